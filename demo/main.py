@@ -41,7 +41,7 @@ def success(result: typing.Dict):
             for link in item['next_link']:
                 crawler.add_task('链接爬取任务', {'url': link})
             for link in item['detail_link']:
-                crawler.add_task('详情爬取任务', {'url': link})
+                crawler.add_task('详情爬取任务', {'url': link}, priority=1)
     if result['task_name'] == '详情爬取任务':
         url = result['meta']['url']
         for item in result['items']:
@@ -5,12 +5,14 @@ import uuid
 import click
 import typing
 import os.path as osp
+import yaml
 
 import easycrawler
 from easycrawler import helps
 from easycrawler.logs import logger
 from easycrawler.worker import Worker
-from easycrawler.server import serve
+from easycrawler.worker.worker import DEFAULT_MAX_WORKERS
+from easycrawler.server import serve, serve_async
 
 
 # 处理帮助信息
@@ -89,6 +91,14 @@ def validate_ip(ctx, param, value):
     return value
 
 
+def load_conf(ctx, param, value) -> typing.Dict:
+    """读取 conf.yaml，主节点与工作节点仅使用其中的部分配置"""
+    if value is None:
+        return {}
+    with open(value, encoding='utf-8') as f:
+        return yaml.safe_load(f) or {}
+
+
 def valid_client_id(ctx, param, value) -> str:
     # 定义 Windows 下的非法字符和保留字
     illegal_chars_windows = r'[<>:"/\\|?*]'
@@ -149,17 +159,58 @@ def valid_client_id(ctx, param, value) -> str:
     default=osp.expanduser("~"),
     help='工作路径'
 )
-
+@click.option(
+    '--lease-timeout',
+    type=click.FloatRange(1),
+    default=60,
+    help='任务租约超时时间(秒)，超时未续约的任务重新分发'
+)
+@click.option(
+    '--wal',
+    is_flag=True,
+    default=False,
+    help='将任务队列写入工作路径下的日志，重启后自动恢复'
+)
+@click.option(
+    '--conf',
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    callback=load_conf,
+    help='配置文件路径，读取其中的 compression 配置'
+)
+@click.option(
+    '--async',
+    'use_async',
+    is_flag=True,
+    default=False,
+    help='以 asyncio 模式运行，流式连接不占用线程，适合大量工作节点'
+)
+@click.option(
+    '--metrics-port',
+    type=click.IntRange(1024, 65535),
+    default=None,
+    help='Prometheus 指标端口，开启后通过 http://host:port/metrics 访问'
+)
+@click.option(
+    '--master-id',
+    type=str,
+    default=None,
+    help='主节点标识，客户端按此标识分片，默认为 主机名:端口'
+)
 @click.pass_context
-def master(ctx: click.Context, port: int, max_clients: int, max_cache: int,container_dir:str) -> None:
-    serve(port, max_clients, max_cache, container_dir)
+def master(ctx: click.Context, port: int, max_clients: int, max_cache: int, container_dir: str,
+           lease_timeout: float, wal: bool, conf: typing.Dict, use_async: bool, metrics_port: int,
+           master_id: str) -> None:
+    run = serve_async if use_async else serve
+    run(port, max_clients, max_cache, container_dir, lease_timeout, wal, conf.get('compression'),
+        metrics_port=metrics_port, master_id=master_id)
 
 
 @main.command(name="worker", help="启动工作节点")
 @click.option(
     "--address",
     type=str,
-    help='主节点工作节点连接地址',
+    help='主节点连接地址，多个主节点时以逗号分隔，工作节点连接全部主节点，地址写法与顺序不必与客户端一致',
     default="127.0.0.1:6666",
 )
 @click.option(
@@ -175,11 +226,51 @@ def master(ctx: click.Context, port: int, max_clients: int, max_cache: int,conta
     default=osp.join(osp.expanduser("~"), 'easycrawler', 'worker'),
     help='工作路径'
 )
+@click.option(
+    '--poll',
+    is_flag=True,
+    default=False,
+    help='轮询获取任务，默认通过订阅流接收主节点推送'
+)
+@click.option(
+    '--max-workers',
+    type=int,
+    default=DEFAULT_MAX_WORKERS,
+    help='执行任务的线程数上限'
+)
+@click.option(
+    '--parse-processes',
+    type=int,
+    default=0,
+    help='解析进程数，大于 0 时任务的解析与构建在进程池中执行，默认在执行任务的线程中解析'
+)
+@click.option(
+    '--no-prefetch',
+    is_flag=True,
+    default=False,
+    help='关闭任务预取，只在有空闲槽位时获取任务'
+)
+@click.option(
+    '--conf',
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    callback=load_conf,
+    help='配置文件路径，读取其中的 compression 配置'
+)
 @click.pass_context
-def client(ctx: click.Context, address: str, worker_id: str, worker_dir: str) -> None:
-    worker = Worker(server_address=address, worker_id=worker_id, worker_dir=worker_dir)
+def client(ctx: click.Context, address: str, worker_id: str, worker_dir: str, poll: bool, max_workers: int,
+           parse_processes: int, no_prefetch: bool, conf: typing.Dict) -> None:
+    worker = Worker(server_address=address.split(','), worker_id=worker_id, worker_dir=worker_dir, stream=not poll,
+                    compression=conf.get('compression'), max_workers=max_workers, parse_processes=parse_processes,
+                    prefetch=not no_prefetch)
     worker.start()
-    worker.join()
+    try:
+        while worker.is_alive():
+            worker.join(timeout=1)
+    except KeyboardInterrupt:
+        # 归还预取的任务并等待执行中的任务完成
+        worker.stop()
+        worker.join()
 
 
 if __name__ == "__main__":
@@ -1,5 +1,6 @@
 import importlib.util
 import os
+import queue
 import shutil
 import threading
 import time
@@ -9,25 +10,87 @@ import grpc
 import json
 import os.path as osp
 
-from easycrawler.core import Task
+from easycrawler.core import Task, AsyncTask
 from easycrawler.logs import logger
 from easycrawler.utils.common import retry
 from easycrawler.utils.file_util import get_chunk_size, zip_folder
+from easycrawler.utils.compress_util import Compression, UNIVERSAL_CODECS, available_codecs
+from easycrawler.utils.hash_ring import HashRing, parse_addresses
+from easycrawler.utils.proto_util import meta_to_pb, pb_to_result
 from easycrawler.protos import easycrawler_pb2_grpc, easycrawler_pb2
 
+# 主节点处理任务出错后重发前的等待时间，单位秒
+RESEND_DELAY = 3
+
+# 查询主节点标识的最大尝试次数、单次超时与重试间隔，单位秒，任一主节点不可用时构造客户端失败而不是一直等待
+MASTER_ID_RETRIES = 3
+MASTER_ID_TIMEOUT = 5
+MASTER_ID_RETRY_DELAY = 1
+
 
 class Client(threading.Thread):
-    def __init__(self, server_address: str, client_id: str, runtime_env: typing.Dict):
-        super().__init__()
+    def __init__(self, server_address: typing.Union[str, typing.List[str]], client_id: str, runtime_env: typing.Dict,
+                 batch_size: int = 500, batch_interval: float = 0.02, compression: typing.Dict = None,
+                 max_pending: int = 10000):
+        super().__init__(daemon=True)
         self.client_id: str = client_id
-        self.server_address: str = server_address
+        # 多个主节点时按 client_id 一致性哈希选择，客户端的全部任务、结果与任务包只在该主节点上
+        self.server_address: str = self._select_master(parse_addresses(server_address), client_id)
         self.runtime_env: typing.Dict[str, typing.Any] = runtime_env
-        self.grpc = grpc.insecure_channel(server_address)
+        self.grpc = grpc.insecure_channel(self.server_address)
+        logger.info(f'Client {client_id} => master {self.server_address}')
+        self.running = False
+        # 缓冲待发送的任务，按数量或时间窗口合并后通过 AddMetaBatch 发送，缓冲区满时 put_meta 阻塞
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self._pending: queue.Queue = queue.Queue(maxsize=max_pending)
+        # 服务端授予的提交额度，耗尽后等待服务端任务出队
+        self._credits = 0
+        self._results_call = None
+        # 任务负载压缩配置，对应 conf.yaml 中的 compression 段；
+        # 任务可能下发给任意工作节点，工作节点不声明可解压的算法，只使用所有节点都能解压的算法
+        self.compression = Compression.from_config(compression)
+        if self.compression is not None:
+            self.compression = self.compression.negotiate(UNIVERSAL_CODECS)
         self._package_folder = osp.join(os.getcwd(), client_id)
         os.makedirs(self._package_folder, exist_ok=True)
         self._check_runtime_env_format()
         self._package_runtime_env()
 
+    @staticmethod
+    def _master_id(address: str) -> str:
+        """查询主节点上报的稳定标识，至多尝试 MASTER_ID_RETRIES 次，仍失败时抛出最后一次的异常"""
+        for attempt in range(MASTER_ID_RETRIES):
+            try:
+                with grpc.insecure_channel(address) as channel:
+                    stub = easycrawler_pb2_grpc.EasyCrawlerServiceStub(channel)
+                    result = stub.Stats(easycrawler_pb2.Message(), timeout=MASTER_ID_TIMEOUT)
+                if result.code != easycrawler_pb2.SUCCESS:
+                    raise Exception(result.message)
+                return json.loads(result.message)['master_id']
+            except Exception as e:
+                logger.warning(f'Stats {address} fail (attempt {attempt + 1}) => {e}')
+                if attempt == MASTER_ID_RETRIES - 1:
+                    raise
+                time.sleep(MASTER_ID_RETRY_DELAY)
+
+    @classmethod
+    def _select_master(cls, addresses: typing.List[str], client_id: str) -> str:
+        """
+        哈希环以主节点标识为节点，同一主节点的地址写法不同时仍映射到同一主节点
+
+        分片由全部主节点决定，任一主节点不可用时无法确定客户端所在的主节点，抛出异常
+        """
+        if len(addresses) == 1:
+            return addresses[0]
+        masters = {}
+        for address in addresses:
+            try:
+                masters[cls._master_id(address)] = address
+            except Exception as e:
+                raise Exception(f'主节点 {address} 不可用，无法确定客户端所在的分片 => {e}') from e
+        return masters[HashRing(masters).get(client_id)]
+
     def _check_runtime_env_format(self):
         runtime_env = self.runtime_env.copy()
         # 检查顶级字段
@@ -40,6 +103,14 @@ class Client(threading.Thread):
             raise Exception("'tasks' 字段缺失或类型不正确，应为列表。")
         if len(runtime_env['tasks']) == 0:
             raise Exception('未配置任务')
+        if runtime_env.get('frontier', 'priority') not in ('priority', 'bfs', 'dfs'):
+            raise Exception("'frontier' 字段不正确，应为 priority、bfs 或 dfs。")
+        politeness = runtime_env.get('politeness')
+        if politeness is not None and not isinstance(politeness, dict):
+            raise Exception("'politeness' 字段类型不正确，应为字典。")
+        dedup = runtime_env.get('dedup')
+        if dedup is not None and dedup is not False and not isinstance(dedup, dict):
+            raise Exception("'dedup' 字段类型不正确，应为字典或 False。")
 
     def _package_runtime_env(self) -> None:
         """
@@ -69,7 +140,7 @@ class Client(threading.Thread):
                 # 获取模块中的所有类
                 for item in dir(module):
                     cls = getattr(module, item)
-                    if isinstance(cls, type) and issubclass(cls, Task) and cls is not Task:
+                    if isinstance(cls, type) and issubclass(cls, Task) and cls not in (Task, AsyncTask):
                         task_name = cls.name
                         logger.info(f'发现任务 {task_name}')
                         if not isinstance(cls.max_threads, int) or cls.max_threads <= 0:
@@ -82,6 +153,8 @@ class Client(threading.Thread):
                 raise Exception(f"文件 {task_file} 不存在!")
         self.runtime_env['tasks'] = tasks_info_map
         self.runtime_env['client_id'] = self.client_id
+        # 声明可解压的算法，工作节点据此选择结果的压缩算法
+        self.runtime_env['encodings'] = available_codecs()
         env_cfg_json = osp.join(self._package_folder, 'runtime_env.json')
         with open(env_cfg_json, 'w', encoding='utf-8') as cfg:
             json.dump(self.runtime_env, cfg)
@@ -113,27 +186,166 @@ class Client(threading.Thread):
     def add_meta(self,meta: typing.Dict) -> bool:
         client_task_key = meta['__task__']
         logger.info(f"AddMeta {client_task_key}=> {meta}")
-        data = json.dumps(meta, ensure_ascii=False)
         stub = easycrawler_pb2_grpc.EasyCrawlerServiceStub(self.grpc)
-        result = stub.AddMeta(easycrawler_pb2.Message(data=data))
-        if result.code == easycrawler_pb2.TASK_QUEUE_FULL:
-            time.sleep(3)
-            raise Exception(result.message)
+        while True:
+            result = stub.AddMeta(meta_to_pb(meta, self.compression))
+            if result.code != easycrawler_pb2.TASK_QUEUE_FULL:
+                break
+            self._acquire_credits()
         if result.code == easycrawler_pb2.CLIENT_NOT_FOUND:
             self.push()
             raise Exception('客户端断开连接')
+        self._credits = result.credits
+        if result.code in (easycrawler_pb2.DUPLICATE, easycrawler_pb2.MAYBE_DUPLICATE):
+            # 两种重复都未入队，是主节点的最终结果
+            logger.info(f"AddMeta duplicate => {client_task_key}")
+            return False
+        if result.code != easycrawler_pb2.SUCCESS:
+            raise Exception(result.message)
         logger.info(f"AddTask success!")
         return True
 
-    def get_result(self):
+    @retry(max_retries=-1, delay=3)
+    def _acquire_credits(self, timeout: float = 10):
+        """阻塞直到服务端授予额度"""
         stub = easycrawler_pb2_grpc.EasyCrawlerServiceStub(self.grpc)
-        result = stub.GetResult(easycrawler_pb2.Message(data=self.client_id))
+        data = json.dumps({'client_id': self.client_id, 'timeout': timeout})
+        while True:
+            result = stub.AcquireCredits(easycrawler_pb2.Message(data=data))
+            if result.code == easycrawler_pb2.CLIENT_NOT_FOUND:
+                self.push()
+                continue
+            if result.code != easycrawler_pb2.SUCCESS:
+                raise Exception(result.message)
+            if result.credits > 0:
+                self._credits = result.credits
+                logger.info(f"AcquireCredits => {result.credits}")
+                return
+            logger.warning('任务队列已满，等待额度')
+
+    def put_meta(self, meta: typing.Dict, callback: typing.Callable[[int], None] = None):
+        """缓冲任务，由后台线程批量发送，callback 接收该任务最终的结果码；缓冲区满时阻塞"""
+        self._pending.put((meta, callback))
+
+    def _next_batch(self) -> typing.List[typing.Tuple[typing.Dict, typing.Callable]]:
+        try:
+            batch = [self._pending.get(timeout=1)]
+        except queue.Empty:
+            return []
+        deadline = time.time() + self.batch_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._pending.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    @retry(max_retries=-1, delay=3)
+    def _try_send_batch(self, batch: typing.List[typing.Tuple[typing.Dict, typing.Callable]]) -> typing.List:
+        """发送一批任务，返回被拒绝需要重发的任务"""
+        logger.info(f"AddMetaBatch => {len(batch)}")
+        stub = easycrawler_pb2_grpc.EasyCrawlerServiceStub(self.grpc)
+        result = stub.AddMetaBatch(meta_to_pb(meta, self.compression) for meta, _ in batch)
+        if result.code != easycrawler_pb2.SUCCESS:
+            raise Exception(result.message)
+        rejected = []
+        for item, code in zip(batch, result.codes):
+            meta, callback = item
+            if code == easycrawler_pb2.TASK_QUEUE_FULL:
+                logger.warning(f"AddMeta rejected, task queue is full => {meta}")
+                rejected.append(item)
+            elif code == easycrawler_pb2.CLIENT_NOT_FOUND:
+                rejected.append(item)
+            elif code == easycrawler_pb2.ERROR:
+                # 主节点处理单个任务出错，未入队，与其他被拒绝的任务一起重发
+                logger.warning(f"AddMeta error, resend => {meta}")
+                rejected.append(item)
+            elif callback:
+                callback(code)
+        self._credits = result.credits
+        if easycrawler_pb2.CLIENT_NOT_FOUND in result.codes:
+            self.push()
+        if easycrawler_pb2.ERROR in result.codes:
+            time.sleep(RESEND_DELAY)
+        duplicates = sum(1 for code in result.codes
+                         if code in (easycrawler_pb2.DUPLICATE, easycrawler_pb2.MAYBE_DUPLICATE))
+        logger.info(f"AddMetaBatch {len(batch) - len(rejected) - duplicates}/{len(batch)} success, "
+                    f"{duplicates} duplicate!")
+        return rejected
+
+    def _send_batch(self, batch: typing.List[typing.Tuple[typing.Dict, typing.Callable]]):
+        """按额度分段发送，额度耗尽时等待服务端授予新额度，被拒绝的任务优先重发"""
+        while batch:
+            if self._credits <= 0:
+                self._acquire_credits()
+            n = min(self._credits, len(batch))
+            batch = self._try_send_batch(batch[:n]) + batch[n:]
+
+    def flush(self):
+        """发送缓冲区中的全部任务"""
+        while not self._pending.empty():
+            batch = self._next_batch()
+            if batch:
+                self._send_batch(batch)
+
+    def run(self):
+        self.running = True
+        while self.running:
+            batch = self._next_batch()
+            if batch:
+                self._send_batch(batch)
+
+    def get_result(self) -> typing.Dict:
+        stub = easycrawler_pb2_grpc.EasyCrawlerServiceStub(self.grpc)
+        reply = stub.GetResult(easycrawler_pb2.Message(data=self.client_id))
+        if reply.code != easycrawler_pb2.SUCCESS:
+            raise Exception(reply.message)
+        return pb_to_result(reply.results[0])
+
+    def subscribe_results(self, window: int = 100) -> typing.Iterator[typing.Dict]:
+        """订阅结果流，每处理半个窗口的结果向服务端确认一次"""
+        stub = easycrawler_pb2_grpc.EasyCrawlerServiceStub(self.grpc)
+        data = {'client_id': self.client_id, 'window': window}
+        self._results_call = stub.SubscribeResults(easycrawler_pb2.Message(data=json.dumps(data)))
+        ack_every = max(window // 2, 1)
+        processed = 0
+        try:
+            for reply in self._results_call:
+                if reply.code != easycrawler_pb2.SUCCESS:
+                    raise Exception(reply.message)
+                for result in reply.results:
+                    yield pb_to_result(result)
+                    processed += 1
+                    if processed >= ack_every:
+                        self._ack_results(processed)
+                        processed = 0
+        finally:
+            self._results_call = None
+            if processed > 0:
+                self._ack_results(processed)
+
+    def _ack_results(self, n: int):
+        stub = easycrawler_pb2_grpc.EasyCrawlerServiceStub(self.grpc)
+        data = {'client_id': self.client_id, 'n': n}
+        result = stub.AckResults(easycrawler_pb2.Message(data=json.dumps(data)))
         if result.code != easycrawler_pb2.SUCCESS:
             raise Exception(result.message)
-        return result.message
+
+    def cancel_results(self):
+        """结束结果订阅"""
+        call = self._results_call
+        if call is not None:
+            call.cancel()
 
     @retry(max_retries=-1, delay=3)
     def close(self):
+        self.running = False
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+        self.flush()
         stub = easycrawler_pb2_grpc.EasyCrawlerServiceStub(self.grpc)
         result = stub.DelClient(easycrawler_pb2.Message(data=self.client_id))
         if result.code != easycrawler_pb2.SUCCESS:
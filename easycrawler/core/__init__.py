@@ -11,4 +11,4 @@ Change Log  :
 
 """
 from easycrawler.core.base_storage import Storage
-from easycrawler.core.base_task import Task
+from easycrawler.core.base_task import Task, AsyncTask
@@ -10,6 +10,8 @@
 Change Log  :
 
 """
+import asyncio
+import inspect
 import json
 import time
 import traceback
@@ -30,6 +32,9 @@ class Task:
 
     name = 'common'
 
+    # 工作节点开启解析进程池时，是否在子进程中执行 parse 与 build
+    parse_in_process = True
+
     lx = LxParse()
 
     def _try_request(self, meta: typing.Dict) -> str:
@@ -90,8 +95,8 @@ class Task:
         self.stop()
         return info
 
-    def run(self, meta:typing.Dict):
-        text = self._try_request(meta)
+    def process(self, text: str) -> typing.List[typing.Dict]:
+        """解析响应文本并构建结果"""
         items = self._try_parse(text)
         if not isinstance(items, list):
             items = [items]
@@ -102,20 +107,34 @@ class Task:
                 _items.append(_item)
         return _items
 
-    def exec(self, meta: typing.Dict):
+    def run(self, meta: typing.Dict, processor: typing.Callable[[str], typing.List[typing.Dict]] = None):
+        """processor 不为空时由其代替 process 完成解析，工作节点用于把解析交给进程池"""
+        text = self._try_request(meta)
+        return (processor or self.process)(text)
+
+    def _begin(self, meta: typing.Dict) -> typing.Dict:
+        """从 meta 中取出路由字段，返回结果的公共部分"""
         result = {
             'id': meta['__id__'],
             'client_id': meta['__client_id__'],
             'worker_id': meta['__worker_id__'],
             'task': meta['__task__'],
+            'priority': meta.pop('__priority__', 0),
+            'depth': meta.pop('__depth__', 0),
         }
-        start_time = time.time()
+        meta.pop('__host__', None)
+        meta.pop('__retry__', None)
         del meta['__client_id__']
         del meta['__worker_id__']
         del meta['__id__']
         del meta['__task__']
+        return result
+
+    def exec(self, meta: typing.Dict, processor: typing.Callable[[str], typing.List[typing.Dict]] = None):
+        result = self._begin(meta)
+        start_time = time.time()
         try:
-            items = self.run(meta)
+            items = self.run(meta) if processor is None else self.run(meta, processor)
         except Exception as e:
             result['error'] = str(e)
         else:
@@ -186,3 +205,80 @@ class Task:
 
     def stop(self):
         pass
+
+
+class AsyncTask(Task):
+    """
+    基于 asyncio 的任务
+
+    request 为协程，parse 可以是普通方法或协程。工作节点在进程内唯一的事件循环中执行 AsyncTask，
+    同时执行的任务数只受 max_threads 限制，不占用线程池，request 与 parse 中不能调用阻塞函数。
+    """
+
+    max_threads = 1000
+
+    async def _try_request(self, meta: typing.Dict) -> str:
+        try:
+            return await self.request(meta)
+        except Exception as e:
+            traceback.print_exc()
+            raise Exception(f'请求异常 request => {e}')
+
+    @abstractmethod
+    async def request(self, meta: typing.Dict) -> str:
+        raise NotImplemented
+
+    async def _try_parse(self, text: str) -> typing.Union[typing.List[typing.Dict], typing.Dict]:
+        try:
+            items = self.parse(text)
+            if inspect.isawaitable(items):
+                items = await items
+            return items
+        except Exception as e:
+            traceback.print_exc()
+            raise Exception(f'解析异常 parse => {e}')
+
+    def test(self, meta: typing.Dict):
+        _meta = {
+            '__id__': 'test',
+            '__client_id__': 'test',
+            '__worker_id__': 'test',
+            '__task__': f'{self.name} 测试'
+        }
+        meta.update(_meta)
+        self.init()
+        info = asyncio.run(self.exec(meta))
+        self.stop()
+        return info
+
+    async def process(self, text: str) -> typing.List[typing.Dict]:
+        items = await self._try_parse(text)
+        if not isinstance(items, list):
+            items = [items]
+        _items = []
+        for item in items:
+            _item = self._try_build(item)
+            if _item:
+                _items.append(_item)
+        return _items
+
+    async def run(self, meta: typing.Dict,
+                  processor: typing.Callable[[str], typing.Awaitable[typing.List[typing.Dict]]] = None):
+        text = await self._try_request(meta)
+        return await (processor or self.process)(text)
+
+    async def exec(self, meta: typing.Dict,
+                   processor: typing.Callable[[str], typing.Awaitable[typing.List[typing.Dict]]] = None):
+        result = self._begin(meta)
+        start_time = time.time()
+        try:
+            items = await (self.run(meta) if processor is None else self.run(meta, processor))
+        except Exception as e:
+            result['error'] = str(e)
+        else:
+            result['items'] = items
+        finally:
+            result['start_time'] = start_time
+            result['end_time'] = time.time()
+            result['meta'] = meta
+        return result
@@ -10,6 +10,7 @@
 Change Log  :
 
 """
+import functools
 import json
 import os
 import queue
@@ -25,9 +26,14 @@ from easycrawler.core import Storage
 from easycrawler.exceptions import DLException
 from easycrawler.logs import logger
 import easycrawler.message as message
+from easycrawler.protos import easycrawler_pb2
 from easycrawler.storage import get_storage
 from easycrawler.utils.common import generate_unique_key_from_dict
 from easycrawler.utils.dl_util import download
+from easycrawler.utils.parse_util import extract_host
+
+# 结果订阅断开后重新订阅的最大退避时间 (秒)
+MAX_SUBSCRIBE_BACKOFF = 30
 
 
 class Crawler:
@@ -37,26 +43,50 @@ class Crawler:
 
     def __init__(self):
         self._init_task_num: int = 0
-        self._has_task: bool = False
+        # 后台执行中的回调数，全部结束且没有在途任务时爬虫结束
+        self._bg_tasks: int = 0
+        self._bg_lock = threading.Lock()
         self._pool: typing.Optional[ThreadPoolExecutor] = None
         self._init: typing.Optional[typing.Callable[[], None]] = None
         self._success: typing.Optional[typing.Callable[[typing.Dict], bool]] = None
         self._fail: typing.Optional[typing.Callable[[typing.Dict], bool]] = None
+        # 当前线程正在处理的结果，add_task 据此推算新任务的深度
+        self._context = threading.local()
 
     def _try_handle_success(self, result: typing.Dict):
+        self._context.result = result
         try:
-            self._handle_success(result)
+            if self._success:
+                self._success(result)
         except:
             traceback.print_exc()
             result['ok'] = True
             message.result_queue.append(json.dumps(result, ensure_ascii=False))
+        finally:
+            self._context.result = None
 
     def _handle_fail(self, result: typing.Dict):
-        pass
-
-    def init(self, runtime_env, address='127.0.0.1:7777', thread_num=20):
+        if self._fail:
+            self._fail(result)
+
+    def init(self, runtime_env, address='127.0.0.1:7777', thread_num=20, frontier=None, politeness=None,
+             dedup=None):
+        """
+        frontier 为主节点的任务排序策略: priority | bfs | dfs，默认读取配置，未配置时为 priority
+        politeness 为按域名限速配置，如 {'max_calls': 2, 'period': 1}，默认读取配置，未配置时不限速
+        address 为主节点地址，多个主节点分片时传入列表或以逗号分隔
+        dedup 为主节点去重配置，如 {'capacity': 1000000, 'error_rate': 0.0001, 'exact': True}，
+        默认读取配置，未配置时使用默认参数，为 False 时关闭去重
+        """
         client_id = f'{config.get_config("id")}_{config.get_config("project")}'
-        self.client = Client(address, client_id, runtime_env)
+        runtime_env.setdefault('frontier', frontier or config.get_config('frontier', 'priority'))
+        politeness = politeness or config.get_config('politeness')
+        if politeness:
+            runtime_env.setdefault('politeness', politeness)
+        dedup = config.get_config('dedup') if dedup is None else dedup
+        if dedup is not None:
+            runtime_env.setdefault('dedup', dedup)
+        self.client = Client(address, client_id, runtime_env, compression=config.get_config('compression'))
 
         def decorator(func):
             self._init = func
@@ -65,11 +95,15 @@ class Crawler:
         return decorator
 
     def bg(self, func, *args, **kwargs):
-        self._has_task = True
+        with self._bg_lock:
+            self._bg_tasks += 1
 
         def t():
-            func(*args, **kwargs)
-            self._has_task = False
+            try:
+                func(*args, **kwargs)
+            finally:
+                with self._bg_lock:
+                    self._bg_tasks -= 1
 
         return self._pool.submit(t)
 
@@ -89,23 +123,38 @@ class Crawler:
                 traceback.print_exc()
                 logger.error(e)
 
-    def _add_task(self, name: str, meta: typing.Dict):
+    def _add_task(self, name: str, meta: typing.Dict, priority: int, depth: int):
         task_id = generate_unique_key_from_dict(meta)
-        is_has = message.filter_queue.exists(task_id)
-        if is_has:
-            logger.info(f'meta is existed =>{meta}')
-        else:
-            meta['__id__'] = task_id
-            meta['__client_id__'] = self.client.client_id
-            meta['__task__'] = f'{self.client.client_id}_{name}'
-            self.client.add_meta(name, meta)
-            meta_str = json.dumps(meta)
-            message.cache_queue.set(task_id, meta_str)
-            message.filter_queue.add(task_id)
-
-
-    def add_task(self, name: str, meta: typing.Dict):
-        t = self._pool.submit(self._add_task, name, meta)
+        meta['__id__'] = task_id
+        meta['__client_id__'] = self.client.client_id
+        meta['__task__'] = f'{self.client.client_id}_{name}'
+        meta['__priority__'] = priority
+        meta['__depth__'] = depth
+        meta['__host__'] = extract_host(meta.get('url'))
+        # 是否重复由主节点判断，本地只跳过缓存中尚未完成的任务，写入与检查是同一次原子操作
+        if not message.cache_queue.set_if_absent(task_id, json.dumps(meta)):
+            logger.info(f'meta is pending => {task_id}')
+            return
+        self.client.put_meta(meta, functools.partial(self._on_meta_added, meta))
+
+    def _on_meta_added(self, meta: typing.Dict, code: int):
+        task_id = meta['__id__']
+        if code in (easycrawler_pb2.DUPLICATE, easycrawler_pb2.MAYBE_DUPLICATE):
+            # 主节点的去重结果是最终结果 (如上次运行已提交)，任务未入队，本次提交不会产生结果
+            logger.info(f'meta is existed => {task_id}')
+            message.cache_queue.delete(task_id)
+
+    def add_task(self, name: str, meta: typing.Dict, priority: int = 0, parent: typing.Dict = None):
+        """
+        添加任务
+
+        priority 越大越先分发；parent 为产生该任务的结果，缺省时取当前正在处理的结果，
+        新任务深度为其深度加一，供 bfs/dfs 策略使用
+        """
+        if parent is None:
+            parent = getattr(self._context, 'result', None)
+        depth = parent.get('depth', 0) + 1 if parent else 0
+        t = self._pool.submit(self._add_task, name, meta, priority, depth)
         if self._init_task_num < 10:
             self._init_task_num += 1
             t.result()
@@ -123,7 +172,7 @@ class Crawler:
 
     @property
     def is_down(self):
-        return not self._has_task and message.cache_queue.size() == 0
+        return self._bg_tasks == 0 and message.cache_queue.size() == 0
 
     def export(self, table: str, fields: typing.List = None, dir_path='./'):
         json_file_path = os.path.join(dir_path, f'{self.client.client_id}.json')
@@ -139,54 +188,110 @@ class Crawler:
                     f.write(json.dumps(new_item, ensure_ascii=False) + '\n')
 
 
-    def try_get_result(self):
-        try:
-            result_str = self.client.get_result()
-        except:
-            result_str = message.result_queue.pop()
-        if result_str:
-            result = json.loads(result_str)
-            task_id = result['id']
-            if result.get('error'):
-                meta = result['meta']
-                meta['__id__'] = task_id
-                meta['__task__'] = result['task']
-                message.task_queue.append(json.dumps(meta, ensure_ascii=False))
-                self.background(self._handle_fail, result)
-            else:
-                if result.get('ok'):
-                    self.background(self._try_handle_success, result)
-                elif not message.r_filter_queue.exists(task_id):
-                    message.cache_queue.delete(task_id)
-                    message.r_filter_queue.add(task_id)
-                    self.background(self._try_handle_success, result)
-        if not self.is_down:
-            threading.Timer(0.01, self.try_get_result).start()
+    def _handle_result(self, result: typing.Dict):
+        task_id = result['id']
+        if result.get('error'):
+            meta = result['meta']
+            meta['__id__'] = task_id
+            meta['__client_id__'] = self.client.client_id
+            meta['__task__'] = result['task']
+            meta['__priority__'] = result.get('priority', 0)
+            meta['__depth__'] = result.get('depth', 0)
+            meta['__host__'] = extract_host(meta.get('url'))
+            meta['__retry__'] = True
+            message.task_queue.append(json.dumps(meta, ensure_ascii=False))
+            self.bg(self._handle_fail, result)
+        else:
+            if result.get('ok'):
+                self.bg(self._try_handle_success, result)
+                return
+            # 重复提交的任务可能收到多次结果，缓存总是删除，结果只处理一次
+            message.cache_queue.delete(task_id)
+            if not message.r_filter_queue.exists(task_id):
+                message.r_filter_queue.add(task_id)
+                self.bg(self._try_handle_success, result)
+
+    def _consume_results(self):
+        """
+        单线程消费服务端推送的结果流，断开后按指数退避重新订阅
+
+        订阅正常结束说明主节点上已不存在该客户端 (主节点重启或客户端被删除)，
+        重新上传任务包注册客户端，并重发本地缓存中尚未完成的任务
+        """
+        backoff = 1
+        while not self.is_down:
+            try:
+                for result in self.client.subscribe_results():
+                    backoff = 1
+                    self._handle_result(result)
+                if self.is_down:
+                    break
+                logger.warning(f'结果订阅结束，重新注册客户端 {self.client.client_id}')
+                self.client.push()
+                self._requeue_cached()
+            except Exception as e:
+                if self.is_down:
+                    break
+                logger.warning(f'结果订阅中断 => {e}')
+            time.sleep(backoff)
+            backoff = min(backoff * 2, MAX_SUBSCRIBE_BACKOFF)
+
+    def _requeue_cached(self):
+        """本地缓存中的任务尚未收到结果，标记为重试后重新发送，重试任务不经过主节点去重"""
+        for meta_str in message.cache_queue.values():
+            meta = json.loads(meta_str)
+            meta['__retry__'] = True
+            message.task_queue.append(json.dumps(meta, ensure_ascii=False))
+
+    def try_add_meta(self):
+        """发送本地任务队列中待重发的任务，直到队列为空"""
+        meta_str = message.task_queue.pop()
+        while meta_str:
+            meta = json.loads(meta_str)
+            self.client.put_meta(meta, functools.partial(self._on_meta_added, meta))
+            meta_str = message.task_queue.pop()
+
+    def _resend_tasks(self):
+        """单线程持续发送本地任务队列中待重发的任务，队列为空时等待后再检查，爬虫结束后退出"""
+        while not self.is_down:
+            try:
+                self.try_add_meta()
+            except Exception as e:
+                logger.warning(f'重发任务失败 => {e}')
+            time.sleep(1)
 
     def _init_tasks(self):
+        # 先重发上次运行未完成的任务，init 中添加的任务在缓存中已有时不再重复发送
+        self._requeue_cached()
         if self._init:
             self._init()
-        for meta_str in message.cache_queue.values():
-
-            message.task_queue.append(meta_str)
 
     def run(self):
         self.db = get_storage(config.get_config('storage'))
         self.client.start()
-
-
-        self.client.push(os.getcwd())
+        self.client.push()
 
         try:
-            threading.Timer(0.01, self.try_add_meta).start()
-            threading.Timer(0.01, self.try_get_result).start()
+            self._init_tasks()
+            sender = threading.Thread(target=self._resend_tasks, daemon=True)
+            sender.start()
+            consumer = threading.Thread(target=self._consume_results, daemon=True)
+            consumer.start()
             while not self.is_down:
-                time.sleep(1)
+                # 重新处理本地暂存的结果
+                result_str = message.result_queue.pop()
+                if result_str:
+                    self._handle_result(json.loads(result_str))
+                else:
+                    time.sleep(1)
+            self.client.cancel_results()
+            consumer.join()
+            sender.join()
         except Exception as e:
             logger.error(e)
             traceback.print_exc()
         finally:
-            self.pool.shutdown(wait=True)
+            self._pool.shutdown(wait=True)
             self.client.close()
             logger.warning(f'客户端{self.client.client_id}关闭')
 
@@ -26,22 +26,52 @@ class EasyCrawlerServiceStub(object):
                 )
         self.AddMeta = channel.unary_unary(
                 '/easycrawler.EasyCrawlerService/AddMeta',
-                request_serializer=easycrawler__pb2.Message.SerializeToString,
+                request_serializer=easycrawler__pb2.Meta.SerializeToString,
+                response_deserializer=easycrawler__pb2.Result.FromString,
+                )
+        self.AddMetaBatch = channel.stream_unary(
+                '/easycrawler.EasyCrawlerService/AddMetaBatch',
+                request_serializer=easycrawler__pb2.Meta.SerializeToString,
                 response_deserializer=easycrawler__pb2.Result.FromString,
                 )
         self.GetMeta = channel.unary_unary(
                 '/easycrawler.EasyCrawlerService/GetMeta',
                 request_serializer=easycrawler__pb2.Message.SerializeToString,
-                response_deserializer=easycrawler__pb2.Result.FromString,
+                response_deserializer=easycrawler__pb2.MetaReply.FromString,
+                )
+        self.GetMetaBatch = channel.unary_unary(
+                '/easycrawler.EasyCrawlerService/GetMetaBatch',
+                request_serializer=easycrawler__pb2.Message.SerializeToString,
+                response_deserializer=easycrawler__pb2.MetaReply.FromString,
+                )
+        self.Subscribe = channel.stream_stream(
+                '/easycrawler.EasyCrawlerService/Subscribe',
+                request_serializer=easycrawler__pb2.Message.SerializeToString,
+                response_deserializer=easycrawler__pb2.MetaReply.FromString,
                 )
         self.OnResult = channel.unary_unary(
                 '/easycrawler.EasyCrawlerService/OnResult',
-                request_serializer=easycrawler__pb2.Message.SerializeToString,
+                request_serializer=easycrawler__pb2.TaskResult.SerializeToString,
+                response_deserializer=easycrawler__pb2.Result.FromString,
+                )
+        self.OnResultBatch = channel.stream_unary(
+                '/easycrawler.EasyCrawlerService/OnResultBatch',
+                request_serializer=easycrawler__pb2.TaskResult.SerializeToString,
                 response_deserializer=easycrawler__pb2.Result.FromString,
                 )
         self.GetResult = channel.unary_unary(
                 '/easycrawler.EasyCrawlerService/GetResult',
                 request_serializer=easycrawler__pb2.Message.SerializeToString,
+                response_deserializer=easycrawler__pb2.ResultReply.FromString,
+                )
+        self.SubscribeResults = channel.unary_stream(
+                '/easycrawler.EasyCrawlerService/SubscribeResults',
+                request_serializer=easycrawler__pb2.Message.SerializeToString,
+                response_deserializer=easycrawler__pb2.ResultReply.FromString,
+                )
+        self.AckResults = channel.unary_unary(
+                '/easycrawler.EasyCrawlerService/AckResults',
+                request_serializer=easycrawler__pb2.Message.SerializeToString,
                 response_deserializer=easycrawler__pb2.Result.FromString,
                 )
         self.DelClient = channel.unary_unary(
@@ -49,6 +79,21 @@ class EasyCrawlerServiceStub(object):
                 request_serializer=easycrawler__pb2.Message.SerializeToString,
                 response_deserializer=easycrawler__pb2.Result.FromString,
                 )
+        self.Heartbeat = channel.unary_unary(
+                '/easycrawler.EasyCrawlerService/Heartbeat',
+                request_serializer=easycrawler__pb2.Message.SerializeToString,
+                response_deserializer=easycrawler__pb2.Result.FromString,
+                )
+        self.AcquireCredits = channel.unary_unary(
+                '/easycrawler.EasyCrawlerService/AcquireCredits',
+                request_serializer=easycrawler__pb2.Message.SerializeToString,
+                response_deserializer=easycrawler__pb2.Result.FromString,
+                )
+        self.Stats = channel.unary_unary(
+                '/easycrawler.EasyCrawlerService/Stats',
+                request_serializer=easycrawler__pb2.Message.SerializeToString,
+                response_deserializer=easycrawler__pb2.Result.FromString,
+                )
 
 
 class EasyCrawlerServiceServicer(object):
@@ -72,30 +117,84 @@ class EasyCrawlerServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def AddMetaBatch(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def GetMeta(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def GetMetaBatch(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def Subscribe(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def OnResult(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def OnResultBatch(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def GetResult(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def SubscribeResults(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def AckResults(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def DelClient(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def Heartbeat(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def AcquireCredits(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def Stats(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_EasyCrawlerServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -111,22 +210,52 @@ def add_EasyCrawlerServiceServicer_to_server(servicer, server):
             ),
             'AddMeta': grpc.unary_unary_rpc_method_handler(
                     servicer.AddMeta,
-                    request_deserializer=easycrawler__pb2.Message.FromString,
+                    request_deserializer=easycrawler__pb2.Meta.FromString,
+                    response_serializer=easycrawler__pb2.Result.SerializeToString,
+            ),
+            'AddMetaBatch': grpc.stream_unary_rpc_method_handler(
+                    servicer.AddMetaBatch,
+                    request_deserializer=easycrawler__pb2.Meta.FromString,
                     response_serializer=easycrawler__pb2.Result.SerializeToString,
             ),
             'GetMeta': grpc.unary_unary_rpc_method_handler(
                     servicer.GetMeta,
                     request_deserializer=easycrawler__pb2.Message.FromString,
-                    response_serializer=easycrawler__pb2.Result.SerializeToString,
+                    response_serializer=easycrawler__pb2.MetaReply.SerializeToString,
+            ),
+            'GetMetaBatch': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetMetaBatch,
+                    request_deserializer=easycrawler__pb2.Message.FromString,
+                    response_serializer=easycrawler__pb2.MetaReply.SerializeToString,
+            ),
+            'Subscribe': grpc.stream_stream_rpc_method_handler(
+                    servicer.Subscribe,
+                    request_deserializer=easycrawler__pb2.Message.FromString,
+                    response_serializer=easycrawler__pb2.MetaReply.SerializeToString,
             ),
             'OnResult': grpc.unary_unary_rpc_method_handler(
                     servicer.OnResult,
-                    request_deserializer=easycrawler__pb2.Message.FromString,
+                    request_deserializer=easycrawler__pb2.TaskResult.FromString,
+                    response_serializer=easycrawler__pb2.Result.SerializeToString,
+            ),
+            'OnResultBatch': grpc.stream_unary_rpc_method_handler(
+                    servicer.OnResultBatch,
+                    request_deserializer=easycrawler__pb2.TaskResult.FromString,
                     response_serializer=easycrawler__pb2.Result.SerializeToString,
             ),
             'GetResult': grpc.unary_unary_rpc_method_handler(
                     servicer.GetResult,
                     request_deserializer=easycrawler__pb2.Message.FromString,
+                    response_serializer=easycrawler__pb2.ResultReply.SerializeToString,
+            ),
+            'SubscribeResults': grpc.unary_stream_rpc_method_handler(
+                    servicer.SubscribeResults,
+                    request_deserializer=easycrawler__pb2.Message.FromString,
+                    response_serializer=easycrawler__pb2.ResultReply.SerializeToString,
+            ),
+            'AckResults': grpc.unary_unary_rpc_method_handler(
+                    servicer.AckResults,
+                    request_deserializer=easycrawler__pb2.Message.FromString,
                     response_serializer=easycrawler__pb2.Result.SerializeToString,
             ),
             'DelClient': grpc.unary_unary_rpc_method_handler(
@@ -134,6 +263,21 @@ def add_EasyCrawlerServiceServicer_to_server(servicer, server):
                     request_deserializer=easycrawler__pb2.Message.FromString,
                     response_serializer=easycrawler__pb2.Result.SerializeToString,
             ),
+            'Heartbeat': grpc.unary_unary_rpc_method_handler(
+                    servicer.Heartbeat,
+                    request_deserializer=easycrawler__pb2.Message.FromString,
+                    response_serializer=easycrawler__pb2.Result.SerializeToString,
+            ),
+            'AcquireCredits': grpc.unary_unary_rpc_method_handler(
+                    servicer.AcquireCredits,
+                    request_deserializer=easycrawler__pb2.Message.FromString,
+                    response_serializer=easycrawler__pb2.Result.SerializeToString,
+            ),
+            'Stats': grpc.unary_unary_rpc_method_handler(
+                    servicer.Stats,
+                    request_deserializer=easycrawler__pb2.Message.FromString,
+                    response_serializer=easycrawler__pb2.Result.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'easycrawler.EasyCrawlerService', rpc_method_handlers)
@@ -190,7 +334,24 @@ class EasyCrawlerService(object):
             timeout=None,
             metadata=None):
         return grpc.experimental.unary_unary(request, target, '/easycrawler.EasyCrawlerService/AddMeta',
-            easycrawler__pb2.Message.SerializeToString,
+            easycrawler__pb2.Meta.SerializeToString,
+            easycrawler__pb2.Result.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def AddMetaBatch(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(request_iterator, target, '/easycrawler.EasyCrawlerService/AddMetaBatch',
+            easycrawler__pb2.Meta.SerializeToString,
             easycrawler__pb2.Result.FromString,
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
@@ -208,7 +369,41 @@ class EasyCrawlerService(object):
             metadata=None):
         return grpc.experimental.unary_unary(request, target, '/easycrawler.EasyCrawlerService/GetMeta',
             easycrawler__pb2.Message.SerializeToString,
-            easycrawler__pb2.Result.FromString,
+            easycrawler__pb2.MetaReply.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def GetMetaBatch(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/easycrawler.EasyCrawlerService/GetMetaBatch',
+            easycrawler__pb2.Message.SerializeToString,
+            easycrawler__pb2.MetaReply.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def Subscribe(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(request_iterator, target, '/easycrawler.EasyCrawlerService/Subscribe',
+            easycrawler__pb2.Message.SerializeToString,
+            easycrawler__pb2.MetaReply.FromString,
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
 
@@ -224,7 +419,24 @@ class EasyCrawlerService(object):
             timeout=None,
             metadata=None):
         return grpc.experimental.unary_unary(request, target, '/easycrawler.EasyCrawlerService/OnResult',
-            easycrawler__pb2.Message.SerializeToString,
+            easycrawler__pb2.TaskResult.SerializeToString,
+            easycrawler__pb2.Result.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def OnResultBatch(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(request_iterator, target, '/easycrawler.EasyCrawlerService/OnResultBatch',
+            easycrawler__pb2.TaskResult.SerializeToString,
             easycrawler__pb2.Result.FromString,
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
@@ -241,6 +453,40 @@ class EasyCrawlerService(object):
             timeout=None,
             metadata=None):
         return grpc.experimental.unary_unary(request, target, '/easycrawler.EasyCrawlerService/GetResult',
+            easycrawler__pb2.Message.SerializeToString,
+            easycrawler__pb2.ResultReply.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def SubscribeResults(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(request, target, '/easycrawler.EasyCrawlerService/SubscribeResults',
+            easycrawler__pb2.Message.SerializeToString,
+            easycrawler__pb2.ResultReply.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def AckResults(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/easycrawler.EasyCrawlerService/AckResults',
             easycrawler__pb2.Message.SerializeToString,
             easycrawler__pb2.Result.FromString,
             options, channel_credentials,
@@ -262,3 +508,54 @@ class EasyCrawlerService(object):
             easycrawler__pb2.Result.FromString,
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def Heartbeat(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/easycrawler.EasyCrawlerService/Heartbeat',
+            easycrawler__pb2.Message.SerializeToString,
+            easycrawler__pb2.Result.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def AcquireCredits(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/easycrawler.EasyCrawlerService/AcquireCredits',
+            easycrawler__pb2.Message.SerializeToString,
+            easycrawler__pb2.Result.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def Stats(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/easycrawler.EasyCrawlerService/Stats',
+            easycrawler__pb2.Message.SerializeToString,
+            easycrawler__pb2.Result.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
@@ -10,4 +10,5 @@
 Change Log  :
 
 """
-from easycrawler.server.server import serve
\ No newline at end of file
+from easycrawler.server.server import serve
+from easycrawler.server.aio_server import serve_async
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 基于 grpc.aio 的主节点
+@Date       : 2024/10/28 20:15
+@Author     : lkkings
+@FileName:  : aio_server.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import asyncio
+import hashlib
+import json
+import os
+import os.path as osp
+import time
+import traceback
+import typing
+from concurrent import futures
+
+import grpc
+
+from easycrawler.logs import logger
+from easycrawler.server.metrics import start_http_server
+from easycrawler.server.route_table import DEFAULT_LEASE_TIMEOUT
+from easycrawler.server.segment_log import OP_ADD
+from easycrawler.server.server import ServiceServicer, Subscription, ResultSubscription, default_master_id
+from easycrawler.protos import easycrawler_pb2_grpc, easycrawler_pb2
+
+
+class Notifier:
+    """
+    事件循环内的广播通知
+
+    所有访问都在事件循环线程内，检查状态与开始等待之间不会插入其他协程，因此不会错过通知。
+    """
+
+    def __init__(self):
+        self._event = asyncio.Event()
+
+    def notify(self):
+        self._event.set()
+        self._event = asyncio.Event()
+
+    async def wait(self, timeout: float):
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class AsyncServiceServicer(ServiceServicer):
+    """
+    协程版主节点
+
+    路由表只在事件循环线程内访问，流式 RPC 不再占用线程，单个主节点可以维持大量工作节点连接。
+    文件读写与日志落盘交给线程池，日志写入使用单线程执行器以保持记录顺序。
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._meta_notifier = Notifier()
+        self._result_notifier = Notifier()
+        self._credit_notifier = Notifier()
+        self._wal_executor = futures.ThreadPoolExecutor(max_workers=1)
+        super().__init__(*args, **kwargs)
+
+    def _start_maintain(self):
+        # 由 serve_async 在事件循环启动后创建 _maintain_async 任务
+        pass
+
+    async def _maintain_async(self, interval: float = 1):
+        """定期回收过期租约与失联工作节点的租约重新分发，并在日志分段过多时压缩日志"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self._requeue_expired()
+                self._expire_workers()
+                self._sample_counters()
+                if self._need_compact():
+                    await loop.run_in_executor(self._wal_executor, self.wal.compact, self._snapshot)
+            except Exception:
+                traceback.print_exc()
+
+    async def _release_hosts_async(self):
+        """按时间轮刻度恢复挂起的域名，并唤醒等待分发的订阅流"""
+        tick = self.route_table.hosts.tick
+        while True:
+            await asyncio.sleep(tick)
+            try:
+                self._release_delayed()
+            except Exception:
+                traceback.print_exc()
+
+    def _log(self, records: typing.List[typing.Tuple[int, bytes]], sync: bool = True):
+        if self.wal is not None and records:
+            asyncio.get_running_loop().run_in_executor(self._wal_executor, self.wal.append, records, False)
+
+    async def _alog(self, records: typing.List[typing.Tuple[int, bytes]], sync: bool = True):
+        if self.wal is None or not records:
+            return
+        loop = asyncio.get_running_loop()
+        seq = await loop.run_in_executor(self._wal_executor, self.wal.append, records, False)
+        if sync:
+            await loop.run_in_executor(None, self.wal.wait_sync, seq)
+
+    def _notify_meta(self):
+        self._meta_notifier.notify()
+
+    def _notify_result(self):
+        self._result_notifier.notify()
+
+    def _notify_credit(self):
+        self._credit_notifier.notify()
+
+    async def Push(self, request_iterator, context):
+        loop = asyncio.get_running_loop()
+        try:
+            client_id = None
+            upload_path = None
+            sha256 = hashlib.sha256()
+            f = None
+            try:
+                async for chunk in request_iterator:
+                    if f is None:
+                        client_id = chunk.client_id
+                        logger.info(f'Push client {client_id}')
+                        upload_path = osp.join(self.package_dir, f'{client_id}.upload')
+                        f = open(upload_path, 'wb')
+                    sha256.update(chunk.data)
+                    await loop.run_in_executor(None, f.write, chunk.data)
+            finally:
+                if f is not None:
+                    f.close()
+            await loop.run_in_executor(None, self._install_package, client_id, upload_path, sha256.hexdigest())
+            logger.info(f'Push success!')
+            return easycrawler_pb2.Result(code=easycrawler_pb2.SUCCESS, message=None)
+        except Exception as e:
+            traceback.print_exc()
+            return easycrawler_pb2.Result(code=easycrawler_pb2.ERROR, message=str(e))
+
+    async def Pull(self, message, context):
+        loop = asyncio.get_running_loop()
+        try:
+            message = json.loads(message.data)
+            client_id = message['client_id']
+            worker_id = message['worker_id']
+            package = self.route_table.package(client_id)
+            if package is None:
+                raise Exception(f'{client_id} 未发现')
+            if package in message.get('cached', []):
+                logger.info(f'Pull worker {worker_id} from client {client_id} hit cache {package}')
+                yield easycrawler_pb2.Chunk(client_id=client_id, sha256=package)
+            else:
+                logger.info(f'Pull worker {worker_id} from client {client_id} => {package}')
+                buffer = await loop.run_in_executor(None, self.package_cache.get, package, self._package_path(package))
+                for chunk in buffer:
+                    yield chunk
+            self.route_table.add_worker(worker_id, client_id, package)
+            logger.info(f'Pull success!')
+        except Exception:
+            traceback.print_exc()
+
+    async def AddMeta(self, meta, context):
+        try:
+            result = self._add_meta(meta)
+            if result.code == easycrawler_pb2.SUCCESS:
+                await self._alog([(OP_ADD, meta.SerializeToString())])
+                self._notify_meta()
+                logger.info('Add Meta success!')
+            result.credits = self._credits(meta.client_id)
+            return result
+        except Exception as e:
+            traceback.print_exc()
+            return easycrawler_pb2.Result(code=easycrawler_pb2.ERROR, message=str(e))
+
+    async def AddMetaBatch(self, request_iterator, context):
+        codes = []
+        client_id = None
+        try:
+            records = []
+            async for meta in request_iterator:
+                client_id = meta.client_id
+                try:
+                    code = self._add_meta(meta).code
+                except Exception as e:
+                    logger.error(f'Add Meta fail! => {e}')
+                    code = easycrawler_pb2.ERROR
+                if code == easycrawler_pb2.SUCCESS and self.wal is not None:
+                    records.append((OP_ADD, meta.SerializeToString()))
+                codes.append(code)
+            accepted = codes.count(easycrawler_pb2.SUCCESS)
+            if accepted > 0:
+                await self._alog(records)
+                self._notify_meta()
+            logger.info(f'Add {accepted}/{len(codes)} Meta success!')
+            return easycrawler_pb2.Result(code=easycrawler_pb2.SUCCESS, message=None, codes=codes,
+                                          credits=self._credits(client_id))
+        except Exception as e:
+            traceback.print_exc()
+            return easycrawler_pb2.Result(code=easycrawler_pb2.ERROR, message=str(e), codes=codes)
+
+    async def GetMeta(self, message, context):
+        return super().GetMeta(message, context)
+
+    async def GetMetaBatch(self, message, context):
+        return super().GetMetaBatch(message, context)
+
+    async def _consume_subscription_async(self, request_iterator, subscription: Subscription):
+        """读取工作节点声明的空闲槽位"""
+        try:
+            async for message in request_iterator:
+                data = json.loads(message.data)
+                self._report(data['worker_id'], data)
+                subscription.worker_id = data['worker_id']
+                subscription.slots += int(data.get('slots', 0))
+                subscription.paused = False
+                self._notify_meta()
+        except Exception as e:
+            logger.warning(f'Subscribe stream closed => {e}')
+        finally:
+            subscription.closed = True
+            self._notify_meta()
+
+    async def Subscribe(self, request_iterator, context):
+        subscription = Subscription()
+        reader = asyncio.ensure_future(self._consume_subscription_async(request_iterator, subscription))
+        try:
+            while not subscription.closed:
+                if subscription.worker_id is None or subscription.paused or subscription.slots <= 0:
+                    await self._meta_notifier.wait(1)
+                    continue
+                worker_id = subscription.worker_id
+                try:
+                    reply = self._check_worker(worker_id)
+                    if reply is not None:
+                        subscription.paused = True
+                        yield reply
+                        continue
+                    metas = self._get_metas(worker_id, subscription.slots)
+                    reply = None if metas else self._check_pending(worker_id)
+                except Exception as e:
+                    traceback.print_exc()
+                    yield easycrawler_pb2.MetaReply(code=easycrawler_pb2.ERROR, message=str(e))
+                    break
+                if reply is not None:
+                    subscription.paused = True
+                    yield reply
+                    continue
+                if not metas:
+                    await self._meta_notifier.wait(1)
+                    continue
+                subscription.slots -= len(metas)
+                logger.info(f'Push {len(metas)} Meta to worker => {worker_id}')
+                yield self._meta_reply(context, worker_id, metas)
+        finally:
+            reader.cancel()
+
+    async def OnResult(self, result, context):
+        return super().OnResult(result, context)
+
+    async def OnResultBatch(self, request_iterator, context):
+        try:
+            results = [result async for result in request_iterator]
+            self._on_results(results)
+            logger.info(f'OnResultBatch {len(results)} success!')
+            return easycrawler_pb2.Result(code=easycrawler_pb2.SUCCESS, message=None)
+        except Exception as e:
+            traceback.print_exc()
+            return easycrawler_pb2.Result(code=easycrawler_pb2.ERROR, message=str(e))
+
+    async def GetResult(self, message, context):
+        return super().GetResult(message, context)
+
+    async def SubscribeResults(self, message, context):
+        data = json.loads(message.data)
+        client_id = data['client_id']
+        subscription = ResultSubscription(max(int(data.get('window', 100)), 1))
+        logger.info(f'SubscribeResults => {client_id}')
+        # 同一客户端仅保留最新的订阅
+        previous = self._result_subscriptions.get(client_id)
+        if previous is not None:
+            previous.closed = True
+        self._result_subscriptions[client_id] = subscription
+        self._notify_result()
+        try:
+            while not subscription.closed and self.route_table.client_is_exist(client_id):
+                space = subscription.window - len(subscription.unacked)
+                if space <= 0:
+                    await self._result_notifier.wait(1)
+                    continue
+                results = []
+                while len(results) < space:
+                    result = self.route_table.get_result(client_id)
+                    if result is None:
+                        break
+                    results.append(result)
+                if not results:
+                    await self._result_notifier.wait(1)
+                    continue
+                subscription.unacked.extend(results)
+                yield self._compress(context,
+                                     easycrawler_pb2.ResultReply(code=easycrawler_pb2.SUCCESS, results=results))
+        finally:
+            if self._result_subscriptions.get(client_id) is subscription:
+                del self._result_subscriptions[client_id]
+            unacked = list(subscription.unacked)
+            subscription.unacked.clear()
+            # 未确认的结果重新入队，等待下一次订阅
+            for result in reversed(unacked):
+                self.route_table.requeue_result(result)
+            if unacked:
+                self._notify_result()
+            logger.info(f'SubscribeResults closed => {client_id}, requeue {len(unacked)} result')
+
+    async def AckResults(self, message, context):
+        try:
+            data = json.loads(message.data)
+            subscription = self._result_subscriptions.get(data['client_id'])
+            if subscription is not None:
+                for _ in range(min(int(data['n']), len(subscription.unacked))):
+                    subscription.unacked.popleft()
+                self._notify_result()
+            return easycrawler_pb2.Result(code=easycrawler_pb2.SUCCESS, message=None)
+        except Exception as e:
+            traceback.print_exc()
+            return easycrawler_pb2.Result(code=easycrawler_pb2.ERROR, message=str(e))
+
+    async def Heartbeat(self, message, context):
+        return super().Heartbeat(message, context)
+
+    async def AcquireCredits(self, message, context):
+        """等待客户端获得额度，至多等待 timeout 秒后返回当前额度"""
+        try:
+            data = json.loads(message.data)
+            client_id = data['client_id']
+            if not self.route_table.client_is_exist(client_id):
+                return easycrawler_pb2.Result(code=easycrawler_pb2.CLIENT_NOT_FOUND, message=f'{client_id} 未发现')
+            deadline = time.time() + float(data.get('timeout', 10))
+            while True:
+                credits = self._credits(client_id)
+                timeout = deadline - time.time()
+                if credits > 0 or timeout <= 0:
+                    break
+                await self._credit_notifier.wait(timeout)
+            return easycrawler_pb2.Result(code=easycrawler_pb2.SUCCESS, message=None, credits=credits)
+        except Exception as e:
+            traceback.print_exc()
+            return easycrawler_pb2.Result(code=easycrawler_pb2.ERROR, message=str(e))
+
+    async def Stats(self, message, context):
+        return super().Stats(message, context)
+
+    async def DelClient(self, message, context):
+        return super().DelClient(message, context)
+
+
+async def _serve_async(port: int, *args, metrics_port: int = None):
+    # 在事件循环内创建，保证通知对象绑定到当前事件循环
+    servicer = AsyncServiceServicer(*args)
+    server = grpc.aio.server()
+    easycrawler_pb2_grpc.add_EasyCrawlerServiceServicer_to_server(servicer, server)
+    if metrics_port:
+        # 指标在独立线程中采集，路由表自身的锁保证一致性
+        start_http_server(metrics_port, servicer._stats)
+    server.add_insecure_port('[::]:{}'.format(port))
+    await server.start()
+    maintain = asyncio.ensure_future(servicer._maintain_async())
+    release_hosts = asyncio.ensure_future(servicer._release_hosts_async())
+    logger.info("Async server started on port {}".format(port))
+    try:
+        await server.wait_for_termination()
+    finally:
+        maintain.cancel()
+        release_hosts.cancel()
+
+
+def serve_async(port: int, max_clients=50, max_task_cache_size=1000, container_dir=osp.expanduser("~"),
+                lease_timeout: float = DEFAULT_LEASE_TIMEOUT, wal: bool = False, compression: typing.Dict = None,
+                metrics_port: int = None, master_id: str = None):
+    container_dir = osp.join(container_dir, 'easycrawler', 'container')
+    os.makedirs(container_dir, exist_ok=True)
+    asyncio.run(_serve_async(port, max_clients, max_task_cache_size, container_dir, lease_timeout, wal, compression,
+                             master_id or default_master_id(port), metrics_port=metrics_port))
+
+
+if __name__ == '__main__':
+    serve_async(8888)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 主节点任务去重
+@Date       : 2024/11/02 16:10
+@Author     : lkkings
+@FileName:  : dedup.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import functools
+import math
+import random
+import typing
+
+# 单层布隆过滤器的默认容量
+DEFAULT_CAPACITY = 1000000
+
+# 默认误判率，关闭精确确认时命中的任务返回 MAYBE_DUPLICATE，按该比例丢弃新任务
+DEFAULT_ERROR_RATE = 0.0001
+
+# 分块布隆过滤器每块的位数，对应一个缓存行
+BLOCK_BITS = 512
+
+# 分块使同一 id 的位集中在一块内，误判率略高于标准布隆过滤器，按该比例多分配位数补偿
+BLOCK_SLACK = 1.3
+
+# 位模式表的大小与段数，一个 id 的 k 个位由三段模式按位或得到
+PATTERN_SIZE = 4096
+PATTERN_PARTS = 3
+
+
+@functools.lru_cache(maxsize=None)
+def _patterns(hash_count: int) -> typing.Tuple[typing.Tuple[int, ...], ...]:
+    """预先生成的位模式表，运行时用查表代替逐位计算"""
+    rnd = random.Random(hash_count)
+    counts = [hash_count // PATTERN_PARTS + (1 if i < hash_count % PATTERN_PARTS else 0)
+              for i in range(PATTERN_PARTS)]
+    return tuple(tuple(sum(1 << bit for bit in rnd.sample(range(BLOCK_BITS), n)) for _ in range(PATTERN_SIZE))
+                 for n in counts)
+
+
+class BloomFilter:
+    """
+    分块布隆过滤器
+
+    每个块为一个 512 位整数，id 的哈希选择块，再由三张位模式表组合出块内的 k 个位，
+    查询与写入都只需一次按位运算。哈希使用进程内的 str 哈希，过滤器不持久化，无需跨进程稳定。
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        bits = -capacity * math.log(error_rate) / (math.log(2) ** 2) * BLOCK_SLACK
+        self.hash_count = max(int(round(-math.log2(error_rate))), PATTERN_PARTS)
+        self._blocks = [0] * max(int(bits) // BLOCK_BITS, 1)
+        self._p0, self._p1, self._p2 = _patterns(self.hash_count)
+        self.count = 0
+
+    def _locate(self, key: str) -> typing.Tuple[int, int]:
+        h = hash(key) & 0xFFFFFFFFFFFFFFFF
+        mask = self._p0[h & 4095] | self._p1[(h >> 12) & 4095] | self._p2[(h >> 24) & 4095]
+        return (h >> 36) % len(self._blocks), mask
+
+    def __contains__(self, key: str) -> bool:
+        index, mask = self._locate(key)
+        return self._blocks[index] & mask == mask
+
+    def add(self, key: str) -> bool:
+        """加入 key，已存在 (可能误判) 时返回 False"""
+        index, mask = self._locate(key)
+        block = self._blocks[index]
+        if block & mask == mask:
+            return False
+        self._blocks[index] = block | mask
+        self.count += 1
+        return True
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._blocks) * BLOCK_BITS // 8
+
+
+class DedupFilter:
+    """
+    单个客户端的任务去重过滤器，对应 runtime_env 中的 dedup 配置:
+
+    dedup:
+      capacity: 1000000   # 单层容量，写满后追加容量翻倍、误判率减半的新层
+      error_rate: 0.0001
+      exact: true         # 默认保存全部任务 id，布隆过滤器命中后再精确确认，不会误判
+
+    布隆层决定绝大多数新任务，只有命中时才查精确层。
+    显式关闭精确层时只用布隆层，节省内存，命中即视为重复，按 error_rate 的比例误丢新任务。
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, error_rate: float = DEFAULT_ERROR_RATE,
+                 exact: bool = True):
+        self.error_rate = error_rate
+        self._tiers: typing.List[BloomFilter] = [BloomFilter(capacity, error_rate / 2)]
+        self._exact: typing.Optional[typing.Set[str]] = set() if exact else None
+
+    @property
+    def exact(self) -> bool:
+        """add 返回 False 时是否确定重复，否则可能是误判"""
+        return self._exact is not None
+
+    @classmethod
+    def from_config(cls, config: typing.Optional[typing.Dict]) -> typing.Optional['DedupFilter']:
+        """未配置时使用默认参数，配置为 false 时关闭去重"""
+        if config is False:
+            return None
+        config = config if isinstance(config, dict) else {}
+        return cls(config.get('capacity', DEFAULT_CAPACITY), config.get('error_rate', DEFAULT_ERROR_RATE),
+                   config.get('exact', True))
+
+    def __contains__(self, key: str) -> bool:
+        if not any(key in tier for tier in self._tiers):
+            return False
+        return self._exact is None or key in self._exact
+
+    def add(self, key: str) -> bool:
+        """加入任务 id，重复 (关闭精确层时为可能重复) 时返回 False"""
+        tier = self._tiers[-1]
+        if tier.count >= tier.capacity:
+            # 可扩展布隆过滤器，各层误判率之和收敛于 error_rate
+            tier = BloomFilter(tier.capacity * 2, self.error_rate / 2 ** (len(self._tiers) + 1))
+            self._tiers.append(tier)
+        # 只有最新一层接收新 id，旧层已写满只需查询
+        seen = any(key in old for old in self._tiers[:-1])
+        if not tier.add(key):
+            seen = True
+        if seen and (self._exact is None or key in self._exact):
+            return False
+        if self._exact is not None:
+            self._exact.add(key)
+        return True
+
+    def stats(self) -> typing.Dict:
+        return {
+            'count': sum(tier.count for tier in self._tiers),
+            'tiers': len(self._tiers),
+            'bytes': sum(tier.nbytes for tier in self._tiers),
+            'exact': self._exact is not None,
+        }
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 主节点运行指标
+@Date       : 2024/10/29 21:05
+@Author     : lkkings
+@FileName:  : metrics.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import bisect
+import threading
+import typing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from easycrawler.logs import logger
+
+# 延迟直方图默认分桶，单位秒
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+
+class Histogram:
+    """固定分桶直方图，调用方负责加锁"""
+
+    def __init__(self, buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # 最后一个桶为 +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> typing.Dict:
+        """返回累计分桶计数"""
+        cumulative = []
+        total = 0
+        for le, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            cumulative.append([le, total])
+        return {'buckets': cumulative, 'sum': self.sum, 'count': self.count}
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _sample(lines: typing.List[str], name: str, value, **labels):
+    if labels:
+        label_str = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+        lines.append(f'{name}{{{label_str}}} {value}')
+    else:
+        lines.append(f'{name} {value}')
+
+
+def render_prometheus(stats: typing.Dict) -> str:
+    """将 Stats 结果转换为 Prometheus 文本格式"""
+    lines = []
+
+    lines.append('# TYPE easycrawler_queue_size gauge')
+    _sample(lines, 'easycrawler_queue_size', stats['queue_size'])
+
+    lines.append('# TYPE easycrawler_client_queue_depth gauge')
+    for client_id, info in stats['clients'].items():
+        _sample(lines, 'easycrawler_client_queue_depth', info['queued'], client=client_id)
+    lines.append('# TYPE easycrawler_client_result_backlog gauge')
+    for client_id, info in stats['clients'].items():
+        _sample(lines, 'easycrawler_client_result_backlog', info['results'] + info.get('unacked', 0),
+                client=client_id)
+
+    lines.append('# TYPE easycrawler_host_delayed gauge')
+    for client_id, info in stats['clients'].items():
+        for host, delayed in info.get('host_delayed', {}).items():
+            _sample(lines, 'easycrawler_host_delayed', delayed, client=client_id, host=host)
+
+    lines.append('# TYPE easycrawler_dedup_filter_bytes gauge')
+    for client_id, info in stats['clients'].items():
+        if info.get('dedup'):
+            _sample(lines, 'easycrawler_dedup_filter_bytes', info['dedup']['bytes'], client=client_id)
+
+    lines.append('# TYPE easycrawler_task_queue_depth gauge')
+    for task_key, info in stats['tasks'].items():
+        _sample(lines, 'easycrawler_task_queue_depth', info['queued'], task=task_key)
+
+    lines.append('# TYPE easycrawler_worker_in_flight gauge')
+    for worker_id, info in stats['workers'].items():
+        for task_key, running in info['tasks'].items():
+            _sample(lines, 'easycrawler_worker_in_flight', running, worker=worker_id, task=task_key)
+
+    # 工作节点心跳上报的资源状态
+    for name, field in (('cpu_percent', 'cpu'), ('rss_bytes', 'rss'), ('free_slots', 'free_slots')):
+        lines.append(f'# TYPE easycrawler_worker_{name} gauge')
+        for worker_id, info in stats['workers'].items():
+            if info.get('status'):
+                _sample(lines, f'easycrawler_worker_{name}', info['status'].get(field, 0), worker=worker_id)
+
+    lines.append('# TYPE easycrawler_ops_total counter')
+    for op, value in stats['counters'].items():
+        _sample(lines, 'easycrawler_ops_total', value, op=op)
+    lines.append('# TYPE easycrawler_ops_rate gauge')
+    for op, value in stats.get('rates', {}).items():
+        _sample(lines, 'easycrawler_ops_rate', f'{value:.3f}', op=op)
+
+    for name, histogram in stats['histograms'].items():
+        metric = f'easycrawler_{name}'
+        lines.append(f'# TYPE {metric} histogram')
+        for le, count in histogram['buckets']:
+            _sample(lines, f'{metric}_bucket', count, le=le)
+        _sample(lines, f'{metric}_sum', histogram['sum'])
+        _sample(lines, f'{metric}_count', histogram['count'])
+    return '\n'.join(lines) + '\n'
+
+
+def start_http_server(port: int, collect: typing.Callable[[], typing.Dict]) -> ThreadingHTTPServer:
+    """在后台线程中提供 /metrics"""
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            try:
+                body = render_prometheus(collect()).encode('utf-8')
+            except Exception as e:
+                logger.error(f'Collect metrics fail! => {e}')
+                self.send_error(500, str(e))
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f'Metrics server started on port {port}')
+    return server
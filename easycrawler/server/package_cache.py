@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 任务包共享缓冲
+@Date       : 2024/10/30 19:40
+@Author     : lkkings
+@FileName:  : package_cache.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import mmap
+import threading
+import typing
+from collections import OrderedDict
+
+from easycrawler.protos import easycrawler_pb2
+
+# Pull 数据块大小，远小于 gRPC 默认 4MB 的消息上限
+PACKAGE_CHUNK_SIZE = 256 * 1024
+
+# 缓存的任务包总大小上限
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class PackageBuffer:
+    """
+    单个任务包的共享缓冲
+
+    任务包只映射一次，数据块在首次被请求时从映射中切出并缓存，
+    同一任务包的并发 Pull 复用同一组 Chunk，不再各自打开文件读取。
+    """
+
+    def __init__(self, package: str, path: str, chunk_size: int = PACKAGE_CHUNK_SIZE):
+        self.package = package
+        self.chunk_size = chunk_size
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self._mm)
+        self._chunks: typing.List[typing.Optional[easycrawler_pb2.Chunk]] = \
+            [None] * ((self.size + chunk_size - 1) // chunk_size)
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def chunk(self, index: int) -> easycrawler_pb2.Chunk:
+        chunk = self._chunks[index]
+        if chunk is None:
+            # 并发构建同一块时结果相同，无需加锁
+            start = index * self.chunk_size
+            chunk = easycrawler_pb2.Chunk(data=self._mm[start:start + self.chunk_size], sha256=self.package)
+            self._chunks[index] = chunk
+        return chunk
+
+    def __iter__(self) -> typing.Iterator[easycrawler_pb2.Chunk]:
+        for index in range(len(self._chunks)):
+            yield self.chunk(index)
+
+
+class PackageCache:
+    """按 sha256 缓存任务包缓冲，超过容量时淘汰最久未使用的任务包"""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._buffers: typing.OrderedDict[str, PackageBuffer] = OrderedDict()
+        self._size = 0
+
+    def get(self, package: str, path: str) -> PackageBuffer:
+        with self._lock:
+            buffer = self._buffers.get(package)
+            if buffer is None:
+                buffer = self._buffers[package] = PackageBuffer(package, path)
+                self._size += buffer.size
+                # 进行中的 Pull 仍持有被淘汰的缓冲，映射在最后一个引用释放后关闭
+                while self._size > self.max_bytes and len(self._buffers) > 1:
+                    _, evicted = self._buffers.popitem(last=False)
+                    self._size -= evicted.size
+            else:
+                self._buffers.move_to_end(package)
+            return buffer
+
+    def evict(self, package: str):
+        """移除已删除任务包的缓冲，进行中的 Pull 仍持有该缓冲直至读完"""
+        with self._lock:
+            buffer = self._buffers.pop(package, None)
+            if buffer is not None:
+                self._size -= buffer.size
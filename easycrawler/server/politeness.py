@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 按域名限速的任务调度
+@Date       : 2024/10/31 20:15
+@Author     : lkkings
+@FileName:  : politeness.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import math
+import time
+import typing
+
+# 时间轮刻度，单位秒
+DEFAULT_TICK = 0.05
+
+# 时间轮槽数，超过一圈的定时项按圈数保留在槽中
+DEFAULT_SLOTS = 512
+
+
+class TokenBucket:
+    """令牌桶，period 秒内最多 max_calls 次，允许 max_calls 次突发"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, max_calls: float, period: float, now: float):
+        self.rate = max_calls / period
+        self.capacity = max(max_calls, 1)
+        self.tokens = self.capacity
+        self.updated = now
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def try_acquire(self, now: float) -> float:
+        """取得令牌返回 0，否则返回距下一个令牌的秒数"""
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class TimerWheel:
+    """
+    单层哈希时间轮
+
+    定时项按到期刻度放入对应槽，推进时只检查经过的槽，
+    调度与推进均与定时项总数无关。
+    """
+
+    def __init__(self, tick: float = DEFAULT_TICK, slots: int = DEFAULT_SLOTS, now: float = None):
+        self.tick = tick
+        self._slots: typing.List[typing.List[typing.Tuple[int, typing.Any]]] = [[] for _ in range(slots)]
+        self._current = int((now or time.time()) / tick)
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def schedule(self, deadline: float, item):
+        t = max(math.ceil(deadline / self.tick), self._current + 1)
+        self._slots[t % len(self._slots)].append((t, item))
+        self._count += 1
+
+    def advance(self, now: float) -> typing.List:
+        """推进到 now，返回全部到期的定时项"""
+        target = int(now / self.tick)
+        expired = []
+        if target <= self._current:
+            return expired
+        if self._count:
+            n = len(self._slots)
+            # 跨越超过一圈时每个槽只需检查一次
+            for t in range(self._current + 1, min(target, self._current + n) + 1):
+                slot = self._slots[t % n]
+                if not slot:
+                    continue
+                keep = []
+                for entry in slot:
+                    if entry[0] <= target:
+                        expired.append(entry[1])
+                    else:
+                        keep.append(entry)
+                self._slots[t % n] = keep
+            self._count -= len(expired)
+        self._current = target
+        return expired
+
+
+class HostScheduler:
+    """
+    按 客户端 => 域名 限速
+
+    客户端在 runtime_env 中配置 politeness:
+
+    politeness:
+      max_calls: 2        # 每个域名 period 秒内最多分发 max_calls 个任务
+      period: 1
+      hosts:              # 可选，按域名覆盖
+        www.example.com: {max_calls: 5, period: 1}
+
+    分发时域名没有令牌则挂起该域名，在时间轮中登记下一个令牌的时间，到期后通知路由表恢复该域名。
+    挂起期间任务留在路由表按域名分组的任务队列中，保持排序，其他域名的任务不受影响。
+    """
+
+    def __init__(self, tick: float = DEFAULT_TICK, now: float = None):
+        # client_id => politeness 配置
+        self._configs: typing.Dict[str, typing.Dict] = {}
+        # (client_id, host) => 令牌桶
+        self._buckets: typing.Dict[typing.Tuple[str, str], TokenBucket] = {}
+        # 等待令牌恢复的 (client_id, host)
+        self._paused: typing.Set[typing.Tuple[str, str]] = set()
+        self._wheel = TimerWheel(tick, now=now)
+
+    @property
+    def tick(self) -> float:
+        return self._wheel.tick
+
+    def __len__(self) -> int:
+        return len(self._paused)
+
+    def configure(self, client_id: str, politeness: typing.Optional[typing.Dict]):
+        if politeness:
+            self._configs[client_id] = politeness
+        else:
+            self._configs.pop(client_id, None)
+        for key in [k for k in self._buckets if k[0] == client_id]:
+            del self._buckets[key]
+
+    def _bucket(self, client_id: str, host: str, now: float) -> typing.Optional[TokenBucket]:
+        key = (client_id, host)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            config = self._configs.get(client_id)
+            if config is None:
+                return None
+            limit = config.get('hosts', {}).get(host, config)
+            if not limit.get('max_calls') or not limit.get('period'):
+                return None
+            bucket = self._buckets[key] = TokenBucket(limit['max_calls'], limit['period'], now)
+        return bucket
+
+    def acquire(self, client_id: str, host: str, now: float) -> float:
+        """为域名取得一个令牌，返回需要等待的秒数，未限速的域名总是返回 0"""
+        if not host:
+            return 0
+        bucket = self._bucket(client_id, host, now)
+        if bucket is None:
+            return 0
+        return bucket.try_acquire(now)
+
+    def pause(self, client_id: str, host: str, wait: float, now: float):
+        """挂起没有令牌的域名，wait 秒后由 release 返回"""
+        key = (client_id, host)
+        if key not in self._paused:
+            self._paused.add(key)
+            self._wheel.schedule(now + wait, key)
+
+    def release(self, now: float) -> typing.List[typing.Tuple[str, str]]:
+        """返回令牌已恢复的 (client_id, host)，恢复后令牌仍不足时由下一次分发重新挂起"""
+        released = []
+        for key in self._wheel.advance(now):
+            if key in self._paused:
+                self._paused.discard(key)
+                released.append(key)
+        return released
+
+    def remove(self, client_id: str):
+        """移除客户端的配置与挂起的域名"""
+        self._configs.pop(client_id, None)
+        for key in [k for k in self._buckets if k[0] == client_id]:
+            del self._buckets[key]
+        self._paused = {key for key in self._paused if key[0] != client_id}
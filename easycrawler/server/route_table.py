@@ -0,0 +1,768 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 主节点任务路由表
+@Date       : 2024/10/19 11:52
+@Author     : lkkings
+@FileName:  : route_table.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import heapq
+import itertools
+import threading
+import time
+import typing
+from collections import OrderedDict, defaultdict, deque
+
+from easycrawler.logs import logger
+from easycrawler.protos import easycrawler_pb2
+from easycrawler.server.dedup import DedupFilter
+from easycrawler.server.metrics import Histogram
+from easycrawler.server.politeness import HostScheduler
+
+# 与 Task.max_threads 的默认值保持一致
+DEFAULT_MAX_THREADS = 10
+
+# 租约默认可见性超时，单位秒
+DEFAULT_LEASE_TIMEOUT = 60
+
+# 工作节点超过该时间没有心跳视为失联，其租约立即回收，单位秒
+DEFAULT_WORKER_TIMEOUT = 30
+
+# 工作节点进程 CPU 使用率达到该值 (百分比，100 为一个核心) 时不再为其预取任务
+DEFAULT_CPU_LIMIT = 90
+
+# 客户端的任务排序策略，对应 runtime_env 中的 frontier 字段
+# priority: 按 priority 从大到小，相同优先级先进先出
+# bfs: 浅层任务优先，同层按 priority
+# dfs: 深层任务优先，同层按 priority，使接近抓取终点的任务先完成
+FRONTIER_PRIORITY = 'priority'
+FRONTIER_BFS = 'bfs'
+FRONTIER_DFS = 'dfs'
+FRONTIER_POLICIES = (FRONTIER_PRIORITY, FRONTIER_BFS, FRONTIER_DFS)
+
+
+# 策略 => 排序键函数，键越小越先分发
+FRONTIER_KEYS: typing.Dict[str, typing.Callable[[easycrawler_pb2.Meta], typing.Tuple[int, ...]]] = {
+    FRONTIER_PRIORITY: lambda meta: (-meta.priority,),
+    FRONTIER_BFS: lambda meta: (meta.depth, -meta.priority),
+    FRONTIER_DFS: lambda meta: (-meta.depth, -meta.priority),
+}
+
+
+class FrontierQueue:
+    """
+    按排序键分桶的任务队列
+
+    每个排序键对应一个先进先出的桶，键本身放在小顶堆中，
+    同一键的入队与出队为 O(1)，只有出现新键或桶被取空时才调整堆，
+    耗时与不同键的数量相关，与排队任务数无关。
+    """
+
+    def __init__(self):
+        self._buckets: typing.Dict[typing.Tuple, typing.Deque] = {}
+        self._keys: typing.List[typing.Tuple] = []
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self):
+        for bucket in self._buckets.values():
+            yield from bucket
+
+    def _new_bucket(self, key: typing.Tuple) -> typing.Deque:
+        bucket = self._buckets[key] = deque()
+        heapq.heappush(self._keys, key)
+        return bucket
+
+    def append(self, key: typing.Tuple, item):
+        bucket = self._buckets.get(key) or self._new_bucket(key)
+        bucket.append(item)
+        self._size += 1
+
+    def appendleft(self, key: typing.Tuple, item):
+        """放回同一键的队首，用于重新入队的任务"""
+        bucket = self._buckets.get(key) or self._new_bucket(key)
+        bucket.appendleft(item)
+        self._size += 1
+
+    def peek_key(self) -> typing.Tuple:
+        return self._keys[0]
+
+    def peek(self):
+        return self._buckets[self._keys[0]][0]
+
+    def popleft(self):
+        key = self._keys[0]
+        bucket = self._buckets[key]
+        item = bucket.popleft()
+        if not bucket:
+            del self._buckets[key]
+            heapq.heappop(self._keys)
+        self._size -= 1
+        return item
+
+
+class HostFrontierQueue:
+    """
+    按域名分组的任务队列
+
+    每个域名的任务放在各自的 FrontierQueue 中，域名按其队首排序键放入小顶堆，出队时取排序键最小的域名。
+    域名没有令牌时挂起，堆中跳过该域名，其任务原地等待并保持排序，令牌恢复后重新参与选择，
+    挂起与恢复只调整堆，不移动任务。堆中的过期项按版本号识别，在到达堆顶时丢弃。
+    """
+
+    def __init__(self):
+        self._hosts: typing.Dict[str, FrontierQueue] = {}
+        # (队首排序键, 版本号, 域名)
+        self._heap: typing.List[typing.Tuple[typing.Tuple, int, str]] = []
+        # host => 堆中有效项的版本号，挂起或为空的域名没有有效项
+        self._versions: typing.Dict[str, int] = {}
+        self._paused: typing.Set[str] = set()
+        self._counter = itertools.count()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self):
+        for queue in self._hosts.values():
+            yield from queue
+
+    def _push(self, host: str):
+        version = self._versions[host] = next(self._counter)
+        heapq.heappush(self._heap, (self._hosts[host].peek_key(), version, host))
+
+    def _add(self, key: typing.Tuple, item, host: str, left: bool):
+        queue = self._hosts.get(host)
+        if queue is None:
+            queue = self._hosts[host] = FrontierQueue()
+            head = None
+        else:
+            head = queue.peek_key()
+        if left:
+            queue.appendleft(key, item)
+        else:
+            queue.append(key, item)
+        self._size += 1
+        # 队首排序键变小时更新堆中的位置
+        if host not in self._paused and (head is None or key < head):
+            self._push(host)
+
+    def append(self, key: typing.Tuple, item, host: str = ''):
+        self._add(key, item, host, False)
+
+    def appendleft(self, key: typing.Tuple, item, host: str = ''):
+        """放回同一键的队首，用于重新入队的任务"""
+        self._add(key, item, host, True)
+
+    def _top(self) -> typing.Optional[str]:
+        heap = self._heap
+        while heap:
+            _, version, host = heap[0]
+            if self._versions.get(host) == version:
+                return host
+            heapq.heappop(heap)
+        return None
+
+    def peek_key(self) -> typing.Optional[typing.Tuple]:
+        """可分发的最小排序键，全部域名都已挂起时返回 None"""
+        return self._heap[0][0] if self._top() is not None else None
+
+    def peek(self):
+        return self._hosts[self._top()].peek()
+
+    def popleft(self):
+        host = self._top()
+        queue = self._hosts[host]
+        item = queue.popleft()
+        self._size -= 1
+        if not queue:
+            heapq.heappop(self._heap)
+            del self._hosts[host]
+            del self._versions[host]
+        elif queue.peek_key() != self._heap[0][0]:
+            # 队首排序键未变时堆顶项仍然有效
+            heapq.heappop(self._heap)
+            self._push(host)
+        return item
+
+    def pause(self, host: str):
+        self._paused.add(host)
+        self._versions.pop(host, None)
+
+    def resume(self, host: str):
+        self._paused.discard(host)
+        if host in self._hosts and host not in self._versions:
+            self._push(host)
+
+    def paused_sizes(self) -> typing.Dict[str, int]:
+        """host => 挂起中的任务数"""
+        return {host: len(self._hosts[host]) for host in self._paused if host in self._hosts}
+
+
+class Lease:
+    """已分发任务的租约"""
+    __slots__ = ('meta', 'worker_id', 'task_key', 'deadline', 'dispatched')
+
+    def __init__(self, meta: easycrawler_pb2.Meta, worker_id: str, deadline: float, dispatched: float):
+        self.meta = meta
+        self.worker_id = worker_id
+        self.task_key = meta.task
+        self.deadline = deadline
+        self.dispatched = dispatched
+
+
+class RouteTable:
+    """
+    任务路由表
+
+    按 客户端 => 任务类型 维护任务队列，队列内按客户端的 frontier 策略排序。
+    任务类型的 max_threads 作为单个工作节点上该类型的在途任务上限，
+    分发时按任务类型轮询决定轮到的客户端，再从该客户端可分发的任务类型中选择排序键最小的队首任务，
+    跳过已达上限或工作节点未加载的任务类型。
+    客户端配置 politeness 时按 Meta.host 限速，任务队列按域名分组，域名没有令牌时在该客户端的全部队列中挂起，
+    任务原地等待，不阻塞其他域名，令牌恢复时由 HostScheduler 通知恢复。
+    入队前按客户端的 DedupFilter 检查任务 id，检查与入队在同一把锁内完成。
+    工作节点上报各任务类型的空闲并发与已加载的任务包，分发时不超过上报的空闲并发，
+    只为工作节点分发其已加载任务包的客户端的任务。工作节点上报的预取深度计入在途任务上限。
+    分发出的任务以租约形式记录，工作节点心跳续约，租约过期或被工作节点归还的任务重新放回队首。
+    工作节点心跳同时上报执行中任务数、CPU 与内存，CPU 满载的工作节点不再预取任务，
+    超过 worker_timeout 没有心跳的工作节点视为失联，其全部租约立即回收。
+    """
+
+    def __init__(self, lease_timeout: float = DEFAULT_LEASE_TIMEOUT, worker_timeout: float = DEFAULT_WORKER_TIMEOUT,
+                 cpu_limit: float = DEFAULT_CPU_LIMIT):
+        self._lock = threading.RLock()
+        self.lease_timeout = lease_timeout
+        self.worker_timeout = worker_timeout
+        self.cpu_limit = cpu_limit
+        # worker_id => 最近一次心跳上报的状态，包括心跳时间 seen
+        self._workers: typing.Dict[str, typing.Dict] = {}
+        # CPU 满载的工作节点
+        self._overloaded: typing.Set[str] = set()
+        # worker_id => {(client_id, meta_id): 租约}
+        self._leases: typing.Dict[str, typing.Dict[typing.Tuple[str, str], Lease]] = defaultdict(dict)
+        # client_id => runtime_env
+        self.clients: typing.Dict[str, typing.Dict] = {}
+        # client_id => frontier 策略
+        self._policies: typing.Dict[str, str] = {}
+        # client_id => 排序键函数
+        self._frontier_keys: typing.Dict[str, typing.Callable] = {}
+        # client_id => 任务去重过滤器，客户端关闭 dedup 时不存在
+        self._filters: typing.Dict[str, DedupFilter] = {}
+        # client_id => 任务包 sha256，内容不变的重复 Push 不会要求工作节点更新
+        self._packages: typing.Dict[str, str] = {}
+        # worker_id => {client_id: 已加载的任务包 sha256}
+        self._worker_clients: typing.Dict[str, typing.Dict[str, str]] = defaultdict(dict)
+        # worker_id => 已关闭但尚未通知的 client_id
+        self.closed_worker_of_client: typing.Dict[str, str] = {}
+        # 按域名限速，记录挂起的域名及其令牌恢复时间
+        self.hosts = HostScheduler()
+        # task_key => 任务队列，元素为 (任务, 入队时间)
+        self._queues: typing.Dict[str, HostFrontierQueue] = {}
+        # 非空任务队列，按轮询顺序排列
+        self._ready: typing.OrderedDict[str, None] = OrderedDict()
+        # task_key => client_id
+        self._task_clients: typing.Dict[str, str] = {}
+        # task_key => 单个工作节点的在途任务上限
+        self._max_threads: typing.Dict[str, int] = {}
+        # worker_id => {task_key: 在途任务数}
+        self._running: typing.Dict[str, typing.Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        # worker_id => {task_key: 工作节点上报的空闲并发，分发后递减}，未上报的工作节点只受 max_threads 限制
+        self._free: typing.Dict[str, typing.Dict[str, int]] = {}
+        # worker_id => {task_key: 预取深度}，在途任务上限为 max_threads 加预取深度
+        self._prefetch: typing.Dict[str, typing.Dict[str, int]] = {}
+        # client_id => 待客户端获取的结果
+        self._results: typing.Dict[str, typing.Deque[easycrawler_pb2.TaskResult]] = {}
+        # client_id => 排队中的任务数
+        self._client_sizes: typing.Dict[str, int] = defaultdict(int)
+        self._size = 0
+        # 运行指标
+        self.counters: typing.Dict[str, int] = {'add_meta': 0, 'dispatch': 0, 'result': 0, 'requeue': 0,
+                                                'host_delay': 0, 'duplicate': 0, 'returned': 0, 'dead_worker': 0}
+        # 任务从入队到分发的等待时间
+        self.queue_wait = Histogram()
+        # 任务从分发到收到结果的时间
+        self.result_latency = Histogram()
+
+    @property
+    def all_task_cache_size(self) -> int:
+        return self._size
+
+    def client_is_exist(self, client_id: str) -> bool:
+        return client_id in self.clients
+
+    def client_task_cache_size(self, client_id: str) -> int:
+        return self._client_sizes.get(client_id, 0)
+
+    def add_client(self, runtime_env: typing.Dict, package: str):
+        client_id = runtime_env['client_id']
+        policy = runtime_env.get('frontier') or FRONTIER_PRIORITY
+        if policy not in FRONTIER_POLICIES:
+            logger.warning(f'未知的 frontier 策略 {policy}，使用 {FRONTIER_PRIORITY}')
+            policy = FRONTIER_PRIORITY
+        with self._lock:
+            self.clients[client_id] = runtime_env
+            self._packages[client_id] = package
+            self._results.setdefault(client_id, deque())
+            if self._policies.get(client_id, policy) != policy:
+                self._reorder(client_id, policy)
+            self._policies[client_id] = policy
+            self._frontier_keys[client_id] = FRONTIER_KEYS[policy]
+            self.hosts.configure(client_id, runtime_env.get('politeness'))
+            # 同一客户端重新 Push 时保留已有的过滤器
+            if client_id not in self._filters:
+                dedup = DedupFilter.from_config(runtime_env.get('dedup'))
+                if dedup is not None:
+                    self._filters[client_id] = dedup
+            for name, info in runtime_env.get('tasks', {}).items():
+                task_key = f'{client_id}_{name}'
+                self._task_clients[task_key] = client_id
+                self._max_threads[task_key] = info.get('max_threads', DEFAULT_MAX_THREADS)
+                self._queues.setdefault(task_key, HostFrontierQueue())
+
+    def _reorder(self, client_id: str, policy: str):
+        """客户端更换策略后按新的排序键重建其任务队列"""
+        frontier_key = FRONTIER_KEYS[policy]
+        for task_key in [k for k, c in self._task_clients.items() if c == client_id]:
+            old = self._queues.get(task_key)
+            if not old:
+                continue
+            queue = self._queues[task_key] = HostFrontierQueue()
+            for meta, enqueued in sorted(old, key=lambda item: item[1]):
+                queue.append(frontier_key(meta), (meta, enqueued), meta.host)
+
+    def package(self, client_id: str) -> typing.Optional[str]:
+        return self._packages.get(client_id)
+
+    def package_in_use(self, package: str) -> bool:
+        """是否仍有客户端使用该任务包"""
+        with self._lock:
+            return package in self._packages.values()
+
+    def add_worker(self, worker_id: str, client_id: str, package: str):
+        """记录工作节点已加载的任务包"""
+        with self._lock:
+            if client_id in self._packages:
+                self._worker_clients[worker_id][client_id] = package
+
+    def report(self, worker_id: str, capacity: typing.Optional[typing.Dict[str, int]] = None,
+               packages: typing.Optional[typing.Dict[str, str]] = None,
+               prefetch: typing.Optional[typing.Dict[str, int]] = None):
+        """
+        记录工作节点上报的状态
+
+        capacity 为 {task_key: 空闲并发}，packages 为 {client_id: 已加载的任务包 sha256}，
+        已加载最新任务包的客户端直接登记，无需再次 Pull，prefetch 为 {task_key: 预取深度}
+        """
+        with self._lock:
+            status = self._workers.get(worker_id)
+            if status is not None:
+                # 获取任务等请求同样说明工作节点存活
+                status['seen'] = time.time()
+            if prefetch is not None:
+                self._prefetch[worker_id] = {task_key: max(int(n), 0) for task_key, n in prefetch.items()}
+            if packages:
+                loaded = self._worker_clients[worker_id]
+                for client_id, package in packages.items():
+                    if self._packages.get(client_id) == package:
+                        loaded[client_id] = package
+            if capacity is not None:
+                self._free[worker_id] = {task_key: int(n) for task_key, n in capacity.items()}
+
+    def find_not_upload_clients(self, worker_id: str) -> typing.List[str]:
+        """返回工作节点已加载但任务包已过期的客户端"""
+        with self._lock:
+            loaded = self._worker_clients.get(worker_id, {})
+            return [client_id for client_id, package in loaded.items()
+                    if client_id in self._packages and self._packages[client_id] != package]
+
+    def find_pending_clients(self, worker_id: str) -> typing.List[str]:
+        """返回有排队任务但工作节点尚未加载任务包的客户端"""
+        with self._lock:
+            loaded = self._worker_clients.get(worker_id, {})
+            return [client_id for client_id in self._packages
+                    if client_id not in loaded and self._client_sizes.get(client_id, 0) > 0]
+
+    def add_meta(self, meta: easycrawler_pb2.Meta, replay: bool = False) -> int:
+        """
+        任务入队，返回结果码
+
+        id 确定重复时返回 DUPLICATE，关闭精确去重后布隆过滤器命中时返回 MAYBE_DUPLICATE，两者都不入队且不再重发。
+        meta.retry 为 True 的任务与从日志恢复 (replay) 的任务只记录 id，跳过去重。
+        """
+        task_key = meta.task
+        with self._lock:
+            dedup = self._filters.get(meta.client_id)
+            if dedup is not None and not dedup.add(meta.id) and not meta.retry and not replay:
+                self.counters['duplicate'] += 1
+                return easycrawler_pb2.DUPLICATE if dedup.exact else easycrawler_pb2.MAYBE_DUPLICATE
+            queue = self._queues.get(task_key)
+            if queue is None:
+                queue = self._queues[task_key] = HostFrontierQueue()
+                self._task_clients[task_key] = meta.client_id
+            frontier_key = self._frontier_keys.get(meta.client_id, FRONTIER_KEYS[FRONTIER_PRIORITY])
+            queue.append(frontier_key(meta), (meta, time.time()), meta.host)
+            self._ready[task_key] = None
+            self._client_sizes[meta.client_id] += 1
+            self._size += 1
+            self.counters['add_meta'] += 1
+            return easycrawler_pb2.SUCCESS
+
+    def get_best_meta(self, worker_id: str) -> typing.Optional[easycrawler_pb2.Meta]:
+        """
+        为工作节点选择下一个任务
+
+        按轮询顺序遍历非空队列，跳过工作节点未加载最新任务包的客户端、
+        在途任务数已达 max_threads 以及工作节点上报的空闲并发已用完的任务类型。第一个可分发的队列决定轮到的客户端，
+        再在该客户端可分发的队列中选择队首排序键最小者，不同客户端之间仍按轮询保证公平，
+        耗时与任务类型数相关，与排队任务数无关。
+        队首任务的域名没有令牌时在该客户端的全部队列中挂起该域名并重新选择，任务不出队，
+        每个域名在令牌恢复前只会被挂起一次。
+        相同 id 的任务已在该工作节点上持有租约时丢弃队首任务，避免覆盖租约使在途任务数无法释放。
+        """
+        with self._lock:
+            now = time.time()
+            if len(self.hosts):
+                self._release_delayed(now)
+            loaded = self._worker_clients.get(worker_id, {})
+            running = self._running[worker_id]
+            leases = self._leases[worker_id]
+            free = self._free.get(worker_id)
+            prefetch = {} if worker_id in self._overloaded else self._prefetch.get(worker_id, {})
+            while self._ready:
+                turn = None
+                best = None
+                best_key = None
+                for task_key in self._ready:
+                    client_id = self._task_clients[task_key]
+                    # 只分发工作节点已加载最新任务包的客户端
+                    if loaded.get(client_id) != self._packages.get(client_id):
+                        continue
+                    if turn is not None and client_id != self._task_clients[turn]:
+                        continue
+                    limit = self._max_threads.get(task_key, DEFAULT_MAX_THREADS) + prefetch.get(task_key, 0)
+                    if running[task_key] >= limit:
+                        continue
+                    if free is not None and free.get(task_key, 0) <= 0:
+                        continue
+                    # 全部域名都已挂起的队列没有可分发的任务
+                    head = self._queues[task_key].peek_key()
+                    if head is None:
+                        continue
+                    if turn is None:
+                        turn = best = task_key
+                        best_key = head
+                    elif head < best_key:
+                        best = task_key
+                        best_key = head
+                if best is None:
+                    return None
+                task_key = best
+                queue = self._queues[task_key]
+                meta, enqueued = queue.peek()
+                lease_key = (meta.client_id, meta.id)
+                # 相同 id 的任务仍在该工作节点上执行，不覆盖其租约，结果以执行中的任务为准
+                duplicate = lease_key in leases
+                if not duplicate and meta.host:
+                    wait = self.hosts.acquire(meta.client_id, meta.host, now)
+                    if wait > 0:
+                        self._pause_host(meta.client_id, meta.host, wait, now)
+                        self.counters['host_delay'] += 1
+                        continue
+                queue.popleft()
+                # 本轮的客户端让出位置，避免高优先级队列使其他客户端饥饿
+                self._ready.move_to_end(turn)
+                if queue:
+                    self._ready.move_to_end(task_key)
+                else:
+                    del self._ready[task_key]
+                self._client_sizes[meta.client_id] -= 1
+                self._size -= 1
+                if duplicate:
+                    self.counters['duplicate'] += 1
+                    continue
+                running[task_key] += 1
+                if free is not None:
+                    free[task_key] -= 1
+                leases[lease_key] = Lease(meta, worker_id, now + self.lease_timeout, now)
+                self.counters['dispatch'] += 1
+                self.queue_wait.observe(now - enqueued)
+                return meta
+            return None
+
+    def _client_queues(self, client_id: str) -> typing.Iterator[HostFrontierQueue]:
+        for task_key, owner in self._task_clients.items():
+            if owner == client_id and task_key in self._queues:
+                yield self._queues[task_key]
+
+    def _pause_host(self, client_id: str, host: str, wait: float, now: float):
+        """域名没有令牌，在客户端的全部任务队列中挂起该域名，wait 秒后由 HostScheduler 恢复"""
+        self.hosts.pause(client_id, host, wait, now)
+        for queue in self._client_queues(client_id):
+            queue.pause(host)
+
+    def _release_delayed(self, now: float) -> int:
+        count = 0
+        for client_id, host in self.hosts.release(now):
+            for queue in self._client_queues(client_id):
+                queue.resume(host)
+            count += 1
+        return count
+
+    def release_delayed(self, now: float = None) -> int:
+        """恢复令牌已到期的挂起域名，返回恢复的域名数"""
+        with self._lock:
+            if not len(self.hosts):
+                return 0
+            return self._release_delayed(now or time.time())
+
+    def _release(self, worker_id: str, lease_key: typing.Tuple[str, str]) -> typing.Optional[Lease]:
+        lease = self._leases.get(worker_id, {}).pop(lease_key, None)
+        if lease is not None:
+            running = self._running[worker_id]
+            if running.get(lease.task_key, 0) > 0:
+                running[lease.task_key] -= 1
+        return lease
+
+    def heartbeat(self, worker_id: str, lease_keys: typing.Iterable[typing.Tuple[str, str]],
+                  status: typing.Optional[typing.Dict] = None):
+        """
+        为工作节点仍在执行的任务续约
+
+        status 为工作节点上报的状态，包括 running ({task_key: 执行中任务数})、free_slots、cpu 与 rss
+        """
+        now = time.time()
+        deadline = now + self.lease_timeout
+        with self._lock:
+            if status is not None:
+                self._workers[worker_id] = dict(status, seen=now)
+                if status.get('cpu', 0) >= self.cpu_limit:
+                    self._overloaded.add(worker_id)
+                else:
+                    self._overloaded.discard(worker_id)
+            leases = self._leases.get(worker_id, {})
+            for lease_key in lease_keys:
+                lease = leases.get(tuple(lease_key))
+                if lease is not None:
+                    lease.deadline = deadline
+
+    def _requeue(self, worker_id: str, lease_key: typing.Tuple[str, str], now: float) -> bool:
+        """释放租约并将任务放回所属队列的队首"""
+        lease = self._release(worker_id, lease_key)
+        if lease is None:
+            return False
+        queue = self._queues.get(lease.task_key)
+        if queue is None:
+            # 客户端已移除
+            return False
+        frontier_key = self._frontier_keys.get(lease.meta.client_id, FRONTIER_KEYS[FRONTIER_PRIORITY])
+        queue.appendleft(frontier_key(lease.meta), (lease.meta, now), lease.meta.host)
+        self._ready[lease.task_key] = None
+        self._client_sizes[lease.meta.client_id] += 1
+        self._size += 1
+        return True
+
+    def requeue_expired(self, now: float = None) -> int:
+        """将租约过期的任务放回所属队列的队首，返回重新入队的任务数"""
+        now = now or time.time()
+        count = 0
+        with self._lock:
+            for worker_id, leases in self._leases.items():
+                for lease_key in [k for k, lease in leases.items() if lease.deadline <= now]:
+                    count += self._requeue(worker_id, lease_key, now)
+            self.counters['requeue'] += count
+        return count
+
+    def expire_workers(self, now: float = None) -> typing.List[str]:
+        """回收超过 worker_timeout 没有心跳的工作节点的全部租约，返回失联的工作节点"""
+        now = now or time.time()
+        with self._lock:
+            dead = [worker_id for worker_id, status in self._workers.items()
+                    if status['seen'] + self.worker_timeout <= now]
+            for worker_id in dead:
+                count = 0
+                for lease_key in list(self._leases.get(worker_id, ())):
+                    count += self._requeue(worker_id, lease_key, now)
+                self.counters['requeue'] += count
+                self.counters['dead_worker'] += 1
+                # 工作节点恢复后通过心跳重新上报已加载的任务包与空闲并发
+                for state in (self._workers, self._leases, self._running, self._free, self._prefetch,
+                              self._worker_clients):
+                    state.pop(worker_id, None)
+                self._overloaded.discard(worker_id)
+            return dead
+
+    def give_back(self, worker_id: str, lease_keys: typing.Iterable[typing.Tuple[str, str]]) -> int:
+        """工作节点归还尚未执行的任务，任务立即放回队首，返回放回的任务数"""
+        now = time.time()
+        count = 0
+        with self._lock:
+            for lease_key in lease_keys:
+                count += self._requeue(worker_id, tuple(lease_key), now)
+            self.counters['returned'] += count
+        return count
+
+    def snapshot_metas(self) -> typing.List[easycrawler_pb2.Meta]:
+        """返回全部未完成的任务，包括已分发但未返回结果的任务"""
+        with self._lock:
+            metas = [lease.meta for leases in self._leases.values() for lease in leases.values()]
+            for queue in self._queues.values():
+                metas.extend(meta for meta, _ in queue)
+            return metas
+
+    def update(self, result: easycrawler_pb2.TaskResult):
+        """记录工作节点返回的结果并释放对应的租约"""
+        client_id = result.client_id
+        with self._lock:
+            lease = self._release(result.worker_id, (client_id, result.id))
+            if lease is not None:
+                self.result_latency.observe(time.time() - lease.dispatched)
+            self.counters['result'] += 1
+            results = self._results.get(client_id)
+            if results is not None:
+                results.append(result)
+
+    def requeue_result(self, result: easycrawler_pb2.TaskResult):
+        """未被客户端确认的结果重新放回队首"""
+        with self._lock:
+            results = self._results.get(result.client_id)
+            if results is not None:
+                results.appendleft(result)
+
+    def get_result(self, client_id: str) -> typing.Optional[easycrawler_pb2.TaskResult]:
+        with self._lock:
+            results = self._results.get(client_id)
+            if results:
+                return results.popleft()
+            return None
+
+    def stats(self) -> typing.Dict:
+        """返回队列深度、在途任务、计数与延迟分布"""
+        with self._lock:
+            delayed = defaultdict(dict)
+            for task_key, queue in self._queues.items():
+                client_delayed = delayed[self._task_clients.get(task_key)]
+                for host, n in queue.paused_sizes().items():
+                    client_delayed[host] = client_delayed.get(host, 0) + n
+            now = time.time()
+            # 已心跳但尚未获取任务的工作节点同样列出
+            worker_ids = list(self._running) + [w for w in self._workers if w not in self._running]
+            return {
+                'queue_size': self._size,
+                'clients': {
+                    client_id: {
+                        'frontier': self._policies.get(client_id, FRONTIER_PRIORITY),
+                        'queued': self._client_sizes.get(client_id, 0),
+                        'host_delayed': delayed.get(client_id, {}),
+                        'dedup': self._filters[client_id].stats() if client_id in self._filters else None,
+                        'results': len(self._results.get(client_id, ())),
+                    } for client_id in self.clients
+                },
+                'tasks': {
+                    task_key: {
+                        'client_id': client_id,
+                        'queued': len(self._queues.get(task_key, ())),
+                        'max_threads': self._max_threads.get(task_key, DEFAULT_MAX_THREADS),
+                    } for task_key, client_id in self._task_clients.items()
+                },
+                'workers': {
+                    worker_id: {
+                        'in_flight': len(self._leases.get(worker_id, ())),
+                        'tasks': {task_key: n for task_key, n in self._running.get(worker_id, {}).items() if n > 0},
+                        'free': dict(self._free.get(worker_id, {})),
+                        'prefetch': dict(self._prefetch.get(worker_id, {})),
+                        'packages': dict(self._worker_clients.get(worker_id, {})),
+                        'status': self._worker_status(worker_id, now),
+                    } for worker_id in worker_ids
+                },
+                'counters': dict(self.counters),
+                'histograms': {
+                    'queue_wait_seconds': self.queue_wait.snapshot(),
+                    'result_latency_seconds': self.result_latency.snapshot(),
+                },
+            }
+
+    def _worker_status(self, worker_id: str, now: float) -> typing.Optional[typing.Dict]:
+        status = self._workers.get(worker_id)
+        if status is None:
+            return None
+        status = dict(status, overloaded=worker_id in self._overloaded)
+        status['last_seen'] = round(now - status.pop('seen'), 3)
+        return status
+
+    def remove(self, client_id: str):
+        with self._lock:
+            self.clients.pop(client_id, None)
+            self._policies.pop(client_id, None)
+            self._frontier_keys.pop(client_id, None)
+            self._filters.pop(client_id, None)
+            self.hosts.remove(client_id)
+            self._packages.pop(client_id, None)
+            self._results.pop(client_id, None)
+            self._client_sizes.pop(client_id, None)
+            for worker_id, loaded in self._worker_clients.items():
+                if loaded.pop(client_id, None) is not None:
+                    self.closed_worker_of_client[worker_id] = client_id
+            for task_key in [k for k, c in self._task_clients.items() if c == client_id]:
+                del self._task_clients[task_key]
+                self._max_threads.pop(task_key, None)
+                self._size -= len(self._queues.pop(task_key, ()))
+                self._ready.pop(task_key, None)
+                for running in self._running.values():
+                    running.pop(task_key, None)
+                for free in self._free.values():
+                    free.pop(task_key, None)
+                for prefetch in self._prefetch.values():
+                    prefetch.pop(task_key, None)
+            for leases in self._leases.values():
+                for lease_key in [k for k in leases if k[0] == client_id]:
+                    del leases[lease_key]
+
+
+if __name__ == '__main__':
+    def benchmark(total: int = 1000000, task_num: int = 4, worker_num: int = 8):
+        """在 total 个排队任务下测试入队与分发吞吐"""
+        route_table = RouteTable()
+        client_id = 'bench'
+        route_table.add_client({
+            'client_id': client_id,
+            'tasks': {f'task{i}': {'max_threads': 16, 'module': f'task{i}'} for i in range(task_num)}
+        }, 'bench')
+        workers = [f'worker{i}' for i in range(worker_num)]
+        for worker_id in workers:
+            route_table.add_worker(worker_id, client_id, 'bench')
+        metas = [easycrawler_pb2.Meta(id=str(i), client_id=client_id, task=f'{client_id}_task{i % task_num}')
+                 for i in range(total)]
+
+        start = time.perf_counter()
+        accepted = 0
+        for meta in metas:
+            accepted += route_table.add_meta(meta) == easycrawler_pb2.SUCCESS
+        cost = time.perf_counter() - start
+        print(f'add_meta: {total} metas in {cost:.2f}s => {total / cost:,.0f} ops/sec, '
+              f'{total - accepted} rejected by dedup filter')
+        total = accepted
+
+        # 每次分发后立即回传结果，模拟工作节点在上限内持续消费
+        dispatched = 0
+        start = time.perf_counter()
+        while dispatched < total:
+            for worker_id in workers:
+                meta = route_table.get_best_meta(worker_id)
+                if meta is None:
+                    continue
+                dispatched += 1
+                route_table.update(easycrawler_pb2.TaskResult(id=meta.id, client_id=client_id, worker_id=worker_id,
+                                                              task=meta.task))
+                route_table.get_result(client_id)
+        cost = time.perf_counter() - start
+        print(f'get_best_meta + update: {dispatched} metas in {cost:.2f}s => {dispatched / cost:,.0f} ops/sec')
+
+
+    benchmark()
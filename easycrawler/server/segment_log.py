@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 主节点任务队列的追加写分段日志
+@Date       : 2024/10/26 14:10
+@Author     : lkkings
+@FileName:  : segment_log.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import mmap
+import os
+import os.path as osp
+import struct
+import threading
+import typing
+import zlib
+
+from easycrawler.logs import logger
+
+# 记录头: 负载长度(4) | crc32(4) | 操作类型(1)
+HEADER = struct.Struct('<IIB')
+
+# 新增任务，负载为任务
+OP_ADD = 1
+# 任务完成，负载为任务标识
+OP_DONE = 2
+# 客户端移除，负载为 client_id
+OP_DEL_CLIENT = 3
+
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+
+
+class SegmentLog:
+    """
+    追加写分段日志
+
+    日志由固定大小的分段文件组成，写满后切换到下一个分段。
+    写入方将记录写入缓冲后等待同步线程统一 fsync (组提交)，
+    多个并发写入共享一次 fsync；启动时通过 mmap 顺序回放全部分段。
+    """
+
+    def __init__(self, log_dir: str, segment_size: int = DEFAULT_SEGMENT_SIZE):
+        self.log_dir = log_dir
+        self.segment_size = segment_size
+        os.makedirs(log_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._sync_cond = threading.Condition()
+        # 已写入缓冲与已落盘的记录序号
+        self._written_seq = 0
+        self._synced_seq = 0
+        self._file: typing.Optional[typing.BinaryIO] = None
+        self._offset = 0
+        self._index = max(self.segments(), default=-1) + 1
+        self._open_segment()
+        threading.Thread(target=self._sync_loop, daemon=True).start()
+
+    def segments(self) -> typing.List[int]:
+        """按顺序返回全部分段编号"""
+        return sorted(int(name[:-4]) for name in os.listdir(self.log_dir) if name.endswith('.log'))
+
+    def _segment_path(self, index: int) -> str:
+        return osp.join(self.log_dir, f'{index:010d}.log')
+
+    def _open_segment(self):
+        path = self._segment_path(self._index)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT)
+        # 预分配分段文件，避免追加时频繁更新文件元数据
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(fd, 0, self.segment_size)
+        else:
+            os.truncate(fd, self.segment_size)
+        self._file = os.fdopen(fd, 'r+b')
+        self._offset = 0
+
+    def _rotate(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._index += 1
+        self._open_segment()
+
+    def _write(self, records: typing.Iterable[typing.Tuple[int, bytes]]) -> int:
+        """写入记录并返回其提交序号，调用方需持有写锁"""
+        for op, payload in records:
+            size = HEADER.size + len(payload)
+            if size > self.segment_size:
+                raise ValueError(f'记录过大 => {size}')
+            if self._offset + size > self.segment_size:
+                self._rotate()
+            self._file.write(HEADER.pack(len(payload), zlib.crc32(payload), op))
+            self._file.write(payload)
+            self._offset += size
+        self._file.flush()
+        with self._sync_cond:
+            self._written_seq += 1
+            self._sync_cond.notify_all()
+            return self._written_seq
+
+    def wait_sync(self, seq: int):
+        """等待提交序号 seq 之前的记录落盘"""
+        with self._sync_cond:
+            self._sync_cond.wait_for(lambda: self._synced_seq >= seq)
+
+    def append(self, records: typing.Iterable[typing.Tuple[int, bytes]], sync: bool = True) -> int:
+        """
+        追加记录
+
+        :param records: (操作类型, 负载) 列表
+        :param sync: 是否等待记录落盘
+        :return: 提交序号，可交给 wait_sync 等待落盘
+        """
+        with self._lock:
+            seq = self._write(records)
+        if sync:
+            self.wait_sync(seq)
+        return seq
+
+    def _sync_loop(self):
+        while True:
+            with self._sync_cond:
+                self._sync_cond.wait_for(lambda: self._written_seq > self._synced_seq)
+                seq = self._written_seq
+            # 复制文件描述符后在锁外 fsync，期间的新写入归入下一次提交；
+            # 切换分段时旧分段已同步落盘
+            with self._lock:
+                fd = os.dup(self._file.fileno())
+            try:
+                os.fsync(fd)
+            except OSError as e:
+                logger.error(f'fsync fail! => {e}')
+            finally:
+                os.close(fd)
+            with self._sync_cond:
+                self._synced_seq = max(self._synced_seq, seq)
+                self._sync_cond.notify_all()
+
+    def replay(self) -> typing.Iterator[typing.Tuple[int, bytes]]:
+        """按写入顺序回放全部记录，遇到未写入区域或损坏记录时结束当前分段"""
+        for index in self.segments():
+            path = self._segment_path(index)
+            if osp.getsize(path) == 0:
+                continue
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                offset = 0
+                while offset + HEADER.size <= len(mm):
+                    length, crc, op = HEADER.unpack_from(mm, offset)
+                    if op == 0:
+                        break
+                    start = offset + HEADER.size
+                    payload = mm[start:start + length]
+                    if len(payload) < length or zlib.crc32(payload) != crc:
+                        logger.warning(f'分段 {path} 在 {offset} 处记录损坏，忽略后续内容')
+                        break
+                    yield op, payload
+                    offset = start + length
+
+    def compact(self, snapshot: typing.Callable[[], typing.Iterable[typing.Tuple[int, bytes]]]):
+        """
+        压缩日志
+
+        持有写锁期间生成快照并写入新分段，随后删除此前的全部分段，
+        保证快照之后的记录都排在快照之后。
+        """
+        with self._lock:
+            old_segments = [i for i in self.segments() if i <= self._index]
+            self._rotate()
+            seq = self._write(snapshot())
+        self.wait_sync(seq)
+        for index in old_segments:
+            os.remove(self._segment_path(index))
+        logger.info(f'日志压缩完成，移除 {len(old_segments)} 个分段')
+
+    @property
+    def segment_count(self) -> int:
+        return len(self.segments())
+
+    def close(self):
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
@@ -10,158 +10,714 @@
 Change Log  :
 
 """
+import hashlib
 import json
 import os
 import os.path as osp
+import socket
+import shutil
+import threading
+import time
 import traceback
+import uuid
+
+import typing
+from collections import deque
 
 import grpc
 from concurrent import futures
 
 from easycrawler.logs import logger
-from easycrawler.server.route_table import RouteTable
-from easycrawler.utils.file_util import get_chunk_size, unzip_file
+from easycrawler.server.metrics import start_http_server
+from easycrawler.server.package_cache import PackageCache
+from easycrawler.server.route_table import RouteTable, DEFAULT_LEASE_TIMEOUT
+from easycrawler.server.segment_log import SegmentLog, OP_ADD, OP_DONE, OP_DEL_CLIENT
+from easycrawler.utils.compress_util import Compression
+from easycrawler.utils.file_util import unzip_file
 from easycrawler.protos import easycrawler_pb2_grpc, easycrawler_pb2
 
 
+class Subscription:
+    """工作节点的任务订阅状态"""
+
+    def __init__(self):
+        self.worker_id: typing.Optional[str] = None
+        # 工作节点声明的空闲槽位数
+        self.slots = 0
+        # 推送控制消息后暂停，直到工作节点再次发来消息
+        self.paused = False
+        self.closed = False
+
+
+class ResultSubscription:
+    """客户端的结果订阅状态"""
+
+    def __init__(self, window: int):
+        # 未确认结果数达到窗口大小时暂停推送
+        self.window = window
+        self.unacked: typing.Deque[easycrawler_pb2.TaskResult] = deque()
+        self.closed = False
+
+
 class ServiceServicer(easycrawler_pb2_grpc.EasyCrawlerServiceServicer):
-    route_table = RouteTable()
 
-    def __init__(self, max_clients: int = 50, max_task_cache_size=1000, container_dir=osp.expanduser("~")):
+    # 日志分段数超过该值时压缩日志
+    max_log_segments = 16
+
+    def __init__(self, max_clients: int = 50, max_task_cache_size=1000, container_dir=osp.expanduser("~"),
+                 lease_timeout: float = DEFAULT_LEASE_TIMEOUT, wal: bool = False, compression: typing.Dict = None,
+                 master_id: str = None):
+        # 主节点的稳定标识，客户端以此构建一致性哈希环，与连接时使用的地址写法无关
+        self.master_id = master_id or uuid.uuid4().hex
         self.container_dir = container_dir
+        # 任务包按 sha256 保存，内容相同的任务包只保存一份
+        self.package_dir = osp.join(container_dir, 'packages')
+        os.makedirs(self.package_dir, exist_ok=True)
+        # 并发 Pull 共享同一任务包的内存映射与数据块
+        self.package_cache = PackageCache()
+        # 保存、注册与删除任务包互斥，避免删除刚被其他客户端引用的任务包
+        self._package_lock = threading.Lock()
         self.max_clients = max_clients
         self.max_task_cache_size = max_task_cache_size
+        self.route_table = RouteTable(lease_timeout)
+        # 新任务入队时唤醒订阅流，_meta_seq 用于避免错过通知
+        self._meta_cond = threading.Condition()
+        self._meta_seq = 0
+        # 新结果到达时唤醒结果订阅流
+        self._result_cond = threading.Condition()
+        self._result_seq = 0
+        self._result_subscriptions: typing.Dict[str, ResultSubscription] = {}
+        # 任务出队后唤醒等待额度的客户端
+        self._credit_cond = threading.Condition()
+        # 回复消息的传输层压缩配置，任务负载由客户端与工作节点自行压缩
+        self.compression = Compression.from_config(compression)
+        # 被拒绝的任务数，以及用于计算速率的计数采样 (时间, 计数)
+        self._rejected = 0
+        self._counter_samples: typing.Deque[typing.Tuple[float, typing.Dict[str, int]]] = deque(maxlen=11)
+        # 可选的任务日志，重启后据此重建路由表
+        self.wal: typing.Optional[SegmentLog] = None
+        if wal:
+            self.wal = SegmentLog(osp.join(container_dir, 'wal'))
+            self._recover()
+        self._start_maintain()
+
+    def _start_maintain(self):
+        threading.Thread(target=self._maintain, daemon=True).start()
+        threading.Thread(target=self._release_hosts, daemon=True).start()
+
+    def _release_delayed(self):
+        if self.route_table.release_delayed() > 0:
+            self._notify_meta()
+
+    def _release_hosts(self):
+        """按时间轮刻度恢复挂起的域名，并唤醒等待分发的订阅流"""
+        tick = self.route_table.hosts.tick
+        while True:
+            time.sleep(tick)
+            try:
+                self._release_delayed()
+            except Exception:
+                traceback.print_exc()
+
+    def _requeue_expired(self):
+        count = self.route_table.requeue_expired()
+        if count > 0:
+            logger.warning(f'{count} 个任务租约过期，重新入队')
+            self._notify_meta()
+
+    def _need_compact(self) -> bool:
+        return self.wal is not None and self.wal.segment_count > self.max_log_segments
+
+    def _expire_workers(self):
+        dead = self.route_table.expire_workers()
+        if dead:
+            logger.warning(f'工作节点 {dead} 心跳超时，回收其租约')
+            self._notify_meta()
+
+    def _maintain(self, interval: float = 1):
+        """定期回收过期租约与失联工作节点的租约重新分发，并在日志分段过多时压缩日志"""
+        while True:
+            time.sleep(interval)
+            try:
+                self._requeue_expired()
+                self._expire_workers()
+                self._sample_counters()
+                if self._need_compact():
+                    self.wal.compact(self._snapshot)
+            except Exception:
+                traceback.print_exc()
+
+    def _sample_counters(self):
+        self._counter_samples.append((time.time(), dict(self.route_table.counters, add_meta_rejected=self._rejected)))
+
+    def _stats(self) -> typing.Dict:
+        """汇总路由表指标、最近 10 秒的速率与结果订阅的未确认数"""
+        stats = self.route_table.stats()
+        stats['master_id'] = self.master_id
+        stats['counters']['add_meta_rejected'] = self._rejected
+        samples = list(self._counter_samples)
+        rates = {}
+        if len(samples) >= 2:
+            (start, first), (end, last) = samples[0], samples[-1]
+            rates = {op: (last[op] - first.get(op, 0)) / (end - start) for op in last}
+        stats['rates'] = rates
+        for client_id, subscription in list(self._result_subscriptions.items()):
+            if client_id in stats['clients']:
+                stats['clients'][client_id]['unacked'] = len(subscription.unacked)
+        return stats
+
+    def _snapshot(self) -> typing.List[typing.Tuple[int, bytes]]:
+        return [(OP_ADD, meta.SerializeToString()) for meta in self.route_table.snapshot_metas()]
+
+    def _recover(self):
+        """回放任务日志重建路由表，随后以当前状态压缩日志"""
+        start_time = time.time()
+        # (client_id, meta_id) => (任务, 原始记录)
+        metas: typing.Dict[typing.Tuple[str, str], typing.Tuple[easycrawler_pb2.Meta, bytes]] = {}
+        for op, payload in self.wal.replay():
+            if op == OP_ADD:
+                meta = easycrawler_pb2.Meta.FromString(payload)
+                metas[(meta.client_id, meta.id)] = (meta, payload)
+            elif op == OP_DONE:
+                meta = easycrawler_pb2.Meta.FromString(payload)
+                metas.pop((meta.client_id, meta.id), None)
+            elif op == OP_DEL_CLIENT:
+                client_id = payload.decode()
+                metas = {key: value for key, value in metas.items() if key[0] != client_id}
+        # 重新注册仍有未完成任务的客户端
+        for client_id in {key[0] for key in metas}:
+            env_cfg_json = osp.join(self.container_dir, client_id, 'runtime_env.json')
+            package_file = osp.join(self.container_dir, f'{client_id}.sha256')
+            if osp.exists(env_cfg_json) and osp.exists(package_file):
+                with open(env_cfg_json) as f, open(package_file) as p:
+                    self.route_table.add_client(json.load(f), p.read().strip())
+        records = []
+        for meta, payload in metas.values():
+            if self.route_table.client_is_exist(meta.client_id):
+                self.route_table.add_meta(meta, replay=True)
+                records.append((OP_ADD, payload))
+        # 复用原始记录压缩，无需重新序列化
+        self.wal.compact(lambda: records)
+        logger.info(f'Recover {len(records)} Meta from log in {time.time() - start_time:.2f}s')
+
+    def _log(self, records: typing.List[typing.Tuple[int, bytes]], sync: bool = True):
+        if self.wal is not None and records:
+            self.wal.append(records, sync)
+
+    def _log_done(self, results: typing.List[easycrawler_pb2.TaskResult]):
+        # 完成记录丢失只会导致任务重复执行，无需等待落盘
+        self._log([(OP_DONE, easycrawler_pb2.Meta(id=r.id, client_id=r.client_id).SerializeToString())
+                   for r in results], sync=False)
+
+    def _compress(self, context, reply):
+        """回复超过阈值时由 gRPC 以 gzip 压缩，小消息跳过压缩"""
+        if self.compression is None or context is None:
+            return reply
+        context.set_compression(self.compression.grpc_compression)
+        if reply.ByteSize() < self.compression.min_size:
+            context.disable_next_message_compression()
+        return reply
+
+    def _notify_meta(self):
+        with self._meta_cond:
+            self._meta_seq += 1
+            self._meta_cond.notify_all()
+
+    def _notify_credit(self):
+        with self._credit_cond:
+            self._credit_cond.notify_all()
+
+    def _credits(self, client_id: str) -> int:
+        """
+        客户端可继续提交的任务数
+
+        任务缓存按客户端数均分，额度为客户端份额减去其排队任务数，且不超过全局剩余容量。
+        """
+        route_table = self.route_table
+        share = self.max_task_cache_size // max(len(route_table.clients), 1)
+        free = self.max_task_cache_size - route_table.all_task_cache_size
+        return max(min(share - route_table.client_task_cache_size(client_id), free), 0)
+
+    def _notify_result(self):
+        with self._result_cond:
+            self._result_seq += 1
+            self._result_cond.notify_all()
 
     def Push(self, request_iterator, context):
         try:
             first_chunk = next(request_iterator)
             client_id = first_chunk.client_id
             logger.info(f'Push client {client_id}')
-            container_dir = osp.join(self.container_dir, client_id)
-            zip_file_path = f'{container_dir}.zip'
-            with open(zip_file_path, "wb") as f:
+            upload_path = osp.join(self.package_dir, f'{client_id}.upload')
+            sha256 = hashlib.sha256(first_chunk.data)
+            with open(upload_path, "wb") as f:
                 f.write(first_chunk.data)
                 for chunk in request_iterator:
+                    sha256.update(chunk.data)
                     f.write(chunk.data)
-            unzip_file(zip_file_path, container_dir)
-            with open(osp.join(container_dir, f'runtime_env.json')) as f:
-                runtime_env = json.load(f)
-            self.route_table.add_client(runtime_env)
+            self._install_package(client_id, upload_path, sha256.hexdigest())
             logger.info(f'Push success!')
             return easycrawler_pb2.Result(code=easycrawler_pb2.SUCCESS, message=None)
         except Exception as e:
             traceback.print_exc()
             return easycrawler_pb2.Result(code=easycrawler_pb2.ERROR, message=str(e))
 
+    def _package_path(self, package: str) -> str:
+        return osp.join(self.package_dir, f'{package}.zip')
+
+    def _install_package(self, client_id: str, upload_path: str, package: str):
+        """按 sha256 保存上传的任务包，解压并注册客户端，旧版本任务包不再被引用时删除"""
+        package_path = self._package_path(package)
+        with self._package_lock:
+            old_package = self.route_table.package(client_id)
+            if osp.exists(package_path):
+                os.remove(upload_path)
+            else:
+                os.replace(upload_path, package_path)
+            container_dir = osp.join(self.container_dir, client_id)
+            unzip_file(package_path, container_dir)
+            with open(osp.join(container_dir, f'runtime_env.json')) as f:
+                runtime_env = json.load(f)
+            with open(osp.join(self.container_dir, f'{client_id}.sha256'), 'w') as f:
+                f.write(package)
+            self.route_table.add_client(runtime_env, package)
+            if old_package is not None and old_package != package:
+                self._release_package(old_package)
+        logger.info(f'Package {client_id} => {package}')
+
+    def _release_package(self, package: str):
+        """没有客户端引用的任务包从磁盘与共享缓冲中删除，调用方持有 _package_lock"""
+        if self.route_table.package_in_use(package):
+            return
+        self.package_cache.evict(package)
+        try:
+            os.remove(self._package_path(package))
+            logger.info(f'Remove package {package}')
+        except OSError as e:
+            logger.warning(f'Remove package {package} fail! => {e}')
+
+    def _remove_client_files(self, client_id: str):
+        """删除客户端的任务包记录与解压目录，任务包不再被引用时一并删除"""
+        with self._package_lock:
+            package = self.route_table.package(client_id)
+            self.route_table.remove(client_id)
+            if package is not None:
+                self._release_package(package)
+            package_file = osp.join(self.container_dir, f'{client_id}.sha256')
+            if osp.exists(package_file):
+                os.remove(package_file)
+            shutil.rmtree(osp.join(self.container_dir, client_id), ignore_errors=True)
+
     def Pull(self, message, context):
         try:
             message = json.loads(message.data)
             client_id = message['client_id']
             worker_id = message['worker_id']
-            logger.info(f'Pull worker {worker_id} from client {client_id}')
-            zip_file_path = osp.join(self.container_dir, f'{client_id}.zip')
-            total_size = osp.getsize(zip_file_path)
-            chunk_size = get_chunk_size(total_size)
-            with open(zip_file_path, 'rb') as f:
-                while True:
-                    chunk = f.read(chunk_size)
-                    if not chunk:
-                        break
-                    yield easycrawler_pb2.Chunk(
-                        client_id=client_id,
-                        data=chunk
-                    )
-            self.route_table.add_worker(worker_id, client_id)
+            package = self.route_table.package(client_id)
+            if package is None:
+                raise Exception(f'{client_id} 未发现')
+            if package in message.get('cached', []):
+                # 工作节点已缓存该任务包，只返回 sha256
+                logger.info(f'Pull worker {worker_id} from client {client_id} hit cache {package}')
+                yield easycrawler_pb2.Chunk(client_id=client_id, sha256=package)
+            else:
+                logger.info(f'Pull worker {worker_id} from client {client_id} => {package}')
+                yield from self.package_cache.get(package, self._package_path(package))
+            self.route_table.add_worker(worker_id, client_id, package)
             logger.info(f'Pull success!')
             return easycrawler_pb2.Result(code=easycrawler_pb2.SUCCESS, message=None)
         except Exception as e:
             traceback.print_exc()
             return easycrawler_pb2.Result(code=easycrawler_pb2.ERROR, message=str(e))
 
-    def AddMeta(self, message, context):
+    def _add_meta(self, meta: easycrawler_pb2.Meta) -> easycrawler_pb2.Result:
+        if self.route_table.all_task_cache_size >= self.max_task_cache_size:
+            self._rejected += 1
+            logger.warning('任务队列已满')
+            return easycrawler_pb2.Result(code=easycrawler_pb2.TASK_QUEUE_FULL, message='任务队列已满')
+        client_id = meta.client_id
+        if not self.route_table.client_is_exist(client_id):
+            logger.warning(f'{client_id} 未发现')
+            return easycrawler_pb2.Result(code=easycrawler_pb2.CLIENT_NOT_FOUND, message=f'{client_id} 未发现')
+        logger.info(f'[{self.route_table.all_task_cache_size}] Add Meta {client_id}=>{meta.id} ')
+        code = self.route_table.add_meta(meta)
+        if code != easycrawler_pb2.SUCCESS:
+            logger.info(f'{client_id} 重复任务 => {meta.id}')
+            return easycrawler_pb2.Result(code=code, message=f'重复任务 => {meta.id}')
+        return easycrawler_pb2.Result(code=easycrawler_pb2.SUCCESS, message=None)
+
+    def AddMeta(self, meta, context):
         try:
-            if self.route_table.all_task_cache_size >= self.max_task_cache_size:
-                logger.warning('任务队列已满')
-                return easycrawler_pb2.Result(code=easycrawler_pb2.TASK_QUEUE_FULL, message='任务队列已满')
-            meta = json.loads(message.data)
-            client_id = meta['__client_id__']
-            if not self.route_table.client_is_exist(client_id):
-                logger.warning(f'{client_id} 未发现')
-                return easycrawler_pb2.Result(code=easycrawler_pb2.CLIENT_NOT_FOUND, message=f'{client_id} 未发现')
-            logger.info(f'[{self.route_table.all_task_cache_size}] Add Meta {client_id}=>{meta} ')
-            self.route_table.add_meta(meta)
-            logger.info('Add Meta success!')
-            return easycrawler_pb2.Result(code=easycrawler_pb2.SUCCESS, message=None)
+            result = self._add_meta(meta)
+            if result.code == easycrawler_pb2.SUCCESS:
+                self._log([(OP_ADD, meta.SerializeToString())])
+                self._notify_meta()
+                logger.info('Add Meta success!')
+            result.credits = self._credits(meta.client_id)
+            return result
         except Exception as e:
             traceback.print_exc()
             return easycrawler_pb2.Result(code=easycrawler_pb2.ERROR, message=str(e))
 
+    def AddMetaBatch(self, request_iterator, context):
+        codes = []
+        client_id = None
+        try:
+            records = []
+            for meta in request_iterator:
+                client_id = meta.client_id
+                try:
+                    code = self._add_meta(meta).code
+                except Exception as e:
+                    logger.error(f'Add Meta fail! => {e}')
+                    code = easycrawler_pb2.ERROR
+                if code == easycrawler_pb2.SUCCESS and self.wal is not None:
+                    records.append((OP_ADD, meta.SerializeToString()))
+                codes.append(code)
+            accepted = codes.count(easycrawler_pb2.SUCCESS)
+            if accepted > 0:
+                # 整批记录共享一次落盘
+                self._log(records)
+                self._notify_meta()
+            logger.info(f'Add {accepted}/{len(codes)} Meta success!')
+            return easycrawler_pb2.Result(code=easycrawler_pb2.SUCCESS, message=None, codes=codes,
+                                          credits=self._credits(client_id))
+        except Exception as e:
+            traceback.print_exc()
+            return easycrawler_pb2.Result(code=easycrawler_pb2.ERROR, message=str(e), codes=codes)
+
+    def _check_worker(self, worker_id: str):
+        """检查工作节点状态，客户端关闭或未更新时返回对应结果，否则返回 None"""
+        if worker_id in self.route_table.closed_worker_of_client:
+            client_id = self.route_table.closed_worker_of_client[worker_id]
+            del self.route_table.closed_worker_of_client[worker_id]
+            logger.warning(f'客户端 {client_id} 已经关闭')
+            return easycrawler_pb2.MetaReply(code=easycrawler_pb2.CLIENT_IS_CLOSED, message=client_id)
+        client_ids = self.route_table.find_not_upload_clients(worker_id)
+        if len(client_ids) > 0:
+            logger.warning(f'客户端 {client_ids} 未更新')
+            return easycrawler_pb2.MetaReply(code=easycrawler_pb2.WORKER_NOT_UPDATE, message=','.join(client_ids))
+        return None
+
+    def _check_pending(self, worker_id: str):
+        """
+        工作节点已加载的客户端没有可分发的任务时，通知其拉取有排队任务的客户端的任务包，否则返回 None
+
+        优先把任务分发给已加载任务包的工作节点，只有空闲的工作节点才去拉取新的任务包
+        """
+        client_ids = self.route_table.find_pending_clients(worker_id)
+        if len(client_ids) > 0:
+            logger.info(f'工作节点 {worker_id} 需要加载客户端 {client_ids}')
+            return easycrawler_pb2.MetaReply(code=easycrawler_pb2.WORKER_NOT_UPDATE, message=','.join(client_ids))
+        return None
+
+    def _meta_reply(self, context, worker_id: str, metas: typing.List[easycrawler_pb2.Meta]):
+        """
+        分发任务的回复，message 附带工作节点尚未加载但有排队任务的客户端
+
+        工作节点在执行已分发任务的同时拉取这些任务包，忙于其他客户端的工作节点也能分担新客户端的任务
+        """
+        pending = self.route_table.find_pending_clients(worker_id)
+        return self._compress(context, easycrawler_pb2.MetaReply(code=easycrawler_pb2.SUCCESS, metas=metas,
+                                                                 message=','.join(pending)))
+
+    def _report(self, worker_id: str, data: typing.Dict):
+        """记录工作节点随请求上报的各任务类型空闲并发与已加载的任务包"""
+        if 'capacity' in data or 'packages' in data or 'prefetch' in data:
+            self.route_table.report(worker_id, data.get('capacity'), data.get('packages'), data.get('prefetch'))
+
+    def _get_metas(self, worker_id: str, max_n: int) -> typing.List[easycrawler_pb2.Meta]:
+        metas = []
+        while len(metas) < max_n:
+            meta = self.route_table.get_best_meta(worker_id)
+            if meta is None:
+                break
+            meta.worker_id = worker_id
+            metas.append(meta)
+        if metas:
+            self._notify_credit()
+        return metas
+
     def GetMeta(self, message, context):
         try:
             worker_id = message.data
-            if worker_id in self.route_table.closed_worker_of_client:
-                client_id = self.route_table.closed_worker_of_client[worker_id]
-                del self.route_table.closed_worker_of_client[worker_id]
-                logger.warning(f'客户端 {client_id} 已经关闭')
-                return easycrawler_pb2.Result(code=easycrawler_pb2.CLIENT_IS_CLOSED, message=client_id)
-            client_ids = self.route_table.find_not_upload_clients(worker_id)
-            if len(client_ids) > 0:
-                logger.warning(f'客户端 {client_ids} 未更新')
-                return easycrawler_pb2.Result(code=easycrawler_pb2.WORKER_NOT_UPDATE, message=','.join(client_ids))
+            result = self._check_worker(worker_id)
+            if result is not None:
+                return result
             logger.info(
                 f'Get Meta for worker => {worker_id} current total meta count is {self.route_table.all_task_cache_size}')
-            meta = self.route_table.get_best_meta(worker_id)
-            if meta is None:
-                return easycrawler_pb2.Result(code=easycrawler_pb2.TASK_QUEUE_EMPTY, message='任务队列为空')
-            meta['__worker_id__'] = worker_id
+            metas = self._get_metas(worker_id, 1)
+            if not metas:
+                return self._check_pending(worker_id) or easycrawler_pb2.MetaReply(code=easycrawler_pb2.TASK_QUEUE_EMPTY, message='任务队列为空')
             logger.info(f'Get Meta success!')
-            return easycrawler_pb2.Result(code=easycrawler_pb2.SUCCESS, message=json.dumps(meta))
+            return self._meta_reply(context, worker_id, metas)
         except Exception as e:
             traceback.print_exc()
-            return easycrawler_pb2.Result(code=easycrawler_pb2.ERROR, message=str(e))
+            return easycrawler_pb2.MetaReply(code=easycrawler_pb2.ERROR, message=str(e))
+
+    def GetMetaBatch(self, message, context):
+        try:
+            message = json.loads(message.data)
+            worker_id = message['worker_id']
+            max_n = max(int(message.get('max_n', 1)), 1)
+            self._report(worker_id, message)
+            result = self._check_worker(worker_id)
+            if result is not None:
+                return result
+            logger.info(f'Get {max_n} Meta for worker => {worker_id} '
+                        f'current total meta count is {self.route_table.all_task_cache_size}')
+            metas = self._get_metas(worker_id, max_n)
+            if not metas:
+                return self._check_pending(worker_id) or easycrawler_pb2.MetaReply(code=easycrawler_pb2.TASK_QUEUE_EMPTY, message='任务队列为空')
+            logger.info(f'Get {len(metas)} Meta success!')
+            return self._meta_reply(context, worker_id, metas)
+        except Exception as e:
+            traceback.print_exc()
+            return easycrawler_pb2.MetaReply(code=easycrawler_pb2.ERROR, message=str(e))
+
+    def _consume_subscription(self, request_iterator, subscription: Subscription):
+        """读取工作节点声明的空闲槽位"""
+        try:
+            for message in request_iterator:
+                data = json.loads(message.data)
+                self._report(data['worker_id'], data)
+                with self._meta_cond:
+                    subscription.worker_id = data['worker_id']
+                    subscription.slots += int(data.get('slots', 0))
+                    subscription.paused = False
+                    self._meta_cond.notify_all()
+        except Exception as e:
+            logger.warning(f'Subscribe stream closed => {e}')
+        finally:
+            with self._meta_cond:
+                subscription.closed = True
+                self._meta_cond.notify_all()
+
+    def Subscribe(self, request_iterator, context):
+        subscription = Subscription()
+        threading.Thread(target=self._consume_subscription, args=(request_iterator, subscription),
+                         daemon=True).start()
+        while context.is_active():
+            with self._meta_cond:
+                seq = self._meta_seq
+                if subscription.closed:
+                    break
+                if subscription.worker_id is None or subscription.paused or subscription.slots <= 0:
+                    self._meta_cond.wait(timeout=1)
+                    continue
+                worker_id = subscription.worker_id
+            try:
+                result = self._check_worker(worker_id)
+                if result is not None:
+                    subscription.paused = True
+                    yield result
+                    continue
+                metas = self._get_metas(worker_id, subscription.slots)
+                result = None if metas else self._check_pending(worker_id)
+            except Exception as e:
+                traceback.print_exc()
+                yield easycrawler_pb2.MetaReply(code=easycrawler_pb2.ERROR, message=str(e))
+                break
+            if result is not None:
+                subscription.paused = True
+                yield result
+                continue
+            if not metas:
+                with self._meta_cond:
+                    if self._meta_seq == seq and not subscription.closed:
+                        self._meta_cond.wait(timeout=1)
+                continue
+            with self._meta_cond:
+                subscription.slots -= len(metas)
+            logger.info(f'Push {len(metas)} Meta to worker => {worker_id}')
+            yield self._meta_reply(context, worker_id, metas)
 
-    def OnResult(self, message, context):
+    def _on_results(self, results: typing.List[easycrawler_pb2.TaskResult]):
+        for result in results:
+            self.route_table.update(result)
+        if results:
+            self._log_done(results)
+            self._notify_result()
+            # 租约释放后工作节点的 max_threads 余量增加，唤醒等待分发的订阅流
+            self._notify_meta()
+
+    def OnResult(self, result, context):
         try:
-            logger.info(f'OnResult => {message.data}')
-            self.route_table.update(json.loads(message.data))
+            logger.info(f'OnResult => {result.client_id}:{result.id}')
+            self._on_results([result])
             logger.info('OnResult success!')
             return easycrawler_pb2.Result(code=easycrawler_pb2.SUCCESS, message=None)
         except Exception as e:
             traceback.print_exc()
             return easycrawler_pb2.Result(code=easycrawler_pb2.ERROR, message=str(e))
 
+    def OnResultBatch(self, request_iterator, context):
+        try:
+            results = list(request_iterator)
+            self._on_results(results)
+            logger.info(f'OnResultBatch {len(results)} success!')
+            return easycrawler_pb2.Result(code=easycrawler_pb2.SUCCESS, message=None)
+        except Exception as e:
+            traceback.print_exc()
+            return easycrawler_pb2.Result(code=easycrawler_pb2.ERROR, message=str(e))
+
     def GetResult(self, message, context):
         try:
             client_id = message.data
             logger.info(f'GetResult => {client_id}')
             result = self.route_table.get_result(client_id)
             if result:
-                logger.info(f'GetResult success ! {client_id} => {result}')
-                return easycrawler_pb2.Result(code=easycrawler_pb2.SUCCESS,
-                                              message=json.dumps(result, ensure_ascii=False))
+                logger.info(f'GetResult success ! {client_id} => {result.id}')
+                return self._compress(context,
+                                      easycrawler_pb2.ResultReply(code=easycrawler_pb2.SUCCESS, results=[result]))
             else:
                 logger.warning(f'{client_id} result is empty!')
-                return easycrawler_pb2.Result(code=easycrawler_pb2.CLIENT_RESULT_EMPTY)
+                return easycrawler_pb2.ResultReply(code=easycrawler_pb2.CLIENT_RESULT_EMPTY)
+        except Exception as e:
+            traceback.print_exc()
+            return easycrawler_pb2.ResultReply(code=easycrawler_pb2.ERROR, message=str(e))
+
+    def SubscribeResults(self, message, context):
+        data = json.loads(message.data)
+        client_id = data['client_id']
+        subscription = ResultSubscription(max(int(data.get('window', 100)), 1))
+        logger.info(f'SubscribeResults => {client_id}')
+
+        def on_done():
+            with self._result_cond:
+                subscription.closed = True
+                self._result_cond.notify_all()
+
+        context.add_callback(on_done)
+        with self._result_cond:
+            # 同一客户端仅保留最新的订阅
+            previous = self._result_subscriptions.get(client_id)
+            if previous is not None:
+                previous.closed = True
+            self._result_subscriptions[client_id] = subscription
+            self._result_cond.notify_all()
+        try:
+            while context.is_active() and self.route_table.client_is_exist(client_id):
+                with self._result_cond:
+                    seq = self._result_seq
+                    if subscription.closed:
+                        break
+                    space = subscription.window - len(subscription.unacked)
+                    if space <= 0:
+                        self._result_cond.wait(timeout=1)
+                        continue
+                # 一次推送窗口剩余空间内的全部结果
+                results = []
+                while len(results) < space:
+                    result = self.route_table.get_result(client_id)
+                    if result is None:
+                        break
+                    results.append(result)
+                if not results:
+                    with self._result_cond:
+                        if self._result_seq == seq and not subscription.closed:
+                            self._result_cond.wait(timeout=1)
+                    continue
+                with self._result_cond:
+                    subscription.unacked.extend(results)
+                yield self._compress(context, easycrawler_pb2.ResultReply(code=easycrawler_pb2.SUCCESS, results=results))
+        finally:
+            with self._result_cond:
+                if self._result_subscriptions.get(client_id) is subscription:
+                    del self._result_subscriptions[client_id]
+                unacked = list(subscription.unacked)
+                subscription.unacked.clear()
+            # 未确认的结果重新入队，等待下一次订阅
+            for result in reversed(unacked):
+                self.route_table.requeue_result(result)
+            if unacked:
+                self._notify_result()
+            logger.info(f'SubscribeResults closed => {client_id}, requeue {len(unacked)} result')
+
+    def AckResults(self, message, context):
+        try:
+            data = json.loads(message.data)
+            with self._result_cond:
+                subscription = self._result_subscriptions.get(data['client_id'])
+                if subscription is not None:
+                    for _ in range(min(int(data['n']), len(subscription.unacked))):
+                        subscription.unacked.popleft()
+                    self._result_cond.notify_all()
+            return easycrawler_pb2.Result(code=easycrawler_pb2.SUCCESS, message=None)
+        except Exception as e:
+            traceback.print_exc()
+            return easycrawler_pb2.Result(code=easycrawler_pb2.ERROR, message=str(e))
+
+    def Heartbeat(self, message, context):
+        try:
+            data = json.loads(message.data)
+            self._report(data['worker_id'], data)
+            self.route_table.heartbeat(data['worker_id'], data.get('leases', []), data.get('status'))
+            if data.get('returned'):
+                # 工作节点停止时归还预取但未执行的任务
+                count = self.route_table.give_back(data['worker_id'], data['returned'])
+                logger.info(f'Worker {data["worker_id"]} returned {count} meta')
+                self._notify_meta()
+            return easycrawler_pb2.Result(code=easycrawler_pb2.SUCCESS, message=None)
+        except Exception as e:
+            traceback.print_exc()
+            return easycrawler_pb2.Result(code=easycrawler_pb2.ERROR, message=str(e))
+
+    def AcquireCredits(self, message, context):
+        """等待客户端获得额度，至多等待 timeout 秒后返回当前额度"""
+        try:
+            data = json.loads(message.data)
+            client_id = data['client_id']
+            if not self.route_table.client_is_exist(client_id):
+                return easycrawler_pb2.Result(code=easycrawler_pb2.CLIENT_NOT_FOUND, message=f'{client_id} 未发现')
+            deadline = time.time() + float(data.get('timeout', 10))
+            with self._credit_cond:
+                while True:
+                    credits = self._credits(client_id)
+                    timeout = deadline - time.time()
+                    if credits > 0 or timeout <= 0 or not context.is_active():
+                        break
+                    self._credit_cond.wait(timeout)
+            return easycrawler_pb2.Result(code=easycrawler_pb2.SUCCESS, message=None, credits=credits)
+        except Exception as e:
+            traceback.print_exc()
+            return easycrawler_pb2.Result(code=easycrawler_pb2.ERROR, message=str(e))
+
+    def Stats(self, message, context):
+        try:
+            return easycrawler_pb2.Result(code=easycrawler_pb2.SUCCESS, message=json.dumps(self._stats()))
         except Exception as e:
             traceback.print_exc()
             return easycrawler_pb2.Result(code=easycrawler_pb2.ERROR, message=str(e))
 
     def DelClient(self, message, context):
         try:
-            self.route_table.remove(message.data)
+            self._remove_client_files(message.data)
+            self._log([(OP_DEL_CLIENT, message.data.encode())], sync=False)
+            # 客户端减少后其余客户端的份额增加
+            self._notify_credit()
             return easycrawler_pb2.Result(code=easycrawler_pb2.SUCCESS, message=None)
         except Exception as e:
             traceback.print_exc()
             return easycrawler_pb2.Result(code=easycrawler_pb2.ERROR, message=str(e))
 
 
-def serve(port: int, max_clients=50, max_task_cache_size=1000, container_dir=osp.expanduser("~")):
+def default_master_id(port: int) -> str:
+    """默认的主节点标识，同一主机上按端口区分，重启后保持不变"""
+    return f'{socket.gethostname()}:{port}'
+
+
+def serve(port: int, max_clients=50, max_task_cache_size=1000, container_dir=osp.expanduser("~"),
+          lease_timeout: float = DEFAULT_LEASE_TIMEOUT, wal: bool = False, compression: typing.Dict = None,
+          metrics_port: int = None, master_id: str = None):
     container_dir = osp.join(container_dir, 'easycrawler', 'container')
     os.makedirs(container_dir, exist_ok=True)
     server = grpc.server(futures.ThreadPoolExecutor(max_workers=1000))
-    easycrawler_pb2_grpc.add_EasyCrawlerServiceServicer_to_server(
-        ServiceServicer(max_clients, max_task_cache_size, container_dir),
-        server)
+    servicer = ServiceServicer(max_clients, max_task_cache_size, container_dir, lease_timeout, wal, compression,
+                               master_id or default_master_id(port))
+    easycrawler_pb2_grpc.add_EasyCrawlerServiceServicer_to_server(servicer, server)
+    if metrics_port:
+        start_http_server(metrics_port, servicer._stats)
     # 开放端口
     server.add_insecure_port('[::]:{}'.format(port))
     server.start()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 任务与结果负载压缩
+@Date       : 2024/10/27 16:40
+@Author     : lkkings
+@FileName:  : compress_util.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import gzip
+import typing
+
+import grpc
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 不压缩
+IDENTITY = ''
+GZIP = 'gzip'
+ZSTD = 'zstd'
+
+# 所有节点都能解压的算法，接收方未声明可解压算法的负载 (如任务) 只使用这些算法
+UNIVERSAL_CODECS = (GZIP,)
+
+# 小于该字节数的负载不压缩
+DEFAULT_MIN_SIZE = 1024
+
+
+class Compression:
+    """
+    压缩配置，对应 conf.yaml 中的 compression 段:
+
+    compression:
+      codec: gzip      # gzip | zstd | none，zstd 需要安装 zstandard，任务负载始终退回 gzip
+      level: 6
+      min_size: 1024
+    """
+
+    def __init__(self, codec: str = GZIP, level: int = None, min_size: int = DEFAULT_MIN_SIZE):
+        codec = (codec or IDENTITY).lower()
+        if codec == 'none':
+            codec = IDENTITY
+        if codec not in (IDENTITY, GZIP, ZSTD):
+            raise ValueError(f'不支持的压缩算法 => {codec}')
+        if codec == ZSTD and zstandard is None:
+            raise ValueError('zstd 压缩需要安装 zstandard')
+        self.codec = codec
+        self.level = level
+        self.min_size = min_size
+        self._zstd_compressor = None
+        if codec == ZSTD:
+            self._zstd_compressor = zstandard.ZstdCompressor(level=level or 3)
+
+    @classmethod
+    def from_config(cls, config: typing.Optional[typing.Dict]) -> typing.Optional['Compression']:
+        """从配置字典创建，未配置时返回 None"""
+        if not config:
+            return None
+        return cls(config.get('codec', GZIP), config.get('level'), config.get('min_size', DEFAULT_MIN_SIZE))
+
+    def negotiate(self, accept: typing.Iterable[str]) -> 'Compression':
+        """对端不支持当前算法时退回 gzip"""
+        if self.codec == IDENTITY or self.codec in accept:
+            return self
+        return Compression(GZIP, None, self.min_size)
+
+    def compress(self, data: bytes) -> typing.Tuple[str, bytes]:
+        """返回 (编码, 数据)，小于阈值或压缩无收益时原样返回"""
+        if self.codec == IDENTITY or len(data) < self.min_size:
+            return IDENTITY, data
+        if self.codec == ZSTD:
+            compressed = self._zstd_compressor.compress(data)
+        else:
+            compressed = gzip.compress(data, compresslevel=self.level or 6)
+        if len(compressed) >= len(data):
+            return IDENTITY, data
+        return self.codec, compressed
+
+    @property
+    def grpc_compression(self) -> grpc.Compression:
+        """gRPC 传输层仅支持 gzip，zstd 在负载层处理"""
+        return grpc.Compression.NoCompression if self.codec == IDENTITY else grpc.Compression.Gzip
+
+
+def available_codecs() -> typing.List[str]:
+    """当前环境可解压的算法"""
+    codecs = [GZIP]
+    if zstandard is not None:
+        codecs.insert(0, ZSTD)
+    return codecs
+
+
+def decompress(encoding: str, data: bytes) -> bytes:
+    if encoding == IDENTITY:
+        return data
+    if encoding == GZIP:
+        return gzip.decompress(data)
+    if encoding == ZSTD:
+        if zstandard is None:
+            raise ValueError('收到 zstd 压缩负载，但未安装 zstandard')
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f'不支持的压缩算法 => {encoding}')
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 一致性哈希环，按 client_id 将客户端分配到主节点
+@Date       : 2024/11/01 21:30
+@Author     : lkkings
+@FileName:  : hash_ring.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import bisect
+import hashlib
+import typing
+
+# 每个节点在环上的虚拟节点数
+DEFAULT_REPLICAS = 160
+
+
+def parse_addresses(address: typing.Union[str, typing.Iterable[str]]) -> typing.List[str]:
+    """主节点地址列表，字符串时按逗号分隔"""
+    if isinstance(address, str):
+        address = address.split(',')
+    addresses = [a.strip() for a in address if a and a.strip()]
+    if not addresses:
+        raise ValueError('未配置主节点地址')
+    return addresses
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    一致性哈希环
+
+    增减节点时只有相邻区间的键迁移。节点为主节点上报的稳定标识而非地址文本，
+    相同的节点集合得到相同的映射，节点列表的顺序不影响结果。
+    """
+
+    def __init__(self, nodes: typing.Iterable[str], replicas: int = DEFAULT_REPLICAS):
+        self.nodes = sorted(set(nodes))
+        if not self.nodes:
+            raise ValueError('哈希环至少需要一个节点')
+        ring = sorted((_hash(f'{node}#{i}'), node) for node in self.nodes for i in range(replicas))
+        self._keys = [h for h, _ in ring]
+        self._nodes = [node for _, node in ring]
+
+    def get(self, key: str) -> str:
+        if len(self.nodes) == 1:
+            return self.nodes[0]
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._nodes[index]
@@ -11,6 +11,7 @@ Change Log  :
 
 """
 import re
+from urllib.parse import urlsplit
 
 
 def url_is_pattern(url, allow=None, deny=None):
@@ -58,3 +59,11 @@ def extract_first_link(text):
     if match:
         return match.group(0)  # 返回第一个匹配的链接
     return None  # 如果没有找到链接，返回 None
+
+
+def extract_host(url):
+    # 提取 url 的域名，非法或缺少域名时返回空字符串
+    try:
+        return (urlsplit(url).hostname or '') if isinstance(url, str) else ''
+    except ValueError:
+        return ''
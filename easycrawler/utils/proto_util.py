@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 任务与结果在字典与 protobuf 消息之间的转换
+@Date       : 2024/10/27 10:21
+@Author     : lkkings
+@FileName:  : proto_util.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import json
+import typing
+
+from easycrawler.protos import easycrawler_pb2
+from easycrawler.utils.compress_util import Compression, IDENTITY, decompress
+
+# 任务字典中的路由字段 => Meta 字段
+META_FIELDS = {
+    '__id__': 'id',
+    '__client_id__': 'client_id',
+    '__task__': 'task',
+    '__worker_id__': 'worker_id',
+    '__priority__': 'priority',
+    '__depth__': 'depth',
+    '__host__': 'host',
+    '__retry__': 'retry',
+}
+
+# 结果字典中的路由字段
+RESULT_FIELDS = ('id', 'client_id', 'task', 'worker_id')
+
+
+def _encode(payload: typing.Dict, compression: typing.Optional[Compression]) -> typing.Tuple[str, bytes]:
+    data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    if compression is None:
+        return IDENTITY, data
+    return compression.compress(data)
+
+
+def _decode(encoding: str, data: bytes) -> typing.Dict:
+    return json.loads(decompress(encoding, data)) if data else {}
+
+
+def meta_to_pb(meta: typing.Dict, compression: Compression = None) -> easycrawler_pb2.Meta:
+    """路由字段写入 Meta，其余字段序列化为 payload，超过阈值时压缩"""
+    fields = {}
+    payload = {}
+    for k, v in meta.items():
+        if k in META_FIELDS:
+            fields[META_FIELDS[k]] = v
+        else:
+            payload[k] = v
+    encoding, data = _encode(payload, compression)
+    return easycrawler_pb2.Meta(payload=data, encoding=encoding, **fields)
+
+
+def pb_to_meta(meta: easycrawler_pb2.Meta) -> typing.Dict:
+    data = _decode(meta.encoding, meta.payload)
+    for k, field in META_FIELDS.items():
+        data[k] = getattr(meta, field)
+    return data
+
+
+def result_to_pb(result: typing.Dict, compression: Compression = None) -> easycrawler_pb2.TaskResult:
+    """路由字段写入 TaskResult，其余字段序列化为 payload，超过阈值时压缩"""
+    fields = {}
+    payload = {}
+    for k, v in result.items():
+        if k in RESULT_FIELDS:
+            fields[k] = v
+        else:
+            payload[k] = v
+    encoding, data = _encode(payload, compression)
+    return easycrawler_pb2.TaskResult(payload=data, encoding=encoding, **fields)
+
+
+def pb_to_result(result: easycrawler_pb2.TaskResult) -> typing.Dict:
+    data = _decode(result.encoding, result.payload)
+    for field in RESULT_FIELDS:
+        data[field] = getattr(result, field)
+    return data
@@ -136,6 +136,10 @@ class NamedHashMap:
     def set(self, key, value):
         self.redis_conn.hset(self.name, key, value)
 
+    def set_if_absent(self, key, value) -> bool:
+        """key 不存在时写入并返回 True，已存在时不覆盖并返回 False"""
+        return bool(self.redis_conn.hsetnx(self.name, key, value))
+
     def get(self, key):
         return self.redis_conn.hget(self.name, key)
 
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 工作节点的解析进程池
+@Date       : 2024/11/03 15:20
+@Author     : lkkings
+@FileName:  : parse_pool.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import asyncio
+import importlib.util
+import inspect
+import multiprocessing
+import os.path as osp
+import typing
+from concurrent.futures import ProcessPoolExecutor, Future
+
+from easycrawler.core.base_task import Task
+
+# 子进程内已加载的任务实例，(文件路径, 类名, 任务包 sha256) => 任务
+_tasks: typing.Dict[typing.Tuple[str, str, str], Task] = {}
+
+
+def _load_task(path: str, cls_name: str, package: str) -> Task:
+    key = (path, cls_name, package)
+    task = _tasks.get(key)
+    if task is None:
+        # 任务包更新后旧版本的实例不再使用
+        for old in [k for k in _tasks if k[:2] == key[:2]]:
+            del _tasks[old]
+        spec = importlib.util.spec_from_file_location(osp.basename(path)[:-3], path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        task = _tasks[key] = getattr(module, cls_name)()
+    return task
+
+
+def _process(path: str, cls_name: str, package: str, text: str) -> typing.List[typing.Dict]:
+    """在子进程中解析并构建结果"""
+    items = _load_task(path, cls_name, package).process(text)
+    if inspect.isawaitable(items):
+        # AsyncTask 的 parse 可以是协程
+        items = asyncio.run(items)
+    return items
+
+
+class ParsePool:
+    """
+    解析进程池
+
+    抓取仍在线程或事件循环中执行，响应文本交给子进程解析与构建，CPU 密集的解析不再与抓取线程争抢 GIL。
+    子进程按文件路径重新加载任务类，只调用 parse 与 build，不执行 init，
+    解析依赖 init 或 request 中设置的实例状态的任务应设置 parse_in_process = False。
+    """
+
+    def __init__(self, processes: int):
+        # 工作节点进程持有 gRPC 连接与多个线程，子进程使用 spawn 启动
+        self._executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+
+    def submit(self, source: typing.Tuple[str, str, str], text: str) -> Future:
+        return self._executor.submit(_process, *source, text)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
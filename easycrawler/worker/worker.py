@@ -10,63 +10,281 @@
 Change Log  :
 
 """
+import asyncio
+import hashlib
 import json
+import math
 import os
 import os.path as osp
+import queue
+import shutil
 import threading
+import time
 import traceback
 import typing
 import importlib.util
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import grpc
+import psutil
 
-from easycrawler.core.base_task import Task
+from easycrawler.core.base_task import Task, AsyncTask
 from easycrawler.exceptions import QueueEmptyException, ClientClosedException, NotUpdateException
 from easycrawler.logs import logger
 from easycrawler.utils.common import retry
 from easycrawler.utils.thread_util import ThreadSafeDict
 from easycrawler.utils.file_util import unzip_file
+from easycrawler.utils.compress_util import Compression, GZIP
+from easycrawler.utils.proto_util import pb_to_meta, result_to_pb
+from easycrawler.utils.hash_ring import parse_addresses
+from easycrawler.worker.parse_pool import ParsePool
 from easycrawler.protos import easycrawler_pb2_grpc, easycrawler_pb2
 
 
+# 执行任务的线程数上限
+DEFAULT_MAX_WORKERS = 64
+
+# 任务耗时与 RPC 延迟的指数滑动平均系数
+EWMA_ALPHA = 0.2
+
+# 轮询模式下主节点没有可分发的任务时，等待任务结束或该时间后再次获取，单位秒
+POLL_INTERVAL = 1
+
+# 获取任务失败后的重试间隔，单位秒，停止时立即结束等待
+RETRY_DELAY = 3
+
+# 单次心跳 RPC 的超时时间，单位秒，不可用的主节点不会阻塞其他主节点的续约
+HEARTBEAT_TIMEOUT = 5
+
+# 单次发送结果 RPC 的超时时间，单位秒，无响应的主节点不会让发送线程无限等待
+SEND_TIMEOUT = 30
+
+# 本地缓存的任务包数上限，超过时删除最久未使用且未加载的任务包
+MAX_CACHED_PACKAGES = 16
+
+# 拉取任务包时 RPC 失败的最大尝试次数，仍失败时跳过，由主节点下次通知时再拉取
+PULL_RETRIES = 3
+
+
+class Shard:
+    """单个主节点的连接与订阅状态"""
+
+    def __init__(self, address: str, result_buffer_size: int = 1000):
+        self.address = address
+        self.grpc = grpc.insecure_channel(address)
+        # 发往该主节点的结果缓冲区，由该主节点独立的发送线程批量发送，不可用的主节点不阻塞其他主节点的结果
+        self.results: queue.Queue = queue.Queue(maxsize=result_buffer_size)
+        self.announcements: typing.Optional[queue.Queue] = None
+        # 已向该主节点声明但尚未收到任务的槽位数
+        self.granted = 0
+        # 来自该主节点的执行中任务数，包括预取尚未执行的任务
+        self.running = 0
+        # 该主节点 RPC 往返时间的滑动平均，单位秒
+        self.latency: typing.Optional[float] = None
+
+    def observe(self, elapsed: float):
+        self.latency = elapsed if self.latency is None else self.latency + EWMA_ALPHA * (elapsed - self.latency)
+
+
 class Worker(threading.Thread):
     tasks: ThreadSafeDict = {}
 
-    def __init__(self, worker_id: str, server_address: str, worker_dir=None):
+    def __init__(self, worker_id: str, server_address: typing.Union[str, typing.List[str]], worker_dir=None,
+                 stream: bool = True,
+                 result_buffer_size: int = 1000, result_batch_size: int = 100, heartbeat_interval: float = 10,
+                 compression: typing.Dict = None, max_workers: int = DEFAULT_MAX_WORKERS, parse_processes: int = 0,
+                 prefetch: bool = True):
         super().__init__()
         if worker_dir is None:
             worker_dir = osp.join(osp.expanduser("~"), 'easycrawler', 'worker')
         self.worker_dir = worker_dir
         os.makedirs(self.worker_dir, exist_ok=True)
+        # 本地任务包缓存，按 sha256 保存
+        self.package_dir = osp.join(worker_dir, 'packages')
+        os.makedirs(self.package_dir, exist_ok=True)
+        # client_id => 已加载的任务包 sha256
+        self._packages: typing.Dict[str, str] = {}
         self.running = False
+        # run 中全部任务结束后置为 True，结果发送线程发送完剩余结果后退出
+        self._stopped = False
         self.worker_id = worker_id
 
-        self.server_address = server_address
-        self.grpc = grpc.insecure_channel(server_address)
+        # 多个主节点按 client_id 分片，工作节点同时连接全部主节点
+        self.server_addresses = parse_addresses(server_address)
+        self.shards: typing.Dict[str, Shard] = {address: Shard(address, result_buffer_size)
+                                                for address in self.server_addresses}
+        # client_id => 下发该客户端任务或任务包的主节点，结果、续约与拉取都经由该主节点，
+        # 不在本地按地址重新计算分片，地址写法不同也不会把结果发往其他主节点
+        self._client_shards: typing.Dict[str, Shard] = {}
+        # task_key => client_id
+        self._task_clients: typing.Dict[str, str] = {}
+        # task_key => 执行中任务数，随请求上报给主节点
+        self._running_tasks: typing.Dict[str, int] = {}
+        # 任务在有界线程池中执行，线程数不随获取的任务数增长
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'{worker_id}-task')
+        # task_key => 执行槽位，限制同类任务的并发数不超过 max_threads
+        self._task_slots: typing.Dict[str, threading.BoundedSemaphore] = {}
+        # task_key => 等待执行槽位的任务
+        self._backlog: typing.Dict[str, typing.Deque[typing.Dict]] = {}
+        # AsyncTask 在进程内唯一的事件循环中执行，首次使用时启动
+        self._loop: typing.Optional[asyncio.AbstractEventLoop] = None
+        # parse_processes 大于 0 时解析与构建在进程池中执行，抓取线程只负责请求
+        self._parse_pool = ParsePool(parse_processes) if parse_processes > 0 else None
+        # task_key => (任务文件路径, 类名)，子进程据此加载任务类
+        self._task_sources: typing.Dict[str, typing.Tuple[str, str]] = {}
+        # 在空闲槽位之外预取任务放入等待队列，槽位空出时无需等待网络往返
+        self.prefetch = prefetch
+        # task_key => 任务执行耗时的滑动平均，单位秒
+        self._durations: typing.Dict[str, float] = {}
+        # 心跳上报本进程的 CPU 与内存，首次调用 cpu_percent 只作为计算起点
+        self._process = psutil.Process()
+        self._process.cpu_percent(None)
         self.i = 0
+        self._slot_cond = threading.Condition()
+        # stream 为 True 时通过 Subscribe 流接收服务端推送，否则轮询 GetMetaBatch
+        self.stream = stream
+        # 任务结果先写入所属主节点的有界缓冲区，由后台线程通过 OnResultBatch 批量发送
+        self.result_batch_size = result_batch_size
+        # 持有租约的任务 (client_id, meta_id)，结果发送成功前定期向服务端续约
+        self._leases: typing.Set[typing.Tuple[str, str]] = set()
+        self.heartbeat_interval = heartbeat_interval
+        # 结果全部发送后置位，心跳在此之前持续为执行中及待发送结果的任务续约
+        self._heartbeat_stop = threading.Event()
+        # 结果负载压缩配置，按客户端声明的可解压算法协商
+        self.compression = Compression.from_config(compression)
+        self._result_compression: typing.Dict[str, Compression] = {}
 
-    @retry(max_retries=-1, delay=3)
-    def pull(self, client_id: str):
-        logger.info(f"Push => {client_id}")
-        data = {'client_id': client_id, 'worker_id': self.worker_id}
-        stub = easycrawler_pb2_grpc.EasyCrawlerServiceStub(self.grpc)
+    def _shard(self, client_id: str) -> Shard:
+        return self._client_shards[client_id]
+
+    def _prefetch_depth(self, task_key: str, task: Task, shard: Shard) -> int:
+        """
+        任务类型的预取深度
+
+        按 max_threads 个槽位在一次 RPC 往返内完成的任务数估算，至少为 1，至多为 max_threads，
+        尚无观测数据时为 1
+        """
+        if not self.prefetch:
+            return 0
+        duration = self._durations.get(task_key)
+        if duration is None or shard.latency is None:
+            return 1
+        depth = math.ceil(task.max_threads * shard.latency / max(duration, 1e-3))
+        return min(max(depth, 1), task.max_threads)
+
+    def _task_capacity(self, shard: Shard) -> typing.Dict[str, typing.Tuple[Task, int, int]]:
+        """主节点上各任务类型的 (任务, 空闲槽位数, 预取深度)，空闲槽位包括预取深度"""
+        capacity = {}
+        for task_key, client_id in self._task_clients.items():
+            task = self.tasks.get(task_key)
+            if task is None or self._shard(client_id) is not shard:
+                continue
+            depth = self._prefetch_depth(task_key, task, shard)
+            free = max(task.max_threads + depth - self._running_tasks.get(task_key, 0), 0)
+            capacity[task_key] = (task, free, depth)
+        return capacity
+
+    def _report(self, shard: Shard) -> typing.Dict:
+        """上报给主节点的状态，包括该主节点上各任务类型的空闲并发、预取深度与已加载的任务包"""
+        with self._slot_cond:
+            capacity = self._task_capacity(shard)
+            packages = {client_id: package for client_id, package in self._packages.items()
+                        if self._shard(client_id) is shard}
+        return {
+            'capacity': {task_key: free for task_key, (_, free, _) in capacity.items()},
+            'prefetch': {task_key: depth for task_key, (_, _, depth) in capacity.items()},
+            'packages': packages,
+        }
+
+    def _prune_packages(self):
+        """本地任务包超过 MAX_CACHED_PACKAGES 个时按最近使用时间删除，已加载的任务包保留"""
+        loaded = set(self._packages.values())
+        paths = [osp.join(self.package_dir, name) for name in os.listdir(self.package_dir) if name.endswith('.zip')]
+        paths.sort(key=osp.getmtime, reverse=True)
+        for path in paths[MAX_CACHED_PACKAGES:]:
+            if osp.basename(path)[:-4] in loaded:
+                continue
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f'Remove package {path} fail! => {e}')
+
+    def pull(self, client_id: str, shard: Shard = None) -> bool:
+        """
+        拉取任务包，本地已缓存相同 sha256 的任务包时服务端不再传输，shard 为通知拉取的主节点，加载成功时返回 True
+
+        只有 RPC 失败会重试，至多 PULL_RETRIES 次，停止后不再重试；客户端已删除、任务包校验失败或任务加载失败
+        重试也无法恢复，记录后跳过，不阻塞获取任务的线程
+        """
+        logger.info(f"Pull => {client_id}")
+        if shard is not None:
+            self._client_shards[client_id] = shard
+        for attempt in range(PULL_RETRIES):
+            try:
+                self._pull(client_id)
+                return True
+            except grpc.RpcError as e:
+                logger.warning(f'Pull {client_id} fail! => {e}')
+                if not self.running or attempt == PULL_RETRIES - 1:
+                    break
+                self._wait_retry()
+            except Exception as e:
+                logger.error(f'Pull {client_id} fail! => {e}')
+                break
+        return False
+
+    def _pull(self, client_id: str):
+        # 只声明该客户端当前加载的任务包，任务包未变化时服务端不再传输
+        loaded = self._packages.get(client_id)
+        data = {'client_id': client_id, 'worker_id': self.worker_id, 'cached': [loaded] if loaded else []}
+        stub = easycrawler_pb2_grpc.EasyCrawlerServiceStub(self._shard(client_id).grpc)
         response_iterator = stub.Pull(easycrawler_pb2.Message(data=json.dumps(data)))
-        work_dir = osp.join(self.worker_dir, f'{client_id}')
-        os.makedirs(work_dir, exist_ok=True)
-        zip_file_path = f'{work_dir}.zip'
-        with open(zip_file_path, "wb") as f:
+        package = None
+        download_path = osp.join(self.package_dir, f'{client_id}.download')
+        sha256 = None
+        f = None
+        try:
             for chunk in response_iterator:
-                f.write(chunk.data)
-        unzip_file(zip_file_path, work_dir)
-        os.remove(zip_file_path)
-        self._load_tasks(client_id)
-        logger.info(f"Push success!")
+                package = package or chunk.sha256
+                if chunk.data:
+                    if f is None:
+                        f = open(download_path, 'wb')
+                        sha256 = hashlib.sha256()
+                    sha256.update(chunk.data)
+                    f.write(chunk.data)
+        finally:
+            if f is not None:
+                f.close()
+        if not package:
+            raise Exception(f'客户端不存在 => {client_id}')
+        package_path = osp.join(self.package_dir, f'{package}.zip')
+        if sha256 is not None:
+            if sha256.hexdigest() != package:
+                os.remove(download_path)
+                raise Exception(f'任务包校验失败 => {client_id}')
+            os.replace(download_path, package_path)
+            logger.info(f'Download package {package}')
+        elif not osp.exists(package_path):
+            raise Exception(f'任务包缓存缺失 => {package}')
+        else:
+            # 更新使用时间，最近使用的任务包不会被清理
+            os.utime(package_path)
+            logger.info(f'Package cache hit {package}')
+        if self._packages.get(client_id) != package:
+            work_dir = osp.join(self.worker_dir, f'{client_id}')
+            # 清理旧版本文件，避免加载已删除的任务
+            shutil.rmtree(work_dir, ignore_errors=True)
+            unzip_file(package_path, work_dir)
+            self._load_tasks(client_id)
+            self._packages[client_id] = package
+        if sha256 is not None:
+            self._prune_packages()
+        logger.info(f"Pull success!")
 
-    @retry(max_retries=-1, delay=3)
-    def get_meta(self) -> typing.Dict:
-        logger.info(f"Get meta")
-        stub = easycrawler_pb2_grpc.EasyCrawlerServiceStub(self.grpc)
-        result = stub.GetMeta(easycrawler_pb2.Message(data=self.worker_id))
+    def _check_result(self, result, shard: Shard):
+        """处理主节点 shard 返回的任务获取结果中的非成功状态"""
         if result.code == easycrawler_pb2.TASK_QUEUE_EMPTY:
             raise QueueEmptyException(f'任务队列为空')
         if result.code == easycrawler_pb2.CLIENT_IS_CLOSED:
@@ -75,35 +293,304 @@ class Worker(threading.Thread):
             raise ClientClosedException(f'客户端已关闭! => {client_id}')
         if result.code == easycrawler_pb2.WORKER_NOT_UPDATE:
             client_ids = result.message.split(',')
-            for client_id in client_ids:
-                self.pull(client_id)
+            failed = [client_id for client_id in client_ids if not self.pull(client_id, shard)]
+            if failed:
+                # 未能加载的任务包按获取失败处理，等待后再重试，避免立即重新获取时反复拉取
+                raise Exception(f'Pull {failed} fail!')
             raise NotUpdateException(f'Client {client_ids} not update!')
-        meta = json.loads(result.message)
-        self.i += 1
+        if result.code != easycrawler_pb2.SUCCESS:
+            raise Exception(result.message)
+
+    def _pull_pending(self, reply, shard: Shard) -> bool:
+        """拉取主节点 shard 随任务下发的待加载客户端的任务包，有新加载的客户端时返回 True"""
+        client_ids = [client_id for client_id in reply.message.split(',')
+                      if client_id and client_id not in self._packages]
+        loaded = [client_id for client_id in client_ids if self.pull(client_id, shard)]
+        return len(loaded) > 0
+
+    def get_meta(self, shard: Shard = None) -> typing.Optional[typing.Dict]:
+        """从主节点租用一个任务，没有可分发的任务时返回 None"""
+        logger.info(f"Get meta")
+        shard = shard or self.shards[self.server_addresses[0]]
+        stub = easycrawler_pb2_grpc.EasyCrawlerServiceStub(shard.grpc)
+        reply = stub.GetMeta(easycrawler_pb2.Message(data=self.worker_id))
+        try:
+            self._check_result(reply, shard)
+        except QueueEmptyException:
+            return None
+        meta = pb_to_meta(reply.metas[0])
+        self._accept([meta], shard)
+        self._pull_pending(reply, shard)
         logger.info(f"[{self.i}] Get Meta success! => {meta}")
         return meta
 
+    def get_metas(self, max_n: int, shard: Shard = None) -> typing.List[typing.Dict]:
+        """
+        从主节点一次租用至多 max_n 个任务，默认为第一个主节点
+
+        没有可分发的任务时返回空列表，主节点返回控制消息或 RPC 失败时抛出异常，由调用方决定是否重试
+        """
+        logger.info(f"Get {max_n} meta")
+        shard = shard or self.shards[self.server_addresses[0]]
+        data = {'worker_id': self.worker_id, 'max_n': max_n, **self._report(shard)}
+        stub = easycrawler_pb2_grpc.EasyCrawlerServiceStub(shard.grpc)
+        start = time.time()
+        reply = stub.GetMetaBatch(easycrawler_pb2.Message(data=json.dumps(data)))
+        shard.observe(time.time() - start)
+        try:
+            self._check_result(reply, shard)
+        except QueueEmptyException:
+            return []
+        metas = [pb_to_meta(meta) for meta in reply.metas]
+        self._accept(metas, shard)
+        self._pull_pending(reply, shard)
+        logger.info(f"[{self.i}] Get {len(metas)} Meta success!")
+        return metas
+
+    def _accept(self, metas: typing.List[typing.Dict], shard: Shard):
+        """记录主节点 shard 下发的任务及其租约"""
+        with self._slot_cond:
+            self.i += len(metas)
+            for meta in metas:
+                client_id = meta['__client_id__']
+                self._client_shards[client_id] = shard
+                shard.running += 1
+                self._running_tasks[meta['__task__']] = self._running_tasks.get(meta['__task__'], 0) + 1
+                self._leases.add((client_id, meta['__id__']))
+
+    def _status(self, shard: Shard, usage: typing.Dict) -> typing.Dict:
+        """心跳上报的状态，执行中任务数与空闲槽位按主节点统计，CPU 与内存为整个进程"""
+        with self._slot_cond:
+            running = {}
+            for task_key, n in self._running_tasks.items():
+                client_id = self._task_clients.get(task_key)
+                if n > 0 and client_id is not None and self._shard(client_id) is shard:
+                    running[task_key] = n
+            free_slots = self._free_capacity(shard)
+        return {'running': running, 'free_slots': free_slots, **usage}
+
+    def _heartbeat(self):
+        """
+        定期向各主节点发送心跳
+
+        心跳为执行中及待发送结果的任务续约，租约按客户端所在主节点分组，
+        同时上报空闲并发、已加载的任务包与进程资源，主节点据此分发任务并判断工作节点是否存活
+        """
+        while not self._heartbeat_stop.is_set():
+            with self._slot_cond:
+                leases = {address: [] for address in self.shards}
+                for lease in self._leases:
+                    leases[self._shard(lease[0]).address].append(lease)
+            try:
+                # cpu 为距上次心跳的平均使用率，100 表示占满一个核心
+                usage = {'cpu': self._process.cpu_percent(None), 'rss': self._process.memory_info().rss}
+            except psutil.Error as e:
+                logger.warning(f'Read process usage fail! => {e}')
+                usage = {}
+            for address, shard_leases in leases.items():
+                try:
+                    shard = self.shards[address]
+                    data = {'worker_id': self.worker_id, 'leases': shard_leases, **self._report(shard),
+                            'status': self._status(shard, usage)}
+                    stub = easycrawler_pb2_grpc.EasyCrawlerServiceStub(shard.grpc)
+                    start = time.time()
+                    result = stub.Heartbeat(easycrawler_pb2.Message(data=json.dumps(data)), timeout=HEARTBEAT_TIMEOUT)
+                    shard.observe(time.time() - start)
+                    if result.code != easycrawler_pb2.SUCCESS:
+                        raise Exception(result.message)
+                except Exception as e:
+                    logger.warning(f'Heartbeat {address} fail! => {e}')
+            self._heartbeat_stop.wait(self.heartbeat_interval)
+
+    def _return_prefetched(self):
+        """停止时把等待队列中预取但尚未执行的任务归还给主节点，由主节点立即重新分发"""
+        with self._slot_cond:
+            metas = [meta for backlog in self._backlog.values() for meta in backlog]
+            self._backlog.clear()
+            returned = {address: [] for address in self.shards}
+            for meta in metas:
+                client_id = meta['__client_id__']
+                lease = (client_id, meta['__id__'])
+                self._leases.discard(lease)
+                returned[self._shard(client_id).address].append(lease)
+        for address, leases in returned.items():
+            if not leases:
+                continue
+            try:
+                data = {'worker_id': self.worker_id, 'leases': [], 'returned': leases}
+                stub = easycrawler_pb2_grpc.EasyCrawlerServiceStub(self.shards[address].grpc)
+                result = stub.Heartbeat(easycrawler_pb2.Message(data=json.dumps(data)), timeout=HEARTBEAT_TIMEOUT)
+                if result.code != easycrawler_pb2.SUCCESS:
+                    raise Exception(result.message)
+                logger.info(f'Return {len(leases)} prefetched meta => {address}')
+            except Exception as e:
+                # 未能归还的任务在租约过期后由主节点重新分发
+                logger.warning(f'Return prefetched meta to {address} fail! => {e}')
+        for meta in metas:
+            self._task_done(meta, sent=True, announce=False)
+
+    def _announce(self, shard: Shard, force: bool = False):
+        """向主节点补充声明空闲槽位"""
+        announcements = shard.announcements
+        if announcements is None:
+            return
+        with self._slot_cond:
+            slots = max(self._free_capacity(shard) - shard.granted, 0)
+            shard.granted += slots
+        if slots > 0 or force:
+            announcements.put({'worker_id': self.worker_id, 'slots': slots, **self._report(shard)})
+
+    def _announcement_iterator(self, announcements: queue.Queue):
+        while self.running:
+            try:
+                data = announcements.get(timeout=1)
+            except queue.Empty:
+                continue
+            yield easycrawler_pb2.Message(data=json.dumps(data))
+
+    def subscribe(self, shard: Shard):
+        """订阅主节点的任务流，主节点在有任务且存在空闲槽位时立即推送，停止后随请求流结束返回"""
+        logger.info(f"Subscribe => {shard.address}")
+        announcements = queue.Queue()
+        with self._slot_cond:
+            shard.granted = 0
+            shard.announcements = announcements
+        stub = easycrawler_pb2_grpc.EasyCrawlerServiceStub(shard.grpc)
+        responses = stub.Subscribe(self._announcement_iterator(announcements))
+        self._announce(shard, force=True)
+        try:
+            for reply in responses:
+                try:
+                    self._check_result(reply, shard)
+                except (ClientClosedException, NotUpdateException) as e:
+                    logger.warning(e)
+                    # 处理完控制消息后通知服务端恢复推送
+                    self._announce(shard, force=True)
+                    continue
+                metas = [pb_to_meta(meta) for meta in reply.metas]
+                with self._slot_cond:
+                    shard.granted -= len(metas)
+                self._accept(metas, shard)
+                logger.info(f"[{self.i}] Receive {len(metas)} Meta")
+                for meta in metas:
+                    self._execute(meta)
+                if self._pull_pending(reply, shard):
+                    # 新加载的任务类型带来空闲槽位，补充声明并上报已加载的任务包
+                    self._announce(shard)
+        finally:
+            with self._slot_cond:
+                shard.announcements = None
+            responses.cancel()
+
+    @property
+    def free_capacity(self) -> int:
+        """空闲并发数，按已加载任务的 max_threads 之和减去执行中的任务数计算"""
+        return sum(self._free_capacity(shard) for shard in self.shards.values())
+
+    def _free_capacity(self, shard: Shard) -> int:
+        """
+        主节点的空闲并发数
+
+        每个客户端只属于一个主节点，按该主节点上客户端各任务的 max_threads 与预取深度之和减去已获取的任务数求和，
+        各主节点的槽位互不占用，空闲的主节点不会占住其他主节点的并发。
+        同步任务的槽位同时不超过线程池的空闲线程数与预取深度之和，AsyncTask 在事件循环中执行，不占用线程
+        """
+        capacity = self._task_capacity(shard)
+        threads = coroutines = depths = 0
+        for task, free, depth in capacity.values():
+            if isinstance(task, AsyncTask):
+                coroutines += free
+            else:
+                threads += free
+                depths += depth
+        idle = self.max_workers - sum(n for task_key, n in self._running_tasks.items()
+                                      if not isinstance(self.tasks.get(task_key), AsyncTask))
+        if not capacity:
+            # 尚未加载该主节点的任务，仍需请求一次以触发拉取
+            return min(1, idle)
+        return min(threads, max(idle, 0) + depths) + coroutines
+
     @retry(max_retries=-1, delay=3)
     def on_result(self, client_id: str, result: typing.Dict):
         logger.info(f"Send result => {result}")
         result['client_id'] = client_id
-        result_str = json.dumps(result)
-        stub = easycrawler_pb2_grpc.EasyCrawlerServiceStub(self.grpc)
-        result = stub.OnResult(easycrawler_pb2.Message(data=result_str))
+        stub = easycrawler_pb2_grpc.EasyCrawlerServiceStub(self._shard(client_id).grpc)
+        result = stub.OnResult(result_to_pb(result, self._result_compression.get(client_id)))
         if result.code != easycrawler_pb2.SUCCESS:
             raise Exception(result.message)
         logger.info(f"[{self.i}] Send result success!")
 
+    def on_results(self, results: typing.List[typing.Dict]):
+        """按客户端所在主节点分组发送结果"""
+        groups: typing.Dict[str, typing.List[typing.Dict]] = {}
+        for result in results:
+            groups.setdefault(self._shard(result['client_id']).address, []).append(result)
+        for address, group in groups.items():
+            self._send_results_to(self.shards[address], group)
+
+    def _send_results_to(self, shard: Shard, results: typing.List[typing.Dict]):
+        """
+        向主节点发送一批结果，失败后等待重试
+
+        停止后发送失败即放弃该批结果，不再续约，由主节点在租约过期后重新分发，
+        缓冲区得以清空，等待写入结果的任务线程与 run 都不会因不可用的主节点而阻塞
+        """
+        while True:
+            logger.info(f"Send {len(results)} result => {shard.address}")
+            try:
+                stub = easycrawler_pb2_grpc.EasyCrawlerServiceStub(shard.grpc)
+                start = time.time()
+                result = stub.OnResultBatch(
+                    (result_to_pb(result, self._result_compression.get(result['client_id'])) for result in results),
+                    timeout=SEND_TIMEOUT)
+                shard.observe(time.time() - start)
+                if result.code != easycrawler_pb2.SUCCESS:
+                    raise Exception(result.message)
+                logger.info(f"Send {len(results)} result success!")
+                break
+            except Exception as e:
+                if self.running:
+                    logger.warning(f'Send result to {shard.address} fail! => {e}')
+                    self._wait_retry()
+                    continue
+                logger.warning(f'Send result to {shard.address} fail, give up {len(results)} result => {e}')
+                break
+        with self._slot_cond:
+            for result in results:
+                self._leases.discard((result['client_id'], result['id']))
+
+    def _send_results(self, shard: Shard):
+        """后台批量发送主节点 shard 的任务结果"""
+        while not self._stopped or not shard.results.empty():
+            try:
+                results = [shard.results.get(timeout=1)]
+            except queue.Empty:
+                continue
+            while len(results) < self.result_batch_size:
+                try:
+                    results.append(shard.results.get_nowait())
+                except queue.Empty:
+                    break
+            self._send_results_to(shard, results)
+
     def del_client(self, client_id: str):
-        tasks = self.tasks.get(client_id)
-        if tasks and len(tasks) > 0:
-            for task in self.tasks:
+        self._packages.pop(client_id, None)
+        for task_key in [k for k, c in self._task_clients.items() if c == client_id]:
+            del self._task_clients[task_key]
+            self._task_sources.pop(task_key, None)
+            task = self.tasks.pop(task_key, None)
+            if task is not None:
                 task.stop()
-            del self.tasks[client_id]
+            with self._slot_cond:
+                self._task_slots.pop(task_key, None)
 
     def _load_tasks(self, client_id: str):
         work_dir = osp.join(self.worker_dir, f'{client_id}')
         logger.info(f'Load task class from {work_dir}')
+        if self.compression is not None:
+            with open(osp.join(work_dir, 'runtime_env.json'), encoding='utf-8') as f:
+                encodings = json.load(f).get('encodings', [GZIP])
+            self._result_compression[client_id] = self.compression.negotiate(encodings)
         for filename in [i for i in os.listdir(work_dir) if i.endswith('.py') and 'task' in i]:
             module_name = filename[:-3]  # 去掉 .py 后缀
             file_path = osp.join(work_dir, filename)
@@ -114,35 +601,226 @@ class Worker(threading.Thread):
             # 获取模块中的所有类
             for item in dir(module):
                 cls = getattr(module, item)
-                if isinstance(cls, type) and issubclass(cls, Task) and cls is not Task:
+                if isinstance(cls, type) and issubclass(cls, Task) and cls not in (Task, AsyncTask):
                     task: Task = cls()
                     try:
                         logger.info(f'Found {client_id} task => {task.name}')
                         task.init()
                         task_key = f'{client_id}_{task.name}'
                         self.tasks[task_key] = task
+                        self._task_clients[task_key] = client_id
+                        self._task_sources[task_key] = (file_path, item)
+                        with self._slot_cond:
+                            self._task_slots[task_key] = threading.BoundedSemaphore(task.max_threads)
                     except Exception as e:
                         logger.error(f'task {cls.name} init fail! => {e}')
 
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        with self._slot_cond:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name=f'{self.worker_id}-loop', daemon=True).start()
+            return self._loop
+
+    def _execute(self, meta: typing.Dict):
+        """任务类型有空闲槽位时开始执行，否则进入该类型的等待队列"""
+        task_key = meta['__task__']
+        with self._slot_cond:
+            slots = self._task_slots.get(task_key)
+            # 停止后收到的任务直接进入等待队列，随预取的任务一起归还
+            if not self.running or (slots is not None and not slots.acquire(blocking=False)):
+                self._backlog.setdefault(task_key, deque()).append(meta)
+                return
+        self._dispatch(meta, slots)
+
+    def _dispatch(self, meta: typing.Dict, slots: typing.Optional[threading.BoundedSemaphore]):
+        """AsyncTask 提交到事件循环，其余任务提交到线程池"""
+        if isinstance(self.tasks.get(meta['__task__']), AsyncTask):
+            asyncio.run_coroutine_threadsafe(self._run_async_task(meta, slots), self._event_loop())
+        else:
+            self._executor.submit(self._run_task, meta, slots)
+
+    def _release_slot(self, task_key: str, slots: typing.Optional[threading.BoundedSemaphore]):
+        """把槽位交给同类型的下一个等待任务，没有等待任务时归还"""
+        if slots is None:
+            return
+        with self._slot_cond:
+            backlog = self._backlog.get(task_key)
+            # 停止后等待队列中的任务不再执行，由 _return_prefetched 归还
+            following = backlog.popleft() if backlog and self.running else None
+            if following is None:
+                slots.release()
+        if following is not None:
+            self._dispatch(following, slots)
+
+    def _run_task(self, meta: typing.Dict, slots: typing.Optional[threading.BoundedSemaphore]):
+        # 任务执行时会从 meta 中取出路由字段
+        task_key = meta['__task__']
+        try:
+            self.handle_task(meta)
+        finally:
+            self._release_slot(task_key, slots)
+
+    async def _run_async_task(self, meta: typing.Dict, slots: typing.Optional[threading.BoundedSemaphore]):
+        task_key = meta['__task__']
+        try:
+            await self.handle_async_task(meta)
+        finally:
+            self._release_slot(task_key, slots)
+
+    def _processor(self, task_key: str, task: Task) -> typing.Optional[typing.Callable]:
+        """
+        返回把响应文本交给解析进程池的函数，未开启进程池或任务不适用时返回 None
+
+        覆写了 run 的任务无法拆分抓取与解析，仍在当前线程中完整执行
+        """
+        if self._parse_pool is None or not task.parse_in_process or task_key not in self._task_sources:
+            return None
+        if type(task).run not in (Task.run, AsyncTask.run):
+            return None
+        client_id = self._task_clients.get(task_key)
+        source = (*self._task_sources[task_key], self._packages.get(client_id, ''))
+        if isinstance(task, AsyncTask):
+            return lambda text: asyncio.wrap_future(self._parse_pool.submit(source, text))
+        return lambda text: self._parse_pool.submit(source, text).result()
+
+    def _task_done(self, meta: typing.Dict, sent: bool, elapsed: float = None, announce: bool = True):
+        """任务结束后释放执行中计数并记录耗时，未产生结果的任务不再续约"""
+        client_id = meta["__client_id__"]
+        task_key = meta['__task__']
+        shard = self._shard(client_id)
+        with self._slot_cond:
+            self.i -= 1
+            shard.running -= 1
+            self._running_tasks[task_key] -= 1
+            if elapsed is not None:
+                duration = self._durations.get(task_key)
+                if duration is not None:
+                    elapsed = duration + EWMA_ALPHA * (elapsed - duration)
+                self._durations[task_key] = elapsed
+            if not sent:
+                # 未产生结果的任务不再续约，由服务端在租约过期后重新分发
+                self._leases.discard((client_id, meta['__id__']))
+            self._slot_cond.notify_all()
+        if announce:
+            self._announce(shard)
+
     def handle_task(self, meta: typing.Dict):
+        # 任务执行时会从 meta 中取出路由字段，结束时使用副本
+        routing = dict(meta)
+        sent = False
+        start = time.time()
         try:
-            client_id = meta["__client_id__"]
-            task_key = f'{client_id}_{meta["__task__"]}'
-            task = self.tasks.get(task_key)
+            task = self.tasks.get(routing['__task__'])
             logger.info(f'Exec task {task.name}')
-            result = task.exec(meta)
+            processor = self._processor(routing['__task__'], task)
+            result = task.exec(meta) if processor is None else task.exec(meta, processor)
             logger.info(f'Exec task success!')
-            self.i -= 1
             if result:
-                self.on_result(client_id, result)
+                result['client_id'] = routing['__client_id__']
+                # 缓冲区满时阻塞，避免结果无限堆积
+                self._shard(routing['__client_id__']).results.put(result)
+                sent = True
         finally:
             traceback.print_exc()
+            self._task_done(routing, sent, time.time() - start)
+
+    async def handle_async_task(self, meta: typing.Dict):
+        routing = dict(meta)
+        sent = False
+        start = time.time()
+        try:
+            task: AsyncTask = self.tasks.get(routing['__task__'])
+            logger.info(f'Exec async task {task.name}')
+            processor = self._processor(routing['__task__'], task)
+            result = await (task.exec(meta) if processor is None else task.exec(meta, processor))
+            logger.info(f'Exec async task success!')
+            if result:
+                result['client_id'] = routing['__client_id__']
+                results = self._shard(routing['__client_id__']).results
+                try:
+                    results.put_nowait(result)
+                except queue.Full:
+                    # 缓冲区满时在线程中等待，不阻塞事件循环中的其他任务
+                    await asyncio.get_running_loop().run_in_executor(None, results.put, result)
+                sent = True
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self._task_done(routing, sent, time.time() - start)
+
+    def _wait_retry(self):
+        """获取任务失败后等待重试，停止时立即返回"""
+        with self._slot_cond:
+            self._slot_cond.wait_for(lambda: not self.running, timeout=RETRY_DELAY)
+
+    def _run_shard(self, shard: Shard):
+        """从单个主节点获取任务，stop 后不再重试，线程随之结束"""
+        while self.running:
+            if self.stream:
+                try:
+                    self.subscribe(shard)
+                except Exception as e:
+                    logger.error(f'Subscribe {shard.address} fail! => {e}')
+                    self._wait_retry()
+                continue
+            with self._slot_cond:
+                self._slot_cond.wait_for(lambda: not self.running or self._free_capacity(shard) > 0)
+                if not self.running:
+                    break
+                max_n = self._free_capacity(shard)
+            try:
+                metas = self.get_metas(max_n, shard)
+            except (ClientClosedException, NotUpdateException) as e:
+                # 控制消息已处理，立即重新获取
+                logger.warning(e)
+                continue
+            except Exception as e:
+                logger.error(f'Get meta from {shard.address} fail! => {e}')
+                self._wait_retry()
+                continue
+            if not metas:
+                # 主节点暂无可分发的任务，任务结束释放槽位或超时后再获取
+                with self._slot_cond:
+                    if self.running:
+                        self._slot_cond.wait(timeout=POLL_INTERVAL)
+                continue
+            for meta in metas:
+                self._execute(meta)
+
+    def stop(self):
+        """停止获取任务，执行中的任务完成后 run 返回，预取的任务归还给主节点"""
+        with self._slot_cond:
+            self.running = False
+            self._slot_cond.notify_all()
 
     def run(self):
         self.running = True
-        while self.running:
-            meta = self.get_meta()
-            threading.Thread(target=self.handle_task, args=(meta,)).start()
+        senders = [threading.Thread(target=self._send_results, args=(shard,), daemon=True)
+                   for shard in self.shards.values()]
+        for sender in senders:
+            sender.start()
+        threading.Thread(target=self._heartbeat, daemon=True).start()
+        # 每个主节点独立获取任务，某个主节点无任务或不可用时不影响其他主节点
+        threads = [threading.Thread(target=self._run_shard, args=(shard,), daemon=True)
+                   for shard in self.shards.values()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._return_prefetched()
+        self._executor.shutdown(wait=True)
+        with self._slot_cond:
+            # 等待事件循环中的任务结束
+            self._slot_cond.wait_for(lambda: not any(self._running_tasks.values()))
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown()
+        self._stopped = True
+        for sender in senders:
+            sender.join()
+        self._heartbeat_stop.set()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 测试公共夹具
+@Date       : 2024/11/05 10:20
+@Author     : lkkings
+@FileName:  : conftest.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import types
+
+import pytest
+
+from easycrawler.server import route_table
+from easycrawler.server.route_table import RouteTable
+from tests.helpers import PACKAGE, Clock, runtime_env
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(route_table, 'time', types.SimpleNamespace(time=clock.time))
+    return clock
+
+
+@pytest.fixture
+def table() -> RouteTable:
+    """注册客户端 A 且工作节点 w 已加载其任务包的路由表"""
+    table = RouteTable()
+    table.add_client(runtime_env(), PACKAGE)
+    table.add_worker('w', 'A', PACKAGE)
+    return table
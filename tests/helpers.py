@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 测试辅助函数
+@Date       : 2024/11/05 10:20
+@Author     : lkkings
+@FileName:  : helpers.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import hashlib
+import json
+import os.path as osp
+import time
+import typing
+import zipfile
+
+from easycrawler.protos import easycrawler_pb2
+from easycrawler.server.route_table import RouteTable
+
+PACKAGE = 'sha-a'
+
+
+class Clock:
+    """可手动推进的时钟，替换路由表中的 time 模块"""
+
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+def runtime_env(client_id: str = 'A', max_threads: int = 10, **kwargs) -> typing.Dict:
+    """只包含一个任务类型 t 的 runtime_env，默认关闭去重"""
+    env = {'client_id': client_id, 'tasks': {'t': {'max_threads': max_threads}}, 'dedup': False}
+    env.update(kwargs)
+    return env
+
+
+def make_meta(meta_id: str, client_id: str = 'A', **kwargs) -> easycrawler_pb2.Meta:
+    return easycrawler_pb2.Meta(id=meta_id, client_id=client_id, task=f'{client_id}_t', **kwargs)
+
+
+def make_result(meta: easycrawler_pb2.Meta, worker_id: str = 'w') -> easycrawler_pb2.TaskResult:
+    return easycrawler_pb2.TaskResult(id=meta.id, client_id=meta.client_id, task=meta.task, worker_id=worker_id)
+
+
+def drain(table: RouteTable, worker_id: str = 'w') -> typing.List[easycrawler_pb2.Meta]:
+    """取出工作节点当前可分发的全部任务"""
+    metas = []
+    meta = table.get_best_meta(worker_id)
+    while meta is not None:
+        metas.append(meta)
+        meta = table.get_best_meta(worker_id)
+    return metas
+
+
+def install_package(servicer, upload_dir: str, client_id: str, files: typing.Dict[str, str]) -> str:
+    """打包任务文件并在主节点注册客户端，返回任务包的 sha256"""
+    upload_path = osp.join(upload_dir, f'{client_id}.upload')
+    env = runtime_env(client_id, pip=[])
+    with zipfile.ZipFile(upload_path, 'w') as f:
+        f.writestr('runtime_env.json', json.dumps(env))
+        for name, source in files.items():
+            f.writestr(name, source)
+    with open(upload_path, 'rb') as f:
+        package = hashlib.sha256(f.read()).hexdigest()
+    servicer._install_package(client_id, upload_path, package)
+    return package
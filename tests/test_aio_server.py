@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 协程版主节点测试
+@Date       : 2024/11/05 11:45
+@Author     : lkkings
+@FileName:  : test_aio_server.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import asyncio
+import json
+
+import grpc
+
+from easycrawler.protos import easycrawler_pb2, easycrawler_pb2_grpc
+from easycrawler.server.aio_server import AsyncServiceServicer
+from easycrawler.utils.proto_util import result_to_pb
+from tests.helpers import PACKAGE, make_meta, runtime_env
+
+
+async def _serve(container_dir: str):
+    # 通知对象绑定到当前事件循环，需在循环内创建
+    servicer = AsyncServiceServicer(container_dir=container_dir, max_task_cache_size=10)
+    servicer.route_table.add_client(runtime_env(), PACKAGE)
+    server = grpc.aio.server()
+    easycrawler_pb2_grpc.add_EasyCrawlerServiceServicer_to_server(servicer, server)
+    port = server.add_insecure_port('127.0.0.1:0')
+    await server.start()
+    return servicer, server, f'127.0.0.1:{port}'
+
+
+def test_subscribe_pushes_metas_on_arrival(tmp_path):
+    async def scenario():
+        servicer, server, address = await _serve(str(tmp_path))
+        announcements = asyncio.Queue()
+
+        async def requests():
+            while True:
+                data = await announcements.get()
+                yield easycrawler_pb2.Message(data=json.dumps(data))
+
+        try:
+            async with grpc.aio.insecure_channel(address) as channel:
+                stub = easycrawler_pb2_grpc.EasyCrawlerServiceStub(channel)
+                call = stub.Subscribe(requests())
+                await announcements.put({'worker_id': 'w', 'slots': 3, 'packages': {'A': PACKAGE}})
+                # 队列为空时订阅流挂起，任务入队后立即推送，不超过声明的槽位
+                read = asyncio.ensure_future(call.read())
+                await asyncio.sleep(0.1)
+                assert not read.done()
+                reply = await stub.AddMetaBatch(iter([make_meta(str(i)) for i in range(5)]))
+                assert list(reply.codes) == [easycrawler_pb2.SUCCESS] * 5
+                assert reply.credits == 5
+                pushed = await asyncio.wait_for(read, 5)
+                assert [meta.id for meta in pushed.metas] == ['0', '1', '2']
+                result = result_to_pb({'id': '0', 'client_id': 'A', 'task': 'A_t', 'worker_id': 'w'})
+                assert (await stub.OnResultBatch(iter([result]))).code == easycrawler_pb2.SUCCESS
+                await announcements.put({'worker_id': 'w', 'slots': 1})
+                pushed = await asyncio.wait_for(call.read(), 5)
+                assert [meta.id for meta in pushed.metas] == ['3']
+                call.cancel()
+            assert servicer.route_table.get_result('A').id == '0'
+        finally:
+            await server.stop(None)
+
+    asyncio.run(scenario())
+
+
+def test_acquire_credits_wakes_on_dequeue(tmp_path):
+    async def scenario():
+        servicer, server, address = await _serve(str(tmp_path))
+        try:
+            async with grpc.aio.insecure_channel(address) as channel:
+                stub = easycrawler_pb2_grpc.EasyCrawlerServiceStub(channel)
+                await stub.AddMetaBatch(iter([make_meta(str(i)) for i in range(10)]))
+                data = json.dumps({'client_id': 'A', 'timeout': 5})
+                acquire = asyncio.ensure_future(stub.AcquireCredits(easycrawler_pb2.Message(data=data)))
+                await asyncio.sleep(0.1)
+                assert not acquire.done()
+                get = {'worker_id': 'w', 'max_n': 2, 'packages': {'A': PACKAGE}}
+                await stub.GetMetaBatch(easycrawler_pb2.Message(data=json.dumps(get)))
+                assert (await asyncio.wait_for(acquire, 5)).credits == 2
+        finally:
+            await server.stop(None)
+
+    asyncio.run(scenario())
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 客户端批量提交测试
+@Date       : 2024/11/05 11:20
+@Author     : lkkings
+@FileName:  : test_client.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import typing
+from concurrent import futures
+
+import grpc
+import pytest
+
+from easycrawler.client import client as client_module
+from easycrawler.client.client import Client
+from easycrawler.protos import easycrawler_pb2, easycrawler_pb2_grpc
+from easycrawler.utils.compress_util import GZIP, ZSTD
+from easycrawler.utils.proto_util import meta_to_pb
+
+TASK_SOURCE = '''
+from easycrawler.core import Task
+
+
+class T(Task):
+    name = 't'
+    max_threads = 1
+'''
+
+
+class ScriptedServicer(easycrawler_pb2_grpc.EasyCrawlerServiceServicer):
+    """按预设的结果码逐批应答 AddMetaBatch，并记录每批收到的任务 id"""
+
+    def __init__(self, replies: typing.List[typing.List[int]], credits: int = 100):
+        self.replies = replies
+        self.credits = credits
+        self.batches: typing.List[typing.List[str]] = []
+
+    def AddMetaBatch(self, request_iterator, context):
+        ids = [meta.id for meta in request_iterator]
+        self.batches.append(ids)
+        codes = self.replies.pop(0) if self.replies else [easycrawler_pb2.SUCCESS] * len(ids)
+        return easycrawler_pb2.Result(code=easycrawler_pb2.SUCCESS, codes=codes, credits=self.credits)
+
+    def AcquireCredits(self, request, context):
+        return easycrawler_pb2.Result(code=easycrawler_pb2.SUCCESS, credits=self.credits)
+
+
+@pytest.fixture
+def serve(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 't.py').write_text(TASK_SOURCE)
+    servers = []
+
+    def serve(servicer, **kwargs) -> Client:
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+        easycrawler_pb2_grpc.add_EasyCrawlerServiceServicer_to_server(servicer, server)
+        port = server.add_insecure_port('127.0.0.1:0')
+        server.start()
+        servers.append(server)
+        return Client(f'127.0.0.1:{port}', 'A', {'pip': [], 'tasks': ['t.py']}, **kwargs)
+
+    yield serve
+    for server in servers:
+        server.stop(None)
+
+
+def _meta(meta_id: str) -> typing.Dict:
+    return {'__id__': meta_id, '__task__': 'A_t', '__priority__': 0}
+
+
+def test_error_codes_are_resent(serve, monkeypatch):
+    monkeypatch.setattr(client_module, 'RESEND_DELAY', 0)
+    servicer = ScriptedServicer([[easycrawler_pb2.SUCCESS, easycrawler_pb2.ERROR]])
+    client = serve(servicer)
+    codes = {}
+    for meta_id in ('a', 'b'):
+        client.put_meta(_meta(meta_id), lambda code, meta_id=meta_id: codes.__setitem__(meta_id, code))
+    client.flush()
+    # 出错的任务没有回调，重新提交成功后才回调
+    assert servicer.batches == [['a', 'b'], ['b']]
+    assert codes == {'a': easycrawler_pb2.SUCCESS, 'b': easycrawler_pb2.SUCCESS}
+
+
+def test_final_codes_go_to_callback(serve):
+    servicer = ScriptedServicer([[easycrawler_pb2.SUCCESS, easycrawler_pb2.DUPLICATE]])
+    client = serve(servicer)
+    codes = []
+    for meta_id in ('a', 'b'):
+        client.put_meta(_meta(meta_id), codes.append)
+    client.flush()
+    assert servicer.batches == [['a', 'b']]
+    assert codes == [easycrawler_pb2.SUCCESS, easycrawler_pb2.DUPLICATE]
+
+
+def test_batches_are_split_by_credits(serve):
+    servicer = ScriptedServicer([], credits=2)
+    client = serve(servicer)
+    for i in range(5):
+        client.put_meta(_meta(str(i)))
+    client.flush()
+    # 每批不超过服务端授予的额度
+    assert servicer.batches == [['0', '1'], ['2', '3'], ['4']]
+
+
+def test_metas_use_a_codec_every_worker_can_decode(serve):
+    pytest.importorskip('zstandard')
+    client = serve(ScriptedServicer([]), compression={'codec': 'zstd', 'min_size': 10})
+    # 工作节点不声明可解压的算法，zstd 配置对任务负载退回 gzip，结果仍按客户端声明协商
+    assert client.compression.codec == GZIP
+    assert meta_to_pb({**_meta('a'), 'body': 'x' * 100}, client.compression).encoding == GZIP
+    assert ZSTD in client.runtime_env['encodings']
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 负载压缩与算法协商测试
+@Date       : 2024/11/05 11:40
+@Author     : lkkings
+@FileName:  : test_compression.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import os
+
+import pytest
+
+from easycrawler.utils.compress_util import GZIP, IDENTITY, UNIVERSAL_CODECS, ZSTD, Compression, decompress
+
+
+def test_small_and_incompressible_payloads_are_not_compressed():
+    compression = Compression(GZIP, min_size=100)
+    assert compression.compress(b'a' * 50) == (IDENTITY, b'a' * 50)
+    data = os.urandom(1000)
+    assert compression.compress(data) == (IDENTITY, data)
+
+
+def test_gzip_round_trip():
+    data = b'{"url": "https://h.com"}' * 100
+    encoding, compressed = Compression(GZIP).compress(data)
+    assert encoding == GZIP and len(compressed) < len(data)
+    assert decompress(encoding, compressed) == data
+
+
+def test_from_config():
+    assert Compression.from_config(None) is None
+    assert Compression.from_config({'codec': 'none'}).codec == IDENTITY
+    with pytest.raises(ValueError):
+        Compression.from_config({'codec': 'lz4'})
+    with pytest.raises(ValueError):
+        decompress('lz4', b'')
+
+
+def test_negotiate_keeps_supported_codec():
+    compression = Compression(GZIP, min_size=10)
+    assert compression.negotiate(UNIVERSAL_CODECS) is compression
+    assert Compression(IDENTITY).negotiate([]).codec == IDENTITY
+
+
+def test_zstd_falls_back_to_universal_codec():
+    pytest.importorskip('zstandard')
+    compression = Compression(ZSTD, min_size=10)
+    assert compression.negotiate([ZSTD, GZIP]) is compression
+    fallback = compression.negotiate(UNIVERSAL_CODECS)
+    assert fallback.codec == GZIP and fallback.min_size == 10
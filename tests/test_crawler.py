@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 爬虫本地任务队列测试
+@Date       : 2024/11/05 11:30
+@Author     : lkkings
+@FileName:  : test_crawler.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import json
+import os
+import os.path as osp
+import threading
+import time
+import types
+
+import pytest
+
+pytest.importorskip('yt_dlp')
+pytest.importorskip('curl_cffi')
+# 爬虫导入时加载配置，测试使用示例配置，本地队列在夹具中替换为内存实现
+os.environ.setdefault('EC_CONFIG', osp.join(osp.dirname(__file__), os.pardir, 'demo', 'conf.yaml'))
+
+import easycrawler.message as message
+from easycrawler.crawler import Crawler
+from easycrawler.protos import easycrawler_pb2
+
+
+class MemoryList:
+    def __init__(self):
+        self.items = []
+        self.lock = threading.Lock()
+
+    def append(self, value):
+        with self.lock:
+            self.items.append(value)
+
+    def pop(self):
+        with self.lock:
+            return self.items.pop(0) if self.items else None
+
+    def size(self):
+        return len(self.items)
+
+    def clear(self):
+        self.items.clear()
+
+
+class MemoryMap:
+    def __init__(self):
+        self.data = {}
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def set_if_absent(self, key, value) -> bool:
+        return self.data.setdefault(key, value) is value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def values(self):
+        return list(self.data.values())
+
+    def size(self):
+        return len(self.data)
+
+    def clear(self):
+        self.data.clear()
+
+
+@pytest.fixture
+def crawler(monkeypatch) -> Crawler:
+    """本地队列替换为内存实现，客户端只记录提交的任务"""
+    for name in ('task_queue', 'result_queue'):
+        monkeypatch.setattr(message, name, MemoryList())
+    monkeypatch.setattr(message, 'cache_queue', MemoryMap())
+    crawler = Crawler()
+    crawler.sent = []
+    crawler.client = types.SimpleNamespace(client_id='A', put_meta=lambda meta, callback: crawler.sent.append(meta))
+    return crawler
+
+
+def _wait(predicate, timeout: float = 5) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_resend_loop_drains_queue_until_down(crawler):
+    message.cache_queue.set('0', '{}')
+    sender = threading.Thread(target=crawler._resend_tasks, daemon=True)
+    sender.start()
+    # 队列为空时循环等待，不再为每次检查创建定时器线程
+    time.sleep(1.5)
+    assert not any(isinstance(thread, threading.Timer) for thread in threading.enumerate())
+    for i in range(3):
+        message.task_queue.append(json.dumps({'__id__': str(i)}))
+    assert _wait(lambda: len(crawler.sent) == 3)
+    assert [meta['__id__'] for meta in crawler.sent] == ['0', '1', '2']
+    message.cache_queue.clear()
+    sender.join(timeout=5)
+    assert not sender.is_alive()
+
+
+def test_pending_meta_is_not_sent_twice(crawler):
+    crawler._add_task('t', {'url': 'https://h.com/1'}, 0, 0)
+    crawler._add_task('t', {'url': 'https://h.com/1'}, 0, 0)
+    assert len(crawler.sent) == 1
+    assert crawler.sent[0]['__task__'] == 'A_t' and crawler.sent[0]['__host__'] == 'h.com'
+    assert message.cache_queue.size() == 1
+
+
+def test_duplicate_answer_is_final(crawler):
+    for i, code in enumerate([easycrawler_pb2.DUPLICATE, easycrawler_pb2.MAYBE_DUPLICATE]):
+        crawler._add_task('t', {'url': f'https://h.com/{i}'}, 0, 0)
+        crawler._on_meta_added(crawler.sent[-1], code)
+    # 主节点判定重复的任务从本地缓存删除，不再标记重试后重发
+    assert message.cache_queue.size() == 0
+    assert message.task_queue.size() == 0
+    assert crawler.is_down
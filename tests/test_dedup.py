@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 任务去重测试
+@Date       : 2024/11/05 10:40
+@Author     : lkkings
+@FileName:  : test_dedup.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+from easycrawler.protos import easycrawler_pb2
+from easycrawler.server.dedup import DedupFilter
+from easycrawler.server.route_table import RouteTable
+from tests.helpers import PACKAGE, make_meta, runtime_env
+
+
+def _table(dedup) -> RouteTable:
+    table = RouteTable()
+    table.add_client(runtime_env(dedup=dedup), PACKAGE)
+    return table
+
+
+def test_filter_rejects_repeated_id():
+    for exact in (False, True):
+        dedup = DedupFilter(capacity=100, exact=exact)
+        assert dedup.add('a')
+        assert not dedup.add('a')
+        assert 'a' in dedup and 'b' not in dedup
+
+
+def test_exact_filter_never_rejects_new_id():
+    # 容量极小且误判率很高，布隆层大量误判
+    bloom = DedupFilter(capacity=64, error_rate=0.5, exact=False)
+    exact = DedupFilter(capacity=64, error_rate=0.5)
+    ids = [f'id-{i}' for i in range(2000)]
+    assert sum(not bloom.add(key) for key in ids) > 0
+    assert all(exact.add(key) for key in ids)
+    assert bloom.stats()['tiers'] > 1
+
+
+def test_exact_by_default():
+    assert DedupFilter().exact
+    assert DedupFilter.from_config(None).exact
+    assert DedupFilter.from_config({'capacity': 64}).exact
+    assert not DedupFilter.from_config({'exact': False}).exact
+    assert DedupFilter.from_config(False) is None
+
+
+def test_bloom_hit_is_maybe_duplicate():
+    table = _table({'capacity': 64, 'error_rate': 0.5, 'exact': False})
+    codes = [table.add_meta(make_meta(f'id-{i}')) for i in range(2000)]
+    # 关闭精确层后布隆层命中只表示可能重复，不能作为确定重复返回
+    assert easycrawler_pb2.MAYBE_DUPLICATE in codes
+    assert easycrawler_pb2.DUPLICATE not in codes
+    assert table.all_task_cache_size == codes.count(easycrawler_pb2.SUCCESS)
+
+
+def test_exact_hit_is_duplicate():
+    table = _table({})
+    assert table.add_meta(make_meta('a')) == easycrawler_pb2.SUCCESS
+    assert table.add_meta(make_meta('a')) == easycrawler_pb2.DUPLICATE
+    assert table.counters['duplicate'] == 1
+    assert table.all_task_cache_size == 1
+
+
+def test_retry_and_replay_skip_dedup():
+    table = _table({'exact': True})
+    table.add_meta(make_meta('a'))
+    assert table.add_meta(make_meta('a', retry=True)) == easycrawler_pb2.SUCCESS
+    assert table.add_meta(make_meta('a'), replay=True) == easycrawler_pb2.SUCCESS
+    assert table.all_task_cache_size == 3
+
+
+def test_dedup_disabled():
+    table = _table(False)
+    assert table.add_meta(make_meta('a')) == easycrawler_pb2.SUCCESS
+    assert table.add_meta(make_meta('a')) == easycrawler_pb2.SUCCESS
+    assert table.stats()['clients']['A']['dedup'] is None
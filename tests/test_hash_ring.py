@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 一致性哈希环测试
+@Date       : 2024/11/05 11:20
+@Author     : lkkings
+@FileName:  : test_hash_ring.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import collections
+
+import pytest
+
+from easycrawler.client import client as client_module
+from easycrawler.client.client import Client
+from easycrawler.utils.hash_ring import HashRing, parse_addresses
+
+KEYS = [f'client-{i}' for i in range(2000)]
+
+
+def _mapping(ring: HashRing):
+    return {key: ring.get(key) for key in KEYS}
+
+
+def test_parse_addresses():
+    assert parse_addresses(' a:1, b:2 ,,') == ['a:1', 'b:2']
+    assert parse_addresses(['a:1']) == ['a:1']
+    with pytest.raises(ValueError):
+        parse_addresses(' , ')
+
+
+def test_mapping_independent_of_node_order():
+    assert _mapping(HashRing(['m0', 'm1', 'm2'])) == _mapping(HashRing(['m2', 'm0', 'm1', 'm0']))
+
+
+def test_adding_node_only_moves_keys_to_it():
+    before = _mapping(HashRing(['m0', 'm1', 'm2']))
+    after = _mapping(HashRing(['m0', 'm1', 'm2', 'm3']))
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert all(after[key] == 'm3' for key in moved)
+    # 约四分之一的键迁移到新节点
+    assert 0.15 < len(moved) / len(KEYS) < 0.35
+
+
+def test_removing_node_only_moves_its_keys():
+    before = _mapping(HashRing(['m0', 'm1', 'm2']))
+    after = _mapping(HashRing(['m0', 'm2']))
+    assert all(before[key] == 'm1' for key in KEYS if before[key] != after[key])
+
+
+def test_keys_spread_across_nodes():
+    counts = collections.Counter(_mapping(HashRing(['m0', 'm1', 'm2'])).values())
+    assert all(count > len(KEYS) / 3 * 0.7 for count in counts.values())
+
+
+def test_client_hashes_master_ids_not_addresses(monkeypatch):
+    ids = {'127.0.0.1:8001': 'm1', 'localhost:8001': 'm1', '127.0.0.1:8002': 'm2', 'localhost:8002': 'm2',
+           '10.0.0.1:8003': 'm3'}
+    monkeypatch.setattr(Client, '_master_id', staticmethod(lambda address: ids[address]))
+    ring = HashRing(['m1', 'm2', 'm3'])
+    for spelling in (['127.0.0.1:8001', '127.0.0.1:8002', '10.0.0.1:8003'],
+                     ['localhost:8002', '10.0.0.1:8003', 'localhost:8001']):
+        for key in KEYS[:200]:
+            assert ids[Client._select_master(spelling, key)] == ring.get(key)
+    assert Client._select_master(['only:1'], 'client-0') == 'only:1'
+
+
+def test_unreachable_master_fails_clearly(monkeypatch):
+    monkeypatch.setattr(client_module, 'MASTER_ID_RETRY_DELAY', 0)
+    monkeypatch.setattr(client_module, 'MASTER_ID_TIMEOUT', 1)
+    with pytest.raises(Exception, match='127.0.0.1:1'):
+        Client._select_master(['127.0.0.1:1', '127.0.0.1:2'], 'client-0')
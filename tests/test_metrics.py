@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 主节点指标测试
+@Date       : 2024/11/05 11:50
+@Author     : lkkings
+@FileName:  : test_metrics.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import urllib.error
+import urllib.request
+
+import pytest
+
+from easycrawler.server.metrics import Histogram, render_prometheus, start_http_server
+from easycrawler.server.server import ServiceServicer
+from tests.helpers import PACKAGE, make_meta, make_result, runtime_env
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram(buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 2):
+        histogram.observe(value)
+    snapshot = histogram.snapshot()
+    assert snapshot['buckets'] == [[0.1, 2], [1, 3], ['+Inf', 4]]
+    assert snapshot['count'] == 4 and snapshot['sum'] == pytest.approx(2.65)
+
+
+def _servicer(tmp_path) -> ServiceServicer:
+    servicer = ServiceServicer(container_dir=str(tmp_path))
+    servicer.route_table.add_client(runtime_env('A"1'), PACKAGE)
+    servicer.route_table.add_worker('w', 'A"1', PACKAGE)
+    for i in range(3):
+        servicer.AddMeta(make_meta(str(i), 'A"1'), None)
+    meta = servicer.route_table.get_best_meta('w')
+    servicer.OnResult(make_result(meta), None)
+    servicer.route_table.get_best_meta('w')
+    return servicer
+
+
+def test_render_prometheus(tmp_path):
+    text = render_prometheus(_servicer(tmp_path)._stats())
+    lines = text.splitlines()
+    assert 'easycrawler_queue_size 1' in lines
+    # 标签值中的引号被转义
+    assert 'easycrawler_client_queue_depth{client="A\\"1"} 1' in lines
+    assert 'easycrawler_worker_in_flight{worker="w",task="A\\"1_t"} 1' in lines
+    assert 'easycrawler_ops_total{op="result"} 1' in lines
+    # 两个任务出队，一个任务产生结果
+    assert '# TYPE easycrawler_queue_wait_seconds histogram' in lines
+    assert 'easycrawler_queue_wait_seconds_bucket{le="+Inf"} 2' in lines
+    assert 'easycrawler_result_latency_seconds_count 1' in lines
+
+
+def test_metrics_endpoint(tmp_path):
+    servicer = _servicer(tmp_path)
+    server = start_http_server(0, servicer._stats)
+    try:
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+        with urllib.request.urlopen(f'{url}/metrics') as response:
+            assert response.headers['Content-Type'].startswith('text/plain')
+            assert 'easycrawler_queue_size 1' in response.read().decode()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f'{url}/other')
+    finally:
+        server.shutdown()
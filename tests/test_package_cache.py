@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 任务包共享缓冲测试
+@Date       : 2024/11/05 11:55
+@Author     : lkkings
+@FileName:  : test_package_cache.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import os
+
+from easycrawler.server.package_cache import PackageBuffer, PackageCache
+
+
+def _package(tmp_path, name: str, size: int) -> str:
+    path = tmp_path / f'{name}.zip'
+    path.write_bytes(os.urandom(size))
+    return str(path)
+
+
+def test_buffer_chunks_are_shared(tmp_path):
+    path = _package(tmp_path, 'p', 2500)
+    buffer = PackageBuffer('p', path, chunk_size=1000)
+    assert len(buffer) == 3
+    chunks = list(buffer)
+    # 并发 Pull 复用同一组数据块
+    assert all(a is b for a, b in zip(chunks, buffer))
+    assert b''.join(chunk.data for chunk in chunks) == open(path, 'rb').read()
+    assert {chunk.sha256 for chunk in chunks} == {'p'}
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = PackageCache(max_bytes=2500)
+    paths = {name: _package(tmp_path, name, 1000) for name in 'abc'}
+    first = cache.get('a', paths['a'])
+    cache.get('b', paths['b'])
+    assert cache.get('a', paths['a']) is first
+    cache.get('c', paths['c'])
+    assert list(cache._buffers) == ['a', 'c']
+    # 已淘汰的缓冲仍可被进行中的 Pull 读完
+    assert len(b''.join(chunk.data for chunk in first)) == 1000
+
+
+def test_evict_removes_buffer(tmp_path):
+    cache = PackageCache()
+    cache.get('a', _package(tmp_path, 'a', 1000))
+    cache.evict('a')
+    cache.evict('missing')
+    assert cache._size == 0 and not cache._buffers
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 解析进程池测试
+@Date       : 2024/11/05 12:05
+@Author     : lkkings
+@FileName:  : test_parse_pool.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import asyncio
+import os
+
+import pytest
+
+from easycrawler.core import AsyncTask, Task
+from easycrawler.worker import Worker
+from easycrawler.worker.parse_pool import ParsePool
+
+TASK_SOURCE = '''
+import os
+
+from easycrawler.core import AsyncTask, Task
+
+
+class P(Task):
+    name = 'p'
+
+    def process(self, text):
+        return [{'text': text, 'pid': os.getpid(), 'version': %d}]
+
+
+class AP(AsyncTask):
+    name = 'ap'
+
+    async def process(self, text):
+        return [{'text': text, 'pid': os.getpid()}]
+'''
+
+
+@pytest.fixture
+def pool():
+    pool = ParsePool(1)
+    yield pool
+    pool.shutdown()
+
+
+def _write(tmp_path, version: int = 1) -> str:
+    path = tmp_path / 'p_task.py'
+    path.write_text(TASK_SOURCE % version)
+    return str(path)
+
+
+def test_process_runs_in_child_process(tmp_path, pool):
+    path = _write(tmp_path)
+    [item] = pool.submit((path, 'P', 'sha1'), 'x').result(timeout=60)
+    assert item['text'] == 'x' and item['pid'] != os.getpid()
+    # 协程形式的 parse 在子进程内执行完再返回
+    [item] = pool.submit((path, 'AP', 'sha1'), 'y').result(timeout=60)
+    assert item['text'] == 'y' and item['pid'] != os.getpid()
+
+
+def test_package_update_reloads_task(tmp_path, pool):
+    path = _write(tmp_path, 1)
+    assert pool.submit((path, 'P', 'sha1'), 'x').result(timeout=60)[0]['version'] == 1
+    _write(tmp_path, 2)
+    # 任务包未变化时沿用已加载的实例，任务包更新后重新加载
+    assert pool.submit((path, 'P', 'sha1'), 'x').result(timeout=60)[0]['version'] == 1
+    assert pool.submit((path, 'P', 'sha2'), 'x').result(timeout=60)[0]['version'] == 2
+
+
+class Inline(Task):
+    name = 'inline'
+    parse_in_process = False
+
+
+class CustomRun(Task):
+    name = 'custom'
+
+    def run(self, meta, processor=None):
+        return []
+
+
+def test_processor_only_for_splittable_tasks(tmp_path):
+    path = _write(tmp_path)
+    worker = Worker('w', '127.0.0.1:1', worker_dir=str(tmp_path / 'w'), parse_processes=1)
+    try:
+        worker.tasks = {}
+        tasks = {'A_p': Task(), 'A_ap': AsyncTask(), 'A_inline': Inline(), 'A_custom': CustomRun(), 'A_none': Task()}
+        for task_key in tasks:
+            worker._task_clients[task_key] = 'A'
+            if task_key != 'A_none':
+                worker._task_sources[task_key] = (path, 'P')
+        worker._task_sources['A_ap'] = (path, 'AP')
+        processors = {task_key: worker._processor(task_key, task) for task_key, task in tasks.items()}
+        # 关闭进程内解析、覆写了 run 或没有来源文件的任务在当前线程中完整执行
+        assert {task_key for task_key, processor in processors.items() if processor} == {'A_p', 'A_ap'}
+        assert processors['A_p']('x')[0]['pid'] != os.getpid()
+
+        async def parse():
+            return await processors['A_ap']('y')
+
+        assert asyncio.run(parse())[0]['text'] == 'y'
+    finally:
+        worker._parse_pool.shutdown()
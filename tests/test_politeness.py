@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 时间轮与域名限速测试
+@Date       : 2024/11/05 10:50
+@Author     : lkkings
+@FileName:  : test_politeness.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+from easycrawler.server.politeness import HostScheduler, TimerWheel
+
+NOW = 1000.0
+
+
+def test_timer_wheel_expires_in_order_of_ticks():
+    wheel = TimerWheel(tick=0.1, slots=8, now=NOW)
+    wheel.schedule(NOW + 0.25, 'a')
+    wheel.schedule(NOW + 0.55, 'b')
+    assert len(wheel) == 2
+    assert wheel.advance(NOW + 0.2) == []
+    assert wheel.advance(NOW + 0.35) == ['a']
+    assert wheel.advance(NOW + 0.65) == ['b']
+    assert len(wheel) == 0
+
+
+def test_timer_wheel_keeps_items_beyond_one_round():
+    wheel = TimerWheel(tick=0.1, slots=8, now=NOW)
+    # 超过一圈的定时项与一圈内的定时项落在同一槽
+    wheel.schedule(NOW + 0.3, 'near')
+    wheel.schedule(NOW + 1.1, 'far')
+    assert wheel.advance(NOW + 0.35) == ['near']
+    assert wheel.advance(NOW + 0.9) == []
+    assert wheel.advance(NOW + 5) == ['far']
+
+
+def test_past_deadline_expires_on_next_tick():
+    wheel = TimerWheel(tick=0.1, slots=8, now=NOW)
+    wheel.schedule(NOW - 1, 'late')
+    assert wheel.advance(NOW + 0.15) == ['late']
+
+
+def test_host_scheduler_limits_each_host():
+    hosts = HostScheduler(tick=0.05, now=NOW)
+    hosts.configure('A', {'max_calls': 2, 'period': 1, 'hosts': {'fast.com': {'max_calls': 10, 'period': 1}}})
+    assert [hosts.acquire('A', 'h.com', NOW) for _ in range(2)] == [0, 0]
+    wait = hosts.acquire('A', 'h.com', NOW)
+    assert 0 < wait <= 0.5
+    assert all(hosts.acquire('A', 'fast.com', NOW) == 0 for _ in range(10))
+    # 未配置的客户端与没有域名的任务不限速
+    assert hosts.acquire('B', 'h.com', NOW) == 0
+    assert hosts.acquire('A', '', NOW) == 0
+
+
+def test_host_scheduler_pauses_once_and_releases():
+    hosts = HostScheduler(tick=0.05, now=NOW)
+    hosts.configure('A', {'max_calls': 1, 'period': 1})
+    hosts.acquire('A', 'h.com', NOW)
+    wait = hosts.acquire('A', 'h.com', NOW)
+    hosts.pause('A', 'h.com', wait, NOW)
+    hosts.pause('A', 'h.com', wait, NOW)
+    assert len(hosts) == 1
+    assert hosts.release(NOW + wait / 2) == []
+    assert hosts.release(NOW + wait + hosts.tick) == [('A', 'h.com')]
+    assert len(hosts) == 0
+    assert hosts.acquire('A', 'h.com', NOW + wait + hosts.tick) == 0
+
+
+def test_host_scheduler_remove_client():
+    hosts = HostScheduler(tick=0.05, now=NOW)
+    hosts.configure('A', {'max_calls': 1, 'period': 1})
+    hosts.acquire('A', 'h.com', NOW)
+    hosts.pause('A', 'h.com', 1, NOW)
+    hosts.remove('A')
+    assert len(hosts) == 0
+    assert hosts.release(NOW + 2) == []
+    assert hosts.acquire('A', 'h.com', NOW) == 0
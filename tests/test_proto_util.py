@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 任务与结果的 protobuf 转换测试
+@Date       : 2024/11/05 11:35
+@Author     : lkkings
+@FileName:  : test_proto_util.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+from easycrawler.utils.compress_util import GZIP, IDENTITY, Compression
+from easycrawler.utils.proto_util import meta_to_pb, pb_to_meta, pb_to_result, result_to_pb
+
+
+def test_meta_round_trip():
+    meta = {'__id__': 'x', '__client_id__': 'A', '__task__': 'A_t', '__priority__': 3, '__depth__': 2,
+            '__host__': 'h.com', '__retry__': True, 'url': 'https://h.com/页面'}
+    pb = meta_to_pb(meta)
+    # 路由字段写入消息字段，服务端无需解析负载
+    assert (pb.id, pb.task, pb.priority, pb.host, pb.retry) == ('x', 'A_t', 3, 'h.com', True)
+    assert pb.encoding == IDENTITY
+    assert pb_to_meta(pb) == {**meta, '__worker_id__': ''}
+
+
+def test_large_payload_is_compressed():
+    meta = {'__id__': 'x', '__task__': 'A_t', 'body': 'a' * 4096}
+    pb = meta_to_pb(meta, Compression(GZIP))
+    assert pb.encoding == GZIP and len(pb.payload) < 4096
+    assert pb_to_meta(pb)['body'] == 'a' * 4096
+
+
+def test_result_round_trip():
+    result = {'id': 'x', 'client_id': 'A', 'task': 'A_t', 'worker_id': 'w', 'items': [{'n': 1}] * 200}
+    pb = result_to_pb(result, Compression(GZIP))
+    assert pb.encoding == GZIP
+    assert pb_to_result(pb) == result
+
+
+def test_missing_payload():
+    pb = result_to_pb({'id': 'x', 'client_id': 'A'})
+    pb.ClearField('payload')
+    assert pb_to_result(pb) == {'id': 'x', 'client_id': 'A', 'task': '', 'worker_id': ''}
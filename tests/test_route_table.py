@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 路由表的调度测试
+@Date       : 2024/11/05 10:30
+@Author     : lkkings
+@FileName:  : test_route_table.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+from easycrawler.server.route_table import FrontierQueue, HostFrontierQueue, RouteTable
+from tests.helpers import PACKAGE, drain, make_meta, make_result, runtime_env
+
+
+def test_max_threads_caps_in_flight():
+    table = RouteTable()
+    table.add_client(runtime_env(max_threads=2), PACKAGE)
+    table.add_worker('w', 'A', PACKAGE)
+    for i in range(3):
+        table.add_meta(make_meta(str(i)))
+    first, second = drain(table)
+    assert table.all_task_cache_size == 1
+    table.update(make_result(first))
+    assert table.get_best_meta('w').id == '2'
+
+
+def test_clients_take_turns(table):
+    table.add_client(runtime_env('B'), PACKAGE)
+    table.add_worker('w', 'B', PACKAGE)
+    for i in range(3):
+        table.add_meta(make_meta(f'a{i}', 'A'))
+        table.add_meta(make_meta(f'b{i}', 'B'))
+    assert [meta.client_id for meta in drain(table)] == ['A', 'B'] * 3
+
+
+def test_result_is_delivered_to_client(table):
+    table.add_meta(make_meta('0'))
+    meta = table.get_best_meta('w')
+    table.update(make_result(meta))
+    assert table.get_result('A').id == '0'
+    assert table.get_result('A') is None
+    assert table.counters['result'] == 1
+
+
+def test_remove_client_drops_queues_and_leases(table):
+    for i in range(3):
+        table.add_meta(make_meta(str(i)))
+    table.get_best_meta('w')
+    table.remove('A')
+    assert table.all_task_cache_size == 0
+    assert table.closed_worker_of_client == {'w': 'A'}
+    assert table.stats()['workers']['w']['in_flight'] == 0
+
+
+def test_expired_lease_is_redelivered_first(clock):
+    table = RouteTable(lease_timeout=10)
+    table.add_client(runtime_env(), PACKAGE)
+    table.add_worker('w', 'A', PACKAGE)
+    table.add_meta(make_meta('0'))
+    table.add_meta(make_meta('1'))
+    assert table.get_best_meta('w').id == '0'
+    clock.advance(5)
+    assert table.requeue_expired() == 0
+    # 续约后从续约时刻重新计时
+    table.heartbeat('w', [('A', '0')])
+    clock.advance(9)
+    assert table.requeue_expired() == 0
+    clock.advance(2)
+    assert table.requeue_expired() == 1
+    assert table.counters['requeue'] == 1
+    # 重新入队的任务放回队首
+    assert [meta.id for meta in drain(table)] == ['0', '1']
+
+
+def test_result_releases_lease(clock):
+    table = RouteTable(lease_timeout=10)
+    table.add_client(runtime_env(), PACKAGE)
+    table.add_worker('w', 'A', PACKAGE)
+    table.add_meta(make_meta('0'))
+    table.update(make_result(table.get_best_meta('w')))
+    clock.advance(20)
+    assert table.requeue_expired() == 0
+    assert table.snapshot_metas() == []
+
+
+def test_same_id_does_not_overwrite_live_lease():
+    table = RouteTable()
+    table.add_client(runtime_env(max_threads=2), PACKAGE)
+    table.add_worker('w', 'A', PACKAGE)
+    table.add_meta(make_meta('x'))
+    table.add_meta(make_meta('x'))
+    assert table.get_best_meta('w').id == 'x'
+    # 第二个相同 id 的任务被丢弃，不覆盖执行中的租约
+    assert table.get_best_meta('w') is None
+    assert table.counters['duplicate'] == 1
+    assert table.all_task_cache_size == 0
+    table.update(make_result(make_meta('x')))
+    stats = table.stats()['workers']['w']
+    assert stats['in_flight'] == 0 and stats['tasks'] == {}
+
+
+def test_frontier_queue_orders_by_key_then_fifo():
+    queue = FrontierQueue()
+    for key, item in [((1,), 'a'), ((0,), 'b'), ((1,), 'c'), ((0,), 'd')]:
+        queue.append(key, item)
+    queue.appendleft((1,), 'e')
+    assert len(queue) == 5
+    assert queue.peek() == 'b'
+    assert [queue.popleft() for _ in range(5)] == ['b', 'd', 'e', 'a', 'c']
+    assert len(queue) == 0
+
+
+def test_priority_frontier(table):
+    for i, priority in enumerate([0, 5, 1, 5]):
+        table.add_meta(make_meta(str(i), priority=priority))
+    assert [meta.id for meta in drain(table)] == ['1', '3', '2', '0']
+
+
+def test_bfs_and_dfs_frontier():
+    for policy, expected in [('bfs', ['0', '2', '1']), ('dfs', ['1', '2', '0'])]:
+        table = RouteTable()
+        table.add_client(runtime_env(frontier=policy), PACKAGE)
+        table.add_worker('w', 'A', PACKAGE)
+        for i, depth in enumerate([0, 2, 1]):
+            table.add_meta(make_meta(str(i), depth=depth))
+        assert [meta.id for meta in drain(table)] == expected
+
+
+def test_policy_change_reorders_queued_metas(table):
+    for i, depth in enumerate([0, 2, 1]):
+        table.add_meta(make_meta(str(i), depth=depth))
+    table.add_client(runtime_env(frontier='dfs'), PACKAGE)
+    assert table.stats()['clients']['A']['frontier'] == 'dfs'
+    assert [meta.id for meta in drain(table)] == ['1', '2', '0']
+
+
+def test_host_frontier_queue_skips_paused_hosts():
+    queue = HostFrontierQueue()
+    queue.append((0,), 'h1-0', 'h1')
+    queue.append((0,), 'h1-1', 'h1')
+    queue.append((1,), 'h2-0', 'h2')
+    queue.pause('h1')
+    assert queue.peek_key() == (1,)
+    assert queue.paused_sizes() == {'h1': 2}
+    assert queue.popleft() == 'h2-0'
+    # 全部域名都已挂起
+    assert queue.peek_key() is None
+    queue.resume('h1')
+    assert [queue.popleft(), queue.popleft()] == ['h1-0', 'h1-1']
+    assert len(queue) == 0 and queue.peek_key() is None
+
+
+def test_host_frontier_queue_reorders_when_head_changes():
+    queue = HostFrontierQueue()
+    queue.append((1,), 'h1-low', 'h1')
+    queue.append((0,), 'h2-high', 'h2')
+    queue.append((2,), 'h2-lower', 'h2')
+    # h1 出现更小的键后应排在 h2 之前
+    queue.append((-1,), 'h1-highest', 'h1')
+    assert [queue.popleft() for _ in range(4)] == ['h1-highest', 'h2-high', 'h1-low', 'h2-lower']
+
+
+def test_throttled_host_waits_in_place(clock):
+    table = RouteTable()
+    table.add_client(runtime_env(max_threads=10 ** 6, politeness={'max_calls': 1, 'period': 1}), PACKAGE)
+    table.add_worker('w', 'A', PACKAGE)
+    for i in range(1000):
+        table.add_meta(make_meta(f'h{i}', host='h.com', priority=i % 3))
+    table.add_meta(make_meta('other', host='o.com'))
+    assert table.get_best_meta('w').id == 'h2'
+    # h.com 挂起后其余域名立即可分发，h.com 的任务留在原队列中
+    assert table.get_best_meta('w').id == 'other'
+    assert table.get_best_meta('w') is None
+    assert table.counters['host_delay'] == 1
+    assert table.stats()['clients']['A']['host_delayed'] == {'h.com': 999}
+    dispatched = []
+    for _ in range(20):
+        clock.advance(1.1)
+        table.release_delayed(clock.now)
+        dispatched.extend(meta.id for meta in drain(table))
+    # 每秒只分发一个，且保持优先级与先进先出顺序
+    assert dispatched == [f'h{i}' for i in range(5, 65, 3)]
+
+
+def test_worker_without_package_gets_nothing(table):
+    table.add_meta(make_meta('0'))
+    assert table.get_best_meta('other') is None
+    assert table.find_pending_clients('other') == ['A']
+    assert table.find_pending_clients('w') == []
+
+
+def test_reported_capacity_limits_dispatch(table):
+    for i in range(5):
+        table.add_meta(make_meta(str(i)))
+    table.report('w', capacity={'A_t': 2})
+    assert len(drain(table)) == 2
+
+
+def test_give_back_returns_meta_to_front(table):
+    for i in range(3):
+        table.add_meta(make_meta(str(i)))
+    first, second = table.get_best_meta('w'), table.get_best_meta('w')
+    assert table.give_back('w', [('A', second.id)]) == 1
+    assert table.counters['returned'] == 1
+    assert table.get_best_meta('w').id == second.id
+    assert table.stats()['workers']['w']['in_flight'] == 2
+
+
+def test_prefetch_depth_raises_in_flight_cap():
+    table = RouteTable()
+    table.add_client(runtime_env(max_threads=2), PACKAGE)
+    table.add_worker('w', 'A', PACKAGE)
+    for i in range(5):
+        table.add_meta(make_meta(str(i)))
+    table.report('w', prefetch={'A_t': 1})
+    assert len(drain(table)) == 3
+
+
+def test_dead_worker_leases_are_reclaimed(clock):
+    table = RouteTable(worker_timeout=30)
+    table.add_client(runtime_env(), PACKAGE)
+    table.add_worker('w', 'A', PACKAGE)
+    table.add_worker('w2', 'A', PACKAGE)
+    table.add_meta(make_meta('0'))
+    table.heartbeat('w', [], {'running': {}, 'free_slots': 1})
+    assert table.get_best_meta('w').id == '0'
+    clock.advance(31)
+    assert table.expire_workers() == ['w']
+    assert table.counters['dead_worker'] == 1
+    assert table.get_best_meta('w2').id == '0'
+
+
+def test_overloaded_worker_gets_no_prefetch():
+    table = RouteTable(cpu_limit=90)
+    table.add_client(runtime_env(max_threads=2), PACKAGE)
+    table.add_worker('w', 'A', PACKAGE)
+    for i in range(5):
+        table.add_meta(make_meta(str(i)))
+    table.report('w', prefetch={'A_t': 2})
+    table.heartbeat('w', [], {'cpu': 95})
+    assert len(drain(table)) == 2
+    assert table.stats()['workers']['w']['status']['overloaded']
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 分段日志与主节点日志恢复测试
+@Date       : 2024/11/05 11:00
+@Author     : lkkings
+@FileName:  : test_segment_log.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import json
+import os
+import os.path as osp
+
+from easycrawler.protos import easycrawler_pb2
+from easycrawler.server.segment_log import HEADER, OP_ADD, OP_DEL_CLIENT, OP_DONE, SegmentLog
+from easycrawler.server.server import ServiceServicer
+from tests.helpers import PACKAGE, make_meta, make_result, runtime_env
+
+SEGMENT_SIZE = 4096
+
+
+def _records(n: int):
+    return [(OP_ADD, f'record-{i}'.encode()) for i in range(n)]
+
+
+def _truncate_last(log_dir: str, records, keep: int):
+    """截断首个分段，最后一条记录只保留负载的前 keep 字节，模拟写入中途崩溃"""
+    size = sum(HEADER.size + len(payload) for _, payload in records)
+    path = osp.join(log_dir, sorted(os.listdir(log_dir))[0])
+    os.truncate(path, size - len(records[-1][1]) + keep)
+
+
+def test_replay_in_write_order(tmp_path):
+    log = SegmentLog(str(tmp_path), SEGMENT_SIZE)
+    records = [(OP_ADD, os.urandom(100)) for _ in range(100)]
+    for i in range(0, 100, 10):
+        log.append(records[i:i + 10])
+    log.close()
+    # 每个分段最多容纳 37 条记录
+    assert log.segment_count == 3
+    assert list(SegmentLog(str(tmp_path), SEGMENT_SIZE).replay()) == records
+
+
+def test_replay_after_truncation(tmp_path):
+    log = SegmentLog(str(tmp_path), SEGMENT_SIZE)
+    records = _records(5)
+    log.append(records)
+    log.close()
+    _truncate_last(str(tmp_path), records, 3)
+    # 不完整的最后一条记录被忽略，之后重新打开的日志仍可追加与回放
+    log = SegmentLog(str(tmp_path), SEGMENT_SIZE)
+    assert list(log.replay()) == records[:4]
+    log.append([(OP_DONE, b'done')])
+    log.close()
+    assert list(SegmentLog(str(tmp_path), SEGMENT_SIZE).replay()) == records[:4] + [(OP_DONE, b'done')]
+
+
+def test_replay_stops_at_corrupted_record(tmp_path):
+    log = SegmentLog(str(tmp_path), SEGMENT_SIZE)
+    records = _records(3)
+    log.append(records)
+    log.close()
+    path = osp.join(str(tmp_path), sorted(os.listdir(str(tmp_path)))[0])
+    offset = 2 * HEADER.size + len(records[0][1]) + 1
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        f.write(b'X')
+    assert list(SegmentLog(str(tmp_path), SEGMENT_SIZE).replay()) == records[:1]
+
+
+def test_compact_keeps_only_snapshot(tmp_path):
+    log = SegmentLog(str(tmp_path), SEGMENT_SIZE)
+    log.append(_records(50))
+    snapshot = [(OP_ADD, b'kept')]
+    log.compact(lambda: snapshot)
+    log.append([(OP_DEL_CLIENT, b'A')])
+    log.close()
+    assert list(SegmentLog(str(tmp_path), SEGMENT_SIZE).replay()) == snapshot + [(OP_DEL_CLIENT, b'A')]
+
+
+def _servicer(container_dir: str) -> ServiceServicer:
+    os.makedirs(osp.join(container_dir, 'A'), exist_ok=True)
+    env = runtime_env(dedup={'exact': True})
+    with open(osp.join(container_dir, 'A', 'runtime_env.json'), 'w') as f:
+        json.dump(env, f)
+    with open(osp.join(container_dir, 'A.sha256'), 'w') as f:
+        f.write(PACKAGE)
+    servicer = ServiceServicer(container_dir=container_dir, wal=True)
+    if not servicer.route_table.client_is_exist('A'):
+        servicer.route_table.add_client(env, PACKAGE)
+    return servicer
+
+
+def test_master_recovers_after_truncated_log(tmp_path):
+    servicer = _servicer(str(tmp_path))
+    metas = [make_meta(str(i)) for i in range(5)]
+    for meta in metas[:4]:
+        servicer.AddMeta(meta, None)
+    servicer.route_table.add_worker('w', 'A', PACKAGE)
+    servicer.OnResult(make_result(servicer.route_table.get_best_meta('w')), None)
+    servicer.AddMeta(metas[4], None)
+    servicer.wal.close()
+    # 启动时的日志压缩只留下当前分段，截断其中最后一条 ADD，模拟写到一半时崩溃
+    log_dir = osp.join(str(tmp_path), 'wal')
+    path = osp.join(log_dir, sorted(os.listdir(log_dir))[-1])
+    with open(path, 'rb') as f:
+        data = f.read()
+    last = metas[4].SerializeToString()
+    os.truncate(path, data.rindex(last) + len(last) - 2)
+
+    recovered = _servicer(str(tmp_path))
+    assert {meta.id for meta in recovered.route_table.snapshot_metas()} == {'1', '2', '3'}
+    # 恢复的任务重新登记到去重过滤器
+    assert recovered.route_table.add_meta(make_meta('1')) == easycrawler_pb2.DUPLICATE
+    assert recovered.route_table.add_meta(make_meta('4')) == easycrawler_pb2.SUCCESS
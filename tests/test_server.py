@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 主节点分发接口测试
+@Date       : 2024/11/05 11:10
+@Author     : lkkings
+@FileName:  : test_server.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import json
+import os
+import os.path as osp
+import threading
+import time
+import types
+
+import pytest
+
+from easycrawler.protos import easycrawler_pb2
+from easycrawler.server.server import ServiceServicer
+from tests.helpers import PACKAGE, install_package, make_meta, runtime_env
+
+
+@pytest.fixture
+def servicer(tmp_path) -> ServiceServicer:
+    servicer = ServiceServicer(container_dir=str(tmp_path), master_id='m0')
+    for client_id in ('A', 'B'):
+        servicer.route_table.add_client(runtime_env(client_id), PACKAGE)
+    return servicer
+
+
+def _get_metas(servicer: ServiceServicer, packages, max_n: int = 5) -> easycrawler_pb2.MetaReply:
+    data = {'worker_id': 'w', 'max_n': max_n, 'packages': {client_id: PACKAGE for client_id in packages}}
+    return servicer.GetMetaBatch(easycrawler_pb2.Message(data=json.dumps(data)), None)
+
+
+def test_busy_worker_is_told_about_pending_clients(servicer):
+    for i in range(500):
+        servicer.AddMeta(make_meta(str(i), 'A'), None)
+    servicer.AddMeta(make_meta('0', 'B'), None)
+    # 工作节点始终有 A 的任务可执行，随任务下发的 message 通知其加载 B
+    reply = _get_metas(servicer, ['A'])
+    assert reply.code == easycrawler_pb2.SUCCESS
+    assert len(reply.metas) == 5
+    assert reply.message == 'B'
+    reply = _get_metas(servicer, ['A', 'B'])
+    assert 'B' in {meta.client_id for meta in reply.metas}
+    assert reply.message == ''
+
+
+def test_idle_worker_is_asked_to_pull(servicer):
+    servicer.AddMeta(make_meta('0', 'B'), None)
+    reply = _get_metas(servicer, ['A'])
+    assert reply.code == easycrawler_pb2.WORKER_NOT_UPDATE
+    assert reply.message == 'B'
+
+
+def test_empty_queue(servicer):
+    reply = _get_metas(servicer, ['A', 'B'])
+    assert reply.code == easycrawler_pb2.TASK_QUEUE_EMPTY
+
+
+def test_stats_report_master_id(servicer):
+    reply = servicer.Stats(easycrawler_pb2.Message(), None)
+    assert json.loads(reply.message)['master_id'] == 'm0'
+
+
+def _packages(servicer: ServiceServicer):
+    return sorted(name[:-4] for name in os.listdir(servicer.package_dir) if name.endswith('.zip'))
+
+
+def test_unreferenced_packages_are_removed(tmp_path):
+    servicer = ServiceServicer(container_dir=str(tmp_path / 'master'))
+    upload_dir = str(tmp_path)
+    old = install_package(servicer, upload_dir, 'A', {'t_task.py': 'v1'})
+    servicer.package_cache.get(old, servicer._package_path(old))
+    new = install_package(servicer, upload_dir, 'A', {'t_task.py': 'v2'})
+    # 更新后旧版本不再被引用，从磁盘与共享缓冲中删除
+    assert _packages(servicer) == [new]
+    assert old not in servicer.package_cache._buffers
+    # 重新上传相同的任务包不会删除正在使用的任务包
+    install_package(servicer, upload_dir, 'A', {'t_task.py': 'v2'})
+    assert _packages(servicer) == [new]
+    servicer.DelClient(easycrawler_pb2.Message(data='A'), None)
+    assert _packages(servicer) == []
+    assert not osp.exists(osp.join(servicer.container_dir, 'A.sha256'))
+    assert not osp.exists(osp.join(servicer.container_dir, 'A'))
+
+
+def test_package_shared_by_clients_is_kept(tmp_path):
+    servicer = ServiceServicer(container_dir=str(tmp_path / 'master'))
+    package = install_package(servicer, str(tmp_path), 'A', {'t_task.py': 'v1'})
+    # 内容相同的任务包只保存一份，仍被其他客户端引用时不删除
+    servicer.route_table.add_client(runtime_env('B'), package)
+    servicer.DelClient(easycrawler_pb2.Message(data='A'), None)
+    assert _packages(servicer) == [package]
+
+
+def _acquire(servicer: ServiceServicer, client_id: str, timeout: float) -> easycrawler_pb2.Result:
+    data = json.dumps({'client_id': client_id, 'timeout': timeout})
+    context = types.SimpleNamespace(is_active=lambda: True)
+    return servicer.AcquireCredits(easycrawler_pb2.Message(data=data), context)
+
+
+def test_credits_are_shared_between_clients(tmp_path):
+    servicer = ServiceServicer(max_task_cache_size=10, container_dir=str(tmp_path))
+    for client_id in ('A', 'B'):
+        servicer.route_table.add_client(runtime_env(client_id), PACKAGE)
+    reply = servicer.AddMetaBatch(iter([make_meta(str(i)) for i in range(3)]), None)
+    # 任务缓存按客户端数均分，额度为份额减去排队任务数
+    assert reply.credits == 2
+    assert _acquire(servicer, 'B', 0).credits == 5
+    servicer.AddMetaBatch(iter([make_meta(str(i)) for i in range(3, 5)]), None)
+    assert _acquire(servicer, 'A', 0).credits == 0
+
+
+def test_acquire_credits_waits_for_dequeue(tmp_path):
+    servicer = ServiceServicer(max_task_cache_size=2, container_dir=str(tmp_path))
+    servicer.route_table.add_client(runtime_env(), PACKAGE)
+    servicer.AddMetaBatch(iter([make_meta('0'), make_meta('1')]), None)
+    start = time.time()
+    assert _acquire(servicer, 'A', 0.2).credits == 0
+    assert time.time() - start >= 0.2
+    # 工作节点取走任务后唤醒等待额度的客户端
+    threading.Timer(0.2, _get_metas, (servicer, ['A'], 1)).start()
+    assert _acquire(servicer, 'A', 5).credits == 1
+    assert _acquire(servicer, 'missing', 0).code == easycrawler_pb2.CLIENT_NOT_FOUND
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 工作节点测试
+@Date       : 2024/11/05 11:30
+@Author     : lkkings
+@FileName:  : test_worker.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import json
+import os
+import os.path as osp
+import threading
+import time
+from concurrent import futures
+
+import grpc
+import pytest
+
+from easycrawler.core import Task
+from easycrawler.protos import easycrawler_pb2, easycrawler_pb2_grpc
+from easycrawler.server.server import ServiceServicer
+from easycrawler.worker import Worker
+from easycrawler.worker import worker as worker_module
+from tests.helpers import install_package
+
+TASK_SOURCE = '''
+from easycrawler.core import Task
+
+
+class T(Task):
+    name = 't'
+    max_threads = 2
+'''
+
+
+def _meta(meta_id: str, client_id: str = 'A', task: str = 't'):
+    return {'__id__': meta_id, '__client_id__': client_id, '__task__': f'{client_id}_{task}', '__worker_id__': 'w'}
+
+
+def test_replies_follow_delivering_master(tmp_path):
+    # 两个地址指向同一主节点的不同写法，工作节点不再按地址文本重新分片
+    worker = Worker('w', ['127.0.0.1:1', 'localhost:1'], worker_dir=str(tmp_path))
+    first, second = worker.shards.values()
+    worker._packages['A'] = 'sha-a'
+    worker._accept([_meta('0')], second)
+    assert worker._shard('A') is second
+    assert second.running == 1 and first.running == 0
+    assert worker._report(second)['packages'] == {'A': 'sha-a'}
+    assert worker._report(first)['packages'] == {}
+
+
+class RecordingMaster(ServiceServicer):
+    """记录每次 Pull 声明的已缓存任务包与心跳归还的任务"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pulls = []
+        self.returned = []
+
+    def Pull(self, message, context):
+        self.pulls.append(json.loads(message.data)['cached'])
+        yield from super().Pull(message, context)
+
+    def Heartbeat(self, message, context):
+        self.returned.extend(json.loads(message.data).get('returned', []))
+        return super().Heartbeat(message, context)
+
+
+@pytest.fixture
+def master(tmp_path):
+    servicer = RecordingMaster(container_dir=str(tmp_path / 'master'))
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+    easycrawler_pb2_grpc.add_EasyCrawlerServiceServicer_to_server(servicer, server)
+    servicer.address = f"127.0.0.1:{server.add_insecure_port('127.0.0.1:0')}"
+    server.start()
+    yield servicer
+    server.stop(None)
+
+
+def _worker(tmp_path, address: str) -> Worker:
+    worker = Worker('w', address, worker_dir=str(tmp_path / 'worker'))
+    worker.running = True
+    return worker
+
+
+def test_pull_loads_package(master, tmp_path):
+    package = install_package(master, str(tmp_path), 'A', {'t_task.py': TASK_SOURCE})
+    worker = _worker(tmp_path, master.address)
+    assert worker.pull('A', worker.shards[master.address])
+    assert worker._packages == {'A': package}
+    assert worker.tasks['A_t'].max_threads == 2
+
+
+def test_pull_failures_are_not_retried(master, tmp_path):
+    install_package(master, str(tmp_path), 'B', {'t_task.py': 'raise ImportError("broken")'})
+    worker = _worker(tmp_path, master.address)
+    shard = worker.shards[master.address]
+    start = time.time()
+    # 客户端不存在与任务导入失败都不会因重试恢复，立即返回
+    assert not worker.pull('missing', shard)
+    assert not worker.pull('B', shard)
+    assert time.time() - start < 1
+    assert worker._packages == {}
+
+
+def test_pull_gives_up_once_stopped(tmp_path):
+    worker = _worker(tmp_path, '127.0.0.1:1')
+    worker.stop()
+    assert not worker.pull('A', worker.shards['127.0.0.1:1'])
+
+
+class RecordingServicer(easycrawler_pb2_grpc.EasyCrawlerServiceServicer):
+    """记录收到的结果 id"""
+
+    def __init__(self):
+        self.received = []
+
+    def OnResultBatch(self, request_iterator, context):
+        self.received.extend(result.id for result in request_iterator)
+        return easycrawler_pb2.Result(code=easycrawler_pb2.SUCCESS)
+
+
+def test_unreachable_master_does_not_block_other_results(tmp_path):
+    servicer = RecordingServicer()
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+    easycrawler_pb2_grpc.add_EasyCrawlerServiceServicer_to_server(servicer, server)
+    live = f"127.0.0.1:{server.add_insecure_port('127.0.0.1:0')}"
+    server.start()
+    try:
+        worker = _worker(tmp_path, ['127.0.0.1:1', live])
+        dead = worker.shards['127.0.0.1:1']
+        worker._accept([_meta('a', 'A')], dead)
+        worker._accept([_meta('b', 'B')], worker.shards[live])
+        for client_id, meta_id in (('A', 'a'), ('B', 'b')):
+            result = {'id': meta_id, 'client_id': client_id, 'task': f'{client_id}_t', 'meta': {}, 'items': []}
+            worker._shard(client_id).results.put(result)
+        senders = [threading.Thread(target=worker._send_results, args=(shard,), daemon=True)
+                   for shard in worker.shards.values()]
+        for sender in senders:
+            sender.start()
+        deadline = time.time() + 5
+        while not servicer.received and time.time() < deadline:
+            time.sleep(0.05)
+        assert servicer.received == ['b']
+        # 停止后放弃发往不可用主节点的结果，不再续约，发送线程随之退出
+        worker.stop()
+        worker._stopped = True
+        for sender in senders:
+            sender.join(timeout=5)
+            assert not sender.is_alive()
+        assert worker._leases == set()
+    finally:
+        server.stop(None)
+
+
+def test_pull_declares_only_the_loaded_package(master, tmp_path):
+    install_package(master, str(tmp_path), 'A', {'t_task.py': TASK_SOURCE})
+    worker = _worker(tmp_path, master.address)
+    shard = worker.shards[master.address]
+    assert worker.pull('A', shard) and worker.pull('A', shard)
+    assert master.pulls == [[], [worker._packages['A']]]
+
+
+def test_package_cache_keeps_loaded_and_recent(tmp_path, monkeypatch):
+    monkeypatch.setattr(worker_module, 'MAX_CACHED_PACKAGES', 2)
+    worker = Worker('w', '127.0.0.1:1', worker_dir=str(tmp_path))
+    for i, name in enumerate(['loaded', 'old', 'recent', 'newest']):
+        path = osp.join(worker.package_dir, f'{name}.zip')
+        open(path, 'wb').close()
+        os.utime(path, (i, i))
+    worker._packages['A'] = 'loaded'
+    worker._prune_packages()
+    assert sorted(os.listdir(worker.package_dir)) == ['loaded.zip', 'newest.zip', 'recent.zip']
+
+
+class GateTask(Task):
+    """请求阻塞到 gate 打开，记录同时执行的最大任务数"""
+    name = 'gate'
+    max_threads = 2
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.lock = threading.Lock()
+        self.active = self.peak = 0
+
+    def request(self, meta):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        self.gate.wait(5)
+        with self.lock:
+            self.active -= 1
+        return '{}'
+
+    def process(self, text):
+        return [{'ok': True}]
+
+
+def _load(worker: Worker, shard, client_id: str = 'A') -> GateTask:
+    """直接加载任务，不经过拉取任务包"""
+    task = GateTask()
+    task_key = f'{client_id}_{task.name}'
+    worker.tasks = {task_key: task}
+    worker._task_clients[task_key] = client_id
+    worker._task_slots[task_key] = threading.BoundedSemaphore(task.max_threads)
+    worker._client_shards[client_id] = shard
+    return task
+
+
+def _until(predicate, timeout: float = 5) -> bool:
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_task_slots_cap_concurrency_and_drain_backlog(tmp_path):
+    worker = _worker(tmp_path, '127.0.0.1:1')
+    shard = worker.shards['127.0.0.1:1']
+    task = _load(worker, shard)
+    metas = [_meta(str(i), task='gate') for i in range(5)]
+    worker._accept(metas, shard)
+    for meta in metas:
+        worker._execute(meta)
+    # 超出 max_threads 的任务进入等待队列，不占用线程
+    assert _until(lambda: task.active == 2)
+    assert len(worker._backlog['A_gate']) == 3
+    assert worker._free_capacity(shard) == 0
+    task.gate.set()
+    assert _until(lambda: shard.results.qsize() == 5)
+    assert task.peak == 2
+    assert worker._running_tasks == {'A_gate': 0} and shard.running == 0
+    assert len(worker._backlog['A_gate']) == 0
+
+
+def test_prefetch_depth_follows_latency_and_duration(tmp_path):
+    worker = _worker(tmp_path, '127.0.0.1:1')
+    shard = worker.shards['127.0.0.1:1']
+    task = _load(worker, shard)
+    # 尚无观测数据时预取一个
+    assert worker._prefetch_depth('A_gate', task, shard) == 1
+    worker._durations['A_gate'] = 1.0
+    shard.observe(0.4)
+    assert worker._prefetch_depth('A_gate', task, shard) == 1
+    # 往返时间越长预取越深，至多为 max_threads
+    shard.latency = 10
+    assert worker._prefetch_depth('A_gate', task, shard) == 2
+    assert worker._report(shard)['prefetch'] == {'A_gate': 2}
+    assert worker._report(shard)['capacity'] == {'A_gate': 4}
+    worker.prefetch = False
+    assert worker._prefetch_depth('A_gate', task, shard) == 0
+
+
+def test_stop_returns_prefetched_metas(master, tmp_path):
+    worker = _worker(tmp_path, master.address)
+    shard = worker.shards[master.address]
+    task = _load(worker, shard)
+    metas = [_meta(str(i), task='gate') for i in range(5)]
+    worker._accept(metas, shard)
+    for meta in metas:
+        worker._execute(meta)
+    assert _until(lambda: task.active == 2)
+    worker.stop()
+    # 停止后收到的任务与等待中的任务都不再执行
+    late = _meta('5', task='gate')
+    worker._accept([late], shard)
+    worker._execute(late)
+    task.gate.set()
+    assert _until(lambda: shard.results.qsize() == 2)
+    assert len(worker._backlog['A_gate']) == 4
+    worker._return_prefetched()
+    assert sorted(meta_id for _, meta_id in master.returned) == ['2', '3', '4', '5']
+    assert not any(lease in worker._leases for lease in [('A', '2'), ('A', '5')])
+    assert worker._backlog == {}
+    assert worker._running_tasks == {'A_gate': 0} and shard.running == 0
+    assert shard.results.qsize() == 2